@@ -14,10 +14,27 @@ from os.path import isdir
 import multiprocessing, logging
 import shutil
 import sys
+import re
 import argparse
+import hashlib
+import subprocess
+import socket
+import random
+import gzip
+import tempfile
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 # Local modules
 import spec_flags
+import preproc_cache
+import perf_report
+import runner
+import cluster
+import gcc_bisect
 
 def error(msg):
     '''Output error message to stderr and exit with non-zero exit code'''
@@ -35,6 +52,11 @@ except:
 # SKIP = ['400.perlbench']
 SKIP        = []
 
+# Workload name of the link of a benchmark (bench/LTO_LINK_UNIT)
+LTO_LINK_UNIT   = 'lto-link'
+# Default number of runs of each calibration job (see --calibrate)
+CALIBRATE_RUNS  = 20
+
 # Function aliases
 pexists = os.path.exists
 pjoin   = os.path.join
@@ -44,6 +66,9 @@ SELF_DIR        = os.path.dirname(__file__)
 SPEC_PATH       = pjoin(config.SPEC_PATH, 'benchspec', 'CPU2006')
 ROOT_PATH       = config.WORK_PATH
 SOURCES_YML     = pjoin(SELF_DIR, 'sources.yml')
+# Command lines used for producing each preprocessed file (for incremental
+# preprocessing)
+PREPROC_STAMPS  = pjoin(ROOT_PATH, 'preproc_cmdlines.yml')
 DEFAULT_ALLOC   = 'ptmalloc'
 
 # No-quite-constant. Set once before actual build
@@ -61,12 +86,6 @@ try:
 except:
     error('required package \'pyYAML\' not found')
 
-# Add md5sum program
-try:
-    from sh import md5sum
-except:
-    error('md5sum not found')
-
 
 def perform_sanity_checks(args):
     '''Check that all required binaries and paths exist'''
@@ -95,12 +114,12 @@ def perform_sanity_checks(args):
             error('cc1plus binary does not exist in {}. Please'
                 ' build the C++ compiler'.format(GCC_PATH))
 
-def find_allocator(args):
+def find_allocator(alloc):
     '''Find memory allocator library: search default paths and the
        path specified in ALLOCATORS dictionary in config.'''
 
-    if config.ALLOCATORS[args.alloc]:
-        path = config.ALLOCATORS[args.alloc]
+    if config.ALLOCATORS[alloc]:
+        path = config.ALLOCATORS[alloc]
         if not pexists(path):
             error('file \'{}\' not found. Please set'
                     ' ALLOCATORS correctly in config.py'.format(path))
@@ -111,12 +130,12 @@ def find_allocator(args):
 
             'jemalloc': ['/usr/lib64/libjemalloc.so.1',                   # CentOS, Fedora
                         '/usr/lib/x86_64-linux-gnu/libjemalloc.so.1']}    # Debian, Ubuntu
-    for path in paths[args.alloc]:
+    for path in paths[alloc]:
         if pexists(path):
             return path
 
     error('{} not found. Please set'
-          ' ALLOCATORS manually in config.py'.format(args.alloc))
+          ' ALLOCATORS manually in config.py'.format(alloc))
 
 def find_gcc(args):
     '''Find the directory, which contains the compilers proper'''
@@ -157,15 +176,38 @@ COMPILER_FNAME  = {LANG_C:      'cc1',
 # TODO: support Fortran
 #                  LANG_F:      'f951'}
 
+# GCC drivers (used for LTO)
+DRIVER_FNAME    = {LANG_C:      'gcc',
+                   LANG_CXX:    'g++'}
+BUILD_DRIVER_FNAME = {LANG_C:   'xgcc',
+                      LANG_CXX: 'xg++'}
+
 CLANG_FNAME     = {LANG_C:      'clang',
                    LANG_CXX:    'clang++'}
 
 LANG_BY_PREPROC = {'.i':        LANG_C,
                    '.ii':       LANG_CXX}
+# Extension of compressed preprocessed units (see --compress)
+COMPRESSED_EXT  = runner.COMPRESSED_EXT
+
+def unit_name(fname):
+    '''Name of a preprocessed unit (without the extension of compression)'''
+    return fname[:-len(COMPRESSED_EXT)] if fname.endswith(COMPRESSED_EXT) else fname
+
+def unit_lang(fname):
+    return LANG_BY_PREPROC[os.path.splitext(unit_name(fname))[1]]
+
+def compress_unit(path):
+    '''Replace a preprocessed unit with its compressed version'''
+    with open(path, 'rb') as src:
+        with gzip.open(path + COMPRESSED_EXT, 'wb') as dest:
+            shutil.copyfileobj(src, dest, 1 << 20)
+    os.remove(path)
 
 pjoin = os.path.join
 
 compilers = {}
+compiler_paths = {}
 
 def prepare_compilers_dict(bin_dir, binaries):
     global compilers
@@ -173,61 +215,216 @@ def prepare_compilers_dict(bin_dir, binaries):
         path = pjoin(bin_dir, fname)
         if os.path.exists(path):
             compilers[lang] = sh.Command(path)
+            compiler_paths[lang] = path
             print('{} compiler: \'{}\''.format(lang, path))
         else:
             print('\'{}\' not found!'.format(path))
 
 
-def compile_worker_func(cmd):
-    '''Worker function for child processed in multiprocess run'''
-    full_path, options = cmd
-    fname = os.path.basename(full_path)
-    _, ext = os.path.splitext(fname)
-    if ext not in LANG_BY_PREPROC:
-        return False
-    lang = LANG_BY_PREPROC[ext]
-    compiler = compilers[lang]
-    options.append(full_path)
+HASH_BLOCK = 1 << 16
+
+def staged_command(argv, compressed, staging_dir):
+    '''Decompress compressed input of a command (if any) into a temporary
+       directory. Returns (command, path of the temporary directory or None)'''
+    if compressed is None:
+        return argv, None
+    stage_dir = tempfile.mkdtemp(prefix='stage-', dir=staging_dir)
     try:
-        res = md5sum(compiler(*options))
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        return res.split()[0].strip()
+        return runner.stage_input(argv, compressed, stage_dir), stage_dir
     except:
-        return False
+        shutil.rmtree(stage_dir)
+        raise
+
+def checksum_worker_func(job):
+    '''Worker function for child processes in checksum calculation.
+       Returns (workload, digest, error message)'''
+    workload, argv, compressed, staging_dir = job
+    digest = hashlib.md5()
+    stage_dir = None
+    try:
+        argv, stage_dir = staged_command(argv, compressed, staging_dir)
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE)
+        while True:
+            block = proc.stdout.read(HASH_BLOCK)
+            if not block:
+                break
+            digest.update(block)
+        ret = proc.wait()
+    except (IOError, OSError) as ex:
+        return (workload, None, str(ex))
+    finally:
+        if stage_dir is not None:
+            shutil.rmtree(stage_dir)
+    if ret != 0:
+        return (workload, None, 'compiler exited with code {}'.format(ret))
+    return (workload, digest.hexdigest(), None)
+
+
+def load_manifest(path):
+    '''Load checksums manifest: dictionary workload -> digest'''
+    result = {}
+    with open(path, 'r') as f:
+        for (num, line) in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            parts = line.split(None, 1)
+            if len(parts) != 2:
+                error('{}:{}: invalid manifest line'.format(path, num + 1))
+            digest, workload = parts
+            result[workload] = digest
+    return result
+
+
+def save_manifest(path, checksums):
+    '''Save checksums in md5sum-like format, sorted by workload name'''
+    with open(path, 'w') as f:
+        for workload in sorted(checksums):
+            f.write('{}  {}\n'.format(checksums[workload], workload))
 
 
 def compile_with_checksums(args):
-    # FIXME: 1. Correctly handle options which gen_shell_scripts can handle
-    #        2. Output checksums in some format usable by 'diff'
     '''Compile SPEC and calculate checksum of each compilation unit'''
-    root_dir = pjoin(ROOT_PATH, 'preproc')
-    BASE_OPTIONS = ['-O', '-w', '-quiet', '-o', '-', '-fpreprocessed']
-    for bench in sorted(os.listdir(root_dir)):
-        sys.stdout.write('Compiling {}: '.format(bench))
-        options = BASE_OPTIONS[:] + spec_flags.CRUTCHES.get(bench, [])
-        pool = multiprocessing.Pool() # Default number of workers is equal to num. of CPUs
-        queue = []
-        bench_dir = pjoin(root_dir, bench)
-        for (ind, fname) in enumerate(sorted(os.listdir(bench_dir))):
-            full_path = pjoin(bench_dir, fname)
-            cmd = (full_path, options + ['-frandom-seed=' + str(ind)])
-            queue.append(cmd)
-        try:
-            res = pool.map_async(compile_worker_func, queue, 1)
-            pool.close()
-            pool.join()
-        except:
-            error('Failed to compile '+bench)
-        checksums = res.get()
-        if any(v == False for v in checksums):
-            error('Failed to compile \'{}\' (unknown error in child process)'.format(bench))
-        sys.stdout.write('\n')
-        print(checksums)
+    preproc_dir = pjoin(ROOT_PATH, 'preproc')
+    baseline = load_manifest(args.baseline) if args.baseline else None
+    jobs = []
+    for (bench, units) in list_units(args, preproc_dir):
+        bench_dir = pjoin(preproc_dir, bench)
+        options = ['-w', '-o', '-']
+        if args.clang:
+            options.append('-S')
+        else:
+            options += ['-quiet', '-fpreprocessed']
+        options += spec_flags.CRUTCHES.get(bench, [])
+        for ind, fname in units:
+            lang = unit_lang(fname)
+            tu_path = pjoin(bench_dir, fname)
+            argv = [compiler_paths[lang]] + options
+            if not args.clang:
+                argv.append('-frandom-seed=' + str(ind))
+            argv += opt_flags(args, lang) + [tu_path]
+            compressed = tu_path if fname.endswith(COMPRESSED_EXT) else None
+            jobs.append((os.path.getsize(tu_path), bench + '/' + unit_name(fname), argv,
+                         compressed, args.staging))
+    # Start with the largest (presumably, the longest to compile) units, so
+    # that a few long compilations do not remain at the end
+    jobs.sort(key=lambda job: (-job[0], job[1]))
+
+    print('Compiling {} units using {} jobs'.format(len(jobs), args.jobs))
+    checksums = {}
+    failed = []
+    diverged = []
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        for (workload, digest, msg) in pool.imap_unordered(
+                checksum_worker_func, [job[1:] for job in jobs]):
+            if digest is None:
+                failed.append('{}: {}'.format(workload, msg))
+                break
+            checksums[workload] = digest
+            if baseline is not None and baseline.get(workload) != digest:
+                diverged.append(workload)
+                if args.stop_on_diff:
+                    break
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        pool.terminate()
+        pool.join()
+    except KeyboardInterrupt:
+        pool.terminate()
+        error('interrupted')
+    sys.stdout.write('\n')
+    if failed:
+        error('failed to compile {}'.format(failed[0]))
+
+    if len(checksums) == len(jobs):
+        manifest = args.manifest or pjoin(ROOT_PATH, 'checksums.md5')
+        save_manifest(manifest, checksums)
+        print('Checksums saved to \'{}\''.format(manifest))
+    if baseline is None:
+        return
+    if args.stop_on_diff and diverged:
+        error('code generated for \'{}\' differs from baseline'.format(diverged[0]))
+    missing = sorted(set(baseline) - set(checksums))
+    if args.subset is not None:
+        # Units outside of the subset were not compiled on purpose
+        missing = [workload for workload in missing if workload in args.subset]
+    for workload in sorted(diverged):
+        print('{}: {}'.format('DIFFERS' if workload in baseline else 'NEW', workload))
+    for workload in missing:
+        print('MISSING: {}'.format(workload))
+    if diverged or missing:
+        error('{} unit(s) differ from baseline, {} missing'.format(len(diverged), len(missing)))
+    print('All {} units match the baseline'.format(len(checksums)))
+
+
+def preprocess_worker_func(job):
+    '''Worker function for child processes in parallel preprocessing.
+       Returns None on success or an error message'''
+    lang, src_dir, preproc_full, full_path, options = job
+    compiler = compilers[lang]
+    try:
+        compiler('-E', '-o', preproc_full, full_path, *options, _cwd=src_dir)
+    except Exception as ex:
+        return '{}: {}'.format(full_path, ex)
+    sys.stdout.write('.')
+    sys.stdout.flush()
+    return None
+
+
+def load_preproc_stamps():
+    '''Load command lines used for previous preprocessing runs'''
+    if not pexists(PREPROC_STAMPS):
+        return {}
+    with open(PREPROC_STAMPS, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+
+def save_preproc_stamps(stamps):
+    with open(PREPROC_STAMPS, 'w') as f:
+        yaml.safe_dump(stamps, f, default_flow_style=False)
+
+
+def is_up_to_date(preproc_full, full_path, cmdline, stamps):
+    '''Check whether a preprocessed file can be reused: it must be newer than
+       the source and must have been produced by the same command line'''
+    if stamps.get(preproc_full) != cmdline:
+        return False
+    if not pexists(preproc_full) or not pexists(full_path):
+        return False
+    return os.path.getmtime(preproc_full) >= os.path.getmtime(full_path)
+
+
+def open_preproc_cache(args):
+    '''Create preprocessed sources cache object (None, if disabled)'''
+    if args.no_cache:
+        return None
+    cache_path = getattr(config, 'PREPROC_CACHE_PATH', None) or \
+                 pjoin(ROOT_PATH, 'preproc_cache')
+    try:
+        return preproc_cache.PreprocCache(cache_path, args.cache_size << 20)
+    except preproc_cache.CacheError as ex:
+        error(str(ex))
+
+
+def evict_preproc_cache(cache):
+    if cache is None:
+        return
+    removed = cache.evict()
+    if removed:
+        print('Evicted {} entries from preprocessed sources cache'.format(removed))
 
 
 def preprocess_sources(args):
     data = load_spec_lists()
+    stamps = load_preproc_stamps()
+    cache = open_preproc_cache(args)
+    if cache is not None:
+        compiler_digests = dict((lang, preproc_cache.hash_file(path).hexdigest())
+                                for (lang, path) in compiler_paths.items())
+    new_stamps = {}
+    queue = []
+    cache_keys = []
     for name in sorted(data.keys()):
         props = data[name]
         lang = props['lang']
@@ -235,16 +432,12 @@ def preprocess_sources(args):
         if props['lang'] in [LANG_F, LANG_FC]:
             continue
 
-        compiler = compilers[lang]
         path = pjoin(SPEC_PATH, name, 'src')
         preproc_dir = pjoin(ROOT_PATH, 'preproc', name)
         if not os.path.exists(preproc_dir):
             os.makedirs(preproc_dir)
-        os.chdir(path)
         preproc_ext = '.ii' if props['lang'] == LANG_CXX else '.i'
 
-        print('Preprocessing: {}'.format(name))
-
         defines = ['-D' + x for x in spec_flags.DEFS + spec_flags.OTHER_DEFS.get(name, [])]
         includes = ['-I' + x for x in spec_flags.INCLUDES.get(name, [])]
         options = defines + includes + spec_flags.CRUTCHES.get(name, [])
@@ -253,20 +446,159 @@ def preprocess_sources(args):
         if props['lang'] == LANG_CXX and args.cxx98:
             options.append('-std=c++98')
 
+        skipped = 0
+        cached = 0
         for fname in props['sources']:
             full_path = pjoin(path, fname)
             base, _ = os.path.splitext(fname)
             preproc_name = base.replace('/', '_') + preproc_ext
             preproc_full = pjoin(preproc_dir, preproc_name)
-            # TODO: spawn multiple processes to preprocess faster
-            compiler('-E', '-o', preproc_full, full_path, *options)
+            # The unit is stored either compressed or not: remove the other
+            # form left by a previous run
+            stored, other = preproc_full, preproc_full + COMPRESSED_EXT
+            if args.compress:
+                stored, other = other, stored
+            if pexists(other):
+                os.remove(other)
+            cmdline = ' '.join([compiler_paths[lang], '-E', full_path] + options)
+            new_stamps[stored] = cmdline
+            if is_up_to_date(stored, full_path, cmdline, stamps):
+                skipped += 1
+                continue
+            if cache is not None:
+                key = cache.make_key(compiler_digests[lang], options, full_path)
+                if cache.get(key, preproc_full):
+                    if args.compress:
+                        compress_unit(preproc_full)
+                    cached += 1
+                    continue
+                cache_keys.append(key)
+            queue.append((lang, path, preproc_full, full_path, options))
+        print('Preprocessing: {} ({} of {} up to date, {} from cache)'.format(
+                    name, skipped, len(props['sources']), cached))
+
+    if not queue:
+        save_preproc_stamps(new_stamps)
+        evict_preproc_cache(cache)
+        print('Nothing to do')
+        return
+    print('Preprocessing {} files using {} jobs'.format(len(queue), args.jobs))
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        results = pool.map_async(preprocess_worker_func, queue, 1).get()
+        pool.close()
+        pool.join()
+    except KeyboardInterrupt:
+        pool.terminate()
+        error('interrupted')
+    sys.stdout.write('\n')
+
+    # Do not record stamps of failed units, so that they are redone next time
+    failed = []
+    done = set()
+    for ind, ((_, _, preproc_full, _, _), res) in enumerate(zip(queue, results)):
+        if res is not None:
+            failed.append(res)
+            new_stamps.pop(preproc_full + COMPRESSED_EXT if args.compress else preproc_full,
+                           None)
+            continue
+        if cache is not None:
+            cache.put(cache_keys[ind], preproc_full)
+        done.add(preproc_full)
+    if args.compress:
+        for preproc_full in sorted(done):
+            compress_unit(preproc_full)
+    save_preproc_stamps(new_stamps)
+    evict_preproc_cache(cache)
+    if failed:
+        error('failed to preprocess {} file(s):\n{}'.format(len(failed), '\n'.join(failed)))
+
+def load_subset(path):
+    '''Read names of units (bench/file) from a subset file written by
+       select_subset.py: CSV file with the "name" column first (lines starting
+       with '#' are comments)'''
+    names = set()
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            name = line.split(',', 1)[0].strip().strip('"')
+            if name != 'name':
+                names.add(name)
+    return names
+
+def list_units(args, preproc_dir):
+    '''Preprocessed units to compile: list of (bench, [(ind, fname)]), where
+       ind is the index of the unit among all units of the benchmark (used for
+       -frandom-seed, so that a subset is compiled in the same way as the
+       whole benchmark). fname is the name of the file, i.e. it ends with
+       COMPRESSED_EXT, if the unit is compressed. With --subset only units from
+       the subset are listed'''
+    result = []
+    found = set()
+    for bench in sorted(os.listdir(preproc_dir)):
+        # Sort by unit name, so that indices do not depend on compression
+        units = list(enumerate(sorted(os.listdir(pjoin(preproc_dir, bench)), key=unit_name)))
+        if args.subset is not None:
+            units = [(ind, fname) for (ind, fname) in units
+                     if bench + '/' + unit_name(fname) in args.subset]
+            found.update(bench + '/' + unit_name(fname) for (_, fname) in units)
+            if not units:
+                continue
+        result.append((bench, units))
+    if args.subset is not None and found != args.subset:
+        missing = sorted(args.subset - found)
+        error('{} unit(s) of the subset not found in preprocessed sources: {}'.format(
+                len(missing), ', '.join(missing[:10])))
+    return result
+
+def compile_options(args, bench):
+    '''Options for compiling a preprocessed unit of a benchmark (except
+       for the optimization options)'''
+    options = ['-o', '/dev/null', '-w']
+    if args.clang:
+        options.append('-S' if args.asm else '-c')
+    else:
+        options += ['-quiet', '-fpreprocessed']
+        if args.mem_report:
+            options.append('-fmem-report')
+        if args.time_report:
+            options.append('-ftime-report')
+    return options + spec_flags.CRUTCHES.get(bench, [])
+
+def unit_argv(args, path, bench, ind, lang, tu_path, optimization=None):
+    '''Command of a timed compilation of a preprocessed unit (ind is its index
+       in the benchmark, see list_units)'''
+    argv = [path] + compile_options(args, bench)
+    if not args.clang:
+        argv.append('-frandom-seed=' + str(ind))
+    return argv + opt_flags(args, lang, optimization) + [tu_path]
+
+def opt_flags(args, lang, optimization=None):
+    '''Optimization options (i.e. CFLAGS or CXXFLAGS). optimization - options
+       in the format of -O (default: args.optimization)'''
+    flags = ['-' + opt for opt in (optimization or args.optimization).split()]
+    if lang == LANG_CXX and args.cxx98:
+        flags.append('-std=c++98')
+    return flags
 
 def wrap_bind_aff_sched(args, cmd):
     return INVOKE_PREFIX + cmd
 
 def wrap_perf(args, cmd, log_path):
+    if args.time_report:
+        # Results are appended to the log by wrap_report
+        return 'perf stat -d -x, -o "$PERF_OUT" {}'.format(cmd)
     return 'perf stat -d -x, -o {} --append {}'.format(log_path, cmd)
 
+def wrap_report(args, cmd, log_path):
+    '''Capture compiler reports: compiler stderr is saved into a temporary
+       file (created by build.sh), then appended to the log (each line is
+       prefixed with REPORT_PREFIX) followed by perf output'''
+    return '{0} 2> "$REPORT_OUT"\n' \
+           'sed \'s/^/{1} /\' "$REPORT_OUT" >> {2}\n' \
+           'cat "$PERF_OUT" >> {2}\n'.format(cmd, perf_report.REPORT_PREFIX, log_path)
+
 def gen_shell_scripts(args):
     if args.clang:
         compiler_path_var = {LANG_C:    '$CC',
@@ -293,10 +625,9 @@ def gen_shell_scripts(args):
         top_script.write('export CC=\'{0}/clang\'\nexport CXX=\'{0}/clang++\'\n'.format(CLANG_PATH))
     else:
         top_script.write('export CC1=\'{0}/cc1\'\nexport CC1PLUS=\'{0}/cc1plus\'\n'.format(GCC_PATH))
-    opt_flags = ' '.join(['-' + opt for opt in args.optimization.split()])
-    cxx_flags = ' -std=c++98' if args.cxx98 else ''
-    top_script.write('export CFLAGS=\'{0}\'\n'
-                     'export CXXFLAGS=\'{0}{1}\'\n'.format(opt_flags, cxx_flags))
+    top_script.write('export CFLAGS=\'{}\'\n'
+                     'export CXXFLAGS=\'{}\'\n'.format(' '.join(opt_flags(args, LANG_C)),
+                                                      ' '.join(opt_flags(args, LANG_CXX))))
 
     if args.alloc != DEFAULT_ALLOC:
         top_script.write('export LD_PRELOAD=\'{}\'\n'.format(ALLOCATOR))
@@ -304,30 +635,39 @@ def gen_shell_scripts(args):
     invoke_prefix = INVOKE_PREFIX
     log_path = '"$1"'
     top_script.write('rm -f {}\n'.format(log_path))
+    all_units = list_units(args, preproc_dir)
+    cleanup = []
+    if args.time_report:
+        top_script.write('export PERF_OUT="$(mktemp)"\n'
+                         'export REPORT_OUT="$(mktemp)"\n')
+        cleanup.append('rm -f "$PERF_OUT" "$REPORT_OUT"')
+    # Compressed units are decompressed into a staging directory before the
+    # timed command (keeping the name of the unit, see runner.staged_name)
+    if any(fname.endswith(COMPRESSED_EXT) for (_, units) in all_units for (_, fname) in units):
+        top_script.write('export STAGE_DIR="$(mktemp -d{})"\n'.format(
+                         ' -p \'{}\''.format(args.staging) if args.staging else ''))
+        cleanup.append('rm -rf "$STAGE_DIR"')
+    if cleanup:
+        top_script.write('trap \'{}\' EXIT\n'.format('; '.join(cleanup)))
     prefix1 = 'time ' if args.verbose else ''
-    for bench in sorted(os.listdir(preproc_dir)):
+    for (bench, units) in all_units:
         dest_path = pjoin(output_dir, bench + '.sh')
         dest = open(dest_path, 'w')
         dest.write('#!/bin/bash -e\n')
         bench_dir = pjoin(preproc_dir, bench)
-        options = ['-o', '/dev/null', '-w']
-        if args.clang:
-            options.append('-S' if args.asm else '-c')
-        else:
-            options += ['-quiet', '-fpreprocessed']
-            if args.mem_report:
-                options.append('-fmem-report')
-                args.verbose = True
-        options += spec_flags.CRUTCHES.get(bench, [])
-        options = ' '.join(options)
-        fnames = os.listdir(bench_dir)
+        options = ' '.join(compile_options(args, bench))
         MARK_STEP = 0.1
         next_mark = MARK_STEP
-        for ind, fname in enumerate(sorted(fnames)):
-            lang = LANG_BY_PREPROC[os.path.splitext(fname)[1]]
+        for (unit_ind, (ind, fname)) in enumerate(units):
+            lang = unit_lang(fname)
             path_var = compiler_path_var[lang]
             flags_var = compiler_flags_var[lang]
             tu_path = pjoin(bench_dir, fname)
+            if fname.endswith(COMPRESSED_EXT):
+                staged_path = '"$STAGE_DIR/{}"'.format(unit_name(fname))
+                dest.write('rm -f "$STAGE_DIR"/*\n')
+                dest.write('gzip -dc {} > {}\n'.format(tu_path, staged_path))
+                tu_path = staged_path
             cmd_parts = [path_var, options]
             if not args.clang:
                 cmd_parts.append('-frandom-seed=' + str(ind))
@@ -335,20 +675,23 @@ def gen_shell_scripts(args):
             cmd = ' '.join(cmd_parts)
             cmd = wrap_perf(args, cmd, log_path)
             cmd = wrap_bind_aff_sched(args, cmd)
-            cmd += ' 2>&1\n'
+            if args.time_report:
+                cmd = wrap_report(args, cmd, log_path)
+            else:
+                cmd += ' 2>&1\n'
             workload_cmd = 'echo \'# WORKLOAD: {}/{}\' >> {}\n'.format(
-                                bench, fname, log_path)
+                                bench, unit_name(fname), log_path)
             if args.repeat > 1:
                 dest.write('for i in {{1..{}}}; do\n'.format(args.repeat))
                 dest.write('    ' + workload_cmd)
-                dest.write('    ' + cmd)
+                dest.write(''.join('    ' + line + '\n' for line in cmd.splitlines()))
                 dest.write('done\n')
             else:
                 dest.write(workload_cmd + cmd)
             if args.verbose:
                 dest.write('echo \'# {}\'\n'.format(fname))
             else:
-                pos = float(ind) / len(fnames)
+                pos = float(unit_ind) / len(units)
                 if pos >= next_mark:
                     mark = '[ {:.1%} ].'.format(pos)
                     next_mark += MARK_STEP
@@ -366,6 +709,531 @@ def gen_shell_scripts(args):
     os.chmod(pjoin(output_dir, 'build.sh'), perm)
     print('Done!')
 
+def compiler_env(args, alloc=None):
+    '''Environment of timed compilations. alloc - allocator (default:
+       args.alloc)'''
+    env = dict(os.environ)
+    alloc = alloc or args.alloc
+    if alloc != DEFAULT_ALLOC:
+        env['LD_PRELOAD'] = ALLOCATOR if alloc == args.alloc else find_allocator(alloc)
+    return env
+
+def timed_jobs(args, paths=None, optimization=None):
+    '''Timed compilations of preprocessed units (list of runner.Job). paths -
+       dictionary: language -> compiler (default: compiler_paths),
+       optimization - see opt_flags'''
+    if paths is None:
+        paths = compiler_paths
+    preproc_dir = pjoin(ROOT_PATH, 'preproc')
+    jobs = []
+    for (bench, units) in list_units(args, preproc_dir):
+        bench_dir = pjoin(preproc_dir, bench)
+        for ind, fname in units:
+            lang = unit_lang(fname)
+            tu_path = pjoin(bench_dir, fname)
+            argv = unit_argv(args, paths[lang], bench, ind, lang, tu_path, optimization)
+            compressed = tu_path if fname.endswith(COMPRESSED_EXT) else None
+            jobs += [runner.Job(bench + '/' + unit_name(fname), argv, rep, compressed=compressed)
+                     for rep in range(args.repeat)]
+    return jobs
+
+def journal_config(args):
+    '''Configuration recorded in the journal of a --journal run: compilers,
+       options and allocator (the number of repeats may change on resume)'''
+    return ' '.join(sorted(compiler_paths.values()) +
+                    compile_options(args, None) + opt_flags(args, LANG_CXX) +
+                    ['alloc=' + args.alloc])
+
+def open_journal(args, log_path):
+    '''Open the journal and the log of a --journal run. Returns (journal, log)'''
+    journal_path = log_path + '.journal'
+    try:
+        journal = runner.Journal(journal_path, journal_config(args))
+    except (runner.RunnerError, IOError, ValueError) as ex:
+        error('failed to load journal: {}'.format(ex))
+    log_size = os.path.getsize(log_path) if pexists(log_path) else 0
+    if log_size < journal.log_size:
+        error('log \'{}\' is shorter than recorded in the journal \'{}\''.format(
+                log_path, journal_path))
+    log = open(log_path, 'a')
+    # Discard the incomplete result written by the interrupted run (if any)
+    log.truncate(journal.log_size)
+    if journal.done:
+        print('Resuming the run: {} compilations done, {} failed before'.format(
+                len(journal.done), len(journal.failed)))
+    return journal, log
+
+def calibrate(args, bench_runner, log):
+    '''Measure the fixed cost of a timed compilation (the compiler run on an
+       empty unit of each language through the same wrappers) and write it
+       into the header of the log as OVERHEAD markers'''
+    unit_dir = tempfile.mkdtemp(prefix='calibrate-', dir=args.staging)
+    jobs = []
+    try:
+        for (ext, lang) in sorted(LANG_BY_PREPROC.items()):
+            unit_path = pjoin(unit_dir, 'empty' + ext)
+            open(unit_path, 'w').close()
+            argv = [compiler_paths[lang]] + compile_options(args, None)
+            if not args.clang:
+                argv.append('-frandom-seed=0')
+            jobs.append(runner.Job(ext, argv + opt_flags(args, lang) + [unit_path]))
+        print('Calibrating: running {} compilations of empty units'.format(
+                len(jobs) * args.calibrate))
+        try:
+            overhead = bench_runner.calibrate(jobs, args.calibrate)
+        except runner.RunnerError as ex:
+            error(str(ex))
+    finally:
+        shutil.rmtree(unit_dir)
+    for (ext, values) in sorted(overhead.items()):
+        log.write('# OVERHEAD: {} {}\n'.format(ext, perf_report.format_config(values)))
+        task_clock = dict(values).get('task-clock')
+        if task_clock is not None:
+            print('Overhead of {} units: {} msec (task-clock)'.format(ext, task_clock))
+    log.flush()
+
+def build_malloc_count(args):
+    '''Build the memory allocation counting shim (malloc_count.c) in the
+       working directory, if it is missing or outdated. Returns its path'''
+    src_path = pjoin(SELF_DIR, 'malloc_count.c')
+    lib_path = pjoin(ROOT_PATH, 'malloc_count.so')
+    if pexists(lib_path) and os.path.getmtime(lib_path) >= os.path.getmtime(src_path):
+        return lib_path
+    argv = [os.environ.get('CC', 'cc'), '-shared', '-fPIC', '-O2', '-o', lib_path,
+            src_path, '-ldl']
+    print('Building \'{}\''.format(lib_path))
+    try:
+        ret = subprocess.call(argv)
+    except OSError as ex:
+        error('failed to run C compiler: {}'.format(ex))
+    if ret != 0:
+        error('failed to build \'{}\''.format(lib_path))
+    return lib_path
+
+# Settings of a --workers run, which are sent to the workers: they build the
+# commands of timed compilations from them (see worker_job_builder)
+REMOTE_SETTINGS = ['optimization', 'cxx98', 'mem_report', 'time_report']
+# Optimization options accepted by workers. Other options (and the unsafe
+# ones below) could make the compiler load plugins, run other programs or
+# write files, and workers run compilations as root
+REMOTE_OPT_RE = re.compile(r'^(O[0-3gsz]?|Ofast|g[0-3]?|w|W[a-z0-9][a-z0-9=-]*|'
+                           r'std=[a-z0-9+]+|[fm][a-z0-9][a-z0-9_.,=+-]*)$')
+REMOTE_UNSAFE_OPTS = ('fplugin', 'fprofile', 'fauto-profile', 'fbranch-probabilities',
+                      'fdump', 'fopt-info', 'fcallgraph-info', 'fstack-usage', 'fsave',
+                      'ftest-coverage', 'fcoverage', 'fmodule', 'frandom-seed',
+                      'fdebug-prefix-map', 'ffile-prefix-map', 'fmacro-prefix-map')
+
+def check_remote_optimization(optimization):
+    '''Check optimization options (in the format of -O) received from a
+       coordinator. Raises cluster.ClusterError'''
+    for opt in optimization.split():
+        if not REMOTE_OPT_RE.match(opt) or opt.startswith(REMOTE_UNSAFE_OPTS):
+            raise cluster.ClusterError('option \'-{}\' is not allowed on workers'.format(opt))
+
+def worker_job_builder(args):
+    '''Job builder of a worker (see cluster.Worker): commands are built in the
+       same way as for local runs, using the settings of the coordinator
+       (validated) and the preprocessed sources of the worker'''
+    preproc_dir = pjoin(ROOT_PATH, 'preproc')
+    def build(settings):
+        if sorted(settings) != sorted(REMOTE_SETTINGS):
+            raise cluster.ClusterError('unexpected settings (different versions of'
+                                       ' build_spec.py?)')
+        opt = settings['optimization']
+        if not isinstance(opt, type(u'')) or not opt.strip():
+            raise cluster.ClusterError('malformed optimization options')
+        check_remote_optimization(opt)
+        run_args = argparse.Namespace(**vars(args))
+        run_args.optimization = str(opt)
+        run_args.subset = None
+        for key in ['cxx98', 'mem_report', 'time_report']:
+            setattr(run_args, key, settings[key] is True)
+        if args.clang and (run_args.mem_report or run_args.time_report):
+            raise cluster.ClusterError('compiler reports are supported only with GCC')
+        # workload -> (benchmark, index, file name)
+        units = {}
+        for (bench, bench_units) in list_units(run_args, preproc_dir):
+            for (ind, fname) in bench_units:
+                units[bench + '/' + unit_name(fname)] = (bench, ind, fname)
+        def make_job(workload):
+            if workload not in units:
+                raise cluster.ClusterError('unit \'{}\' not found'.format(workload))
+            bench, ind, fname = units[workload]
+            lang = unit_lang(fname)
+            tu_path = pjoin(preproc_dir, bench, fname)
+            argv = unit_argv(run_args, compiler_paths[lang], bench, ind, lang, tu_path)
+            return argv, tu_path if fname.endswith(COMPRESSED_EXT) else None
+        return make_job
+    return build
+
+def load_secret(args):
+    '''Shared secret of workers and coordinators (None if not configured)'''
+    if args.secret_file is None:
+        return None
+    try:
+        return cluster.load_secret(args.secret_file)
+    except (cluster.ClusterError, IOError) as ex:
+        error(str(ex))
+
+def run_on_workers(args, jobs, log_path):
+    '''Distribute timed compilations among worker hosts (see --serve)'''
+    try:
+        addresses = [cluster.parse_address(addr) for addr in args.workers.split(',')]
+        known = cluster.load_costs(args.costs) if args.costs else {}
+        check_remote_optimization(args.optimization)
+    except (cluster.ClusterError, IOError, perf_report.ReportError) as ex:
+        error(str(ex))
+    settings = dict((key, getattr(args, key)) for key in REMOTE_SETTINGS)
+    secret = load_secret(args)
+    costs = cluster.estimate_costs(jobs, known)
+    print('Running {} compilations on {} worker(s), writing results to \'{}\''.format(
+            len(jobs), len(addresses), log_path))
+    with open(log_path, 'w') as log:
+        try:
+            cluster.Coordinator(addresses, log, args.alloc, settings, args.verbose,
+                                secret).run(jobs, costs)
+        except cluster.ClusterError as ex:
+            error(str(ex))
+    print('Done!')
+
+def sweep_configs(args):
+    '''Configurations of a --sweep-* run: the cartesian product of
+       optimization options, allocators and compilers. Returns list of
+       (config, paths, optimization, env), where config is the list of
+       (key, value) pairs written into the log (see runner.Job)'''
+    opts = args.sweep_opt or [args.optimization]
+    allocs = args.sweep_alloc or [args.alloc]
+    compilers = []
+    for spec in args.sweep_gcc or []:
+        label, sep, path = spec.partition('=')
+        if not sep:
+            label = path = spec
+        compilers.append((label, resolve_build(args, path)))
+    if not compilers:
+        compilers = [(CLANG_PATH if args.clang else GCC_PATH, compiler_paths)]
+    labels = [('opt', ['_'.join(opt.split()) for opt in opts]),
+              ('alloc', allocs), ('compiler', [label for (label, _) in compilers])]
+    for (key, values) in labels:
+        if len(set(values)) != len(values):
+            error('duplicate values in --sweep-{}'.format('gcc' if key == 'compiler' else key))
+        for value in values:
+            if not value or any(c.isspace() or c in ',"' for c in value):
+                error('invalid {} label \'{}\' (labels can not contain whitespace,'
+                      ' commas and quotes)'.format(key, value))
+    envs = dict((alloc, compiler_env(args, alloc)) for alloc in allocs)
+    configs = []
+    for (opt, opt_label) in zip(opts, labels[0][1]):
+        for alloc in allocs:
+            for (label, paths) in compilers:
+                config = [('opt', opt_label), ('alloc', alloc), ('compiler', label)]
+                configs.append((config, paths, opt, envs[alloc]))
+    return configs
+
+def sweep_jobs(args, configs):
+    '''Schedule of a --sweep-* run: all the configurations compile the same
+       preprocessed units; each repeat of each unit is compiled with every
+       configuration in a random order (so that slow drift of the machine
+       state affects all the configurations equally), then the next one'''
+    per_config = [timed_jobs(args, paths, opt) for (_, paths, opt, _) in configs]
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    print('Sweeping {} configurations, schedule seed {}'.format(len(configs), seed))
+    rng = random.Random(seed)
+    jobs = []
+    order = list(range(len(configs)))
+    for ind in range(len(per_config[0])):
+        rng.shuffle(order)
+        for c in order:
+            job = per_config[c][ind]
+            config, _, _, env = configs[c]
+            jobs.append(runner.Job(job.workload, job.argv, job.repeat, env, config,
+                                   job.compressed))
+    return jobs
+
+def run_benchmarks(args):
+    '''Perform timed compilation in parallel on several CPUs'''
+    if args.sweep_opt or args.sweep_alloc or args.sweep_gcc:
+        jobs = sweep_jobs(args, sweep_configs(args))
+    else:
+        jobs = timed_jobs(args)
+    log_path = args.log or pjoin(ROOT_PATH, 'log.txt')
+    if args.workers:
+        run_on_workers(args, jobs, log_path)
+        return
+    try:
+        cpus = runner.parse_cpu_list(args.cpus)
+    except runner.RunnerError as ex:
+        error(str(ex))
+    env = compiler_env(args)
+    count_malloc = build_malloc_count(args) if args.count_malloc else None
+
+    policy = None
+    summary = None
+    if args.adaptive:
+        policy = runner.AdaptivePolicy(args.adaptive_counter, args.rel_ci / 100.0,
+                                       args.min_repeat, args.max_repeat)
+        summary_path = log_path + '.repeats.csv'
+        summary = open(summary_path, 'w')
+        print('Repeating each compilation until {} is measured with +-{}% accuracy'
+              ' ({} to {} times), see \'{}\''.format(args.adaptive_counter, args.rel_ci,
+              args.min_repeat, args.max_repeat, summary_path))
+    journal = None
+    if args.journal:
+        journal, log = open_journal(args, log_path)
+        jobs = [job for job in jobs if not journal.is_done(job)]
+    else:
+        log = open(log_path, 'w')
+    print('Running {} compilations on CPU(s) {}, writing results to \'{}\''.format(
+            len(jobs), ','.join(str(cpu) for cpu in cpus), log_path))
+    with log:
+        bench_runner = runner.Runner(cpus, log, env, args.verbose, policy, summary,
+                                     capture_report=args.time_report, journal=journal,
+                                     count_malloc=count_malloc, staging_dir=args.staging)
+        # A resumed run keeps the header written by the first one
+        if args.calibrate and (journal is None or journal.log_size == 0):
+            calibrate(args, bench_runner, log)
+        try:
+            bench_runner.run(jobs)
+        except runner.RunnerError as ex:
+            error(str(ex))
+        finally:
+            if summary is not None:
+                summary.close()
+            if journal is not None:
+                journal.close()
+    if bench_runner.failed:
+        print('{} compilation(s) failed, see \'{}\' (run again to retry them)'.format(
+                len(bench_runner.failed), journal.path))
+        for (job, reason) in bench_runner.failed[:10]:
+            print('  {} (repeat {}): {}'.format(job.workload, job.repeat, reason))
+        sys.exit(1)
+    print('Done!')
+
+def find_drivers(args):
+    '''GCC drivers used by --lto: dictionary language -> command prefix. The
+       drivers of the build directory (xgcc, xg++) are used, if GCC_PATH is
+       one, otherwise gcc and g++ from GCC_ROOT_PATH. -B makes the drivers
+       run cc1, cc1plus and lto1 from GCC_PATH'''
+    prefix = '-B' + pjoin(GCC_PATH, '')
+    if not pexists(pjoin(GCC_PATH, 'lto1')):
+        error('lto1 binary does not exist in {}. Please build GCC'
+              ' with LTO support'.format(GCC_PATH))
+    if pexists(pjoin(GCC_PATH, BUILD_DRIVER_FNAME[LANG_C])):
+        return dict((lang, [pjoin(GCC_PATH, fname), prefix])
+                    for (lang, fname) in BUILD_DRIVER_FNAME.items())
+    if config.GCC_ROOT_PATH is None:
+        error('GCC_ROOT_PATH not set in config.py (required for --lto)')
+    drivers = {}
+    for (lang, fname) in DRIVER_FNAME.items():
+        path = pjoin(config.GCC_ROOT_PATH, 'bin', fname)
+        if not pexists(path):
+            error('\'{}\' not found. Please set GCC_ROOT_PATH correctly'
+                  ' in config.py'.format(path))
+        drivers[lang] = [path, prefix]
+    return drivers
+
+def lto_compile_worker_func(job):
+    '''Worker function for child processes compiling LTO objects.
+       Returns (workload, error message)'''
+    workload, argv, compressed, staging_dir = job
+    stage_dir = None
+    try:
+        argv, stage_dir = staged_command(argv, compressed, staging_dir)
+        ret = subprocess.call(argv)
+    except (IOError, OSError) as ex:
+        return (workload, str(ex))
+    finally:
+        if stage_dir is not None:
+            shutil.rmtree(stage_dir)
+    return (workload, None if ret == 0 else 'compiler exited with code {}'.format(ret))
+
+def lto_links(args):
+    '''Compile the units of each benchmark into LTO objects (in parallel,
+       not timed), then perform timed links (WPA and LTRANS stages) of each
+       benchmark with each -flto=N'''
+    try:
+        cpus = runner.parse_cpu_list(args.cpus)
+    except runner.RunnerError as ex:
+        error(str(ex))
+    drivers = find_drivers(args)
+    preproc_dir = pjoin(ROOT_PATH, 'preproc')
+    obj_root = pjoin(ROOT_PATH, 'lto_objs')
+    compile_jobs = []
+    links = []
+    for (bench, units) in list_units(args, preproc_dir):
+        obj_dir = pjoin(obj_root, bench)
+        if not isdir(obj_dir):
+            os.makedirs(obj_dir)
+        objs = []
+        langs = set()
+        for ind, fname in units:
+            lang = unit_lang(fname)
+            tu_path = pjoin(preproc_dir, bench, fname)
+            obj_path = pjoin(obj_dir, os.path.splitext(unit_name(fname))[0] + '.o')
+            argv = drivers[lang] + ['-c', '-w', '-flto', '-frandom-seed=' + str(ind)]
+            argv += spec_flags.CRUTCHES.get(bench, []) + opt_flags(args, lang)
+            argv += ['-o', obj_path, tu_path]
+            compressed = tu_path if fname.endswith(COMPRESSED_EXT) else None
+            compile_jobs.append((bench + '/' + unit_name(fname), argv, compressed, args.staging))
+            objs.append(obj_path)
+            langs.add(lang)
+        # C++ benchmarks are linked by g++ (it adds libstdc++)
+        links.append((bench, LANG_CXX if LANG_CXX in langs else LANG_C, objs))
+
+    print('Compiling {} units into LTO objects in \'{}\' using {} jobs'.format(
+            len(compile_jobs), obj_root, args.jobs))
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        for (workload, msg) in pool.imap_unordered(lto_compile_worker_func, compile_jobs):
+            if msg is not None:
+                pool.terminate()
+                error('failed to compile {}: {}'.format(workload, msg))
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        pool.close()
+        pool.join()
+    except KeyboardInterrupt:
+        pool.terminate()
+        error('interrupted')
+    sys.stdout.write('\n')
+
+    jobs = []
+    link_flags = args.link_flags.split()
+    for rep in range(args.repeat):
+        for (bench, lang, objs) in links:
+            exe_path = pjoin(obj_root, bench, bench + '.exe')
+            for n in args.lto_jobs:
+                argv = drivers[lang] + ['-flto={}'.format(n), '-w'] + opt_flags(args, lang)
+                argv += ['-o', exe_path] + objs + link_flags
+                jobs.append(runner.Job(bench + '/' + LTO_LINK_UNIT, argv, rep,
+                                       config=[('flto', n)]))
+    if max(args.lto_jobs) > len(cpus):
+        print('Warning: -flto={} uses more jobs than the {} CPU(s) given by'
+              ' --cpus'.format(max(args.lto_jobs), len(cpus)))
+    log_path = args.log or pjoin(ROOT_PATH, 'lto_log.txt')
+    print('Running {} links on CPU(s) {}, writing results to \'{}\''.format(
+            len(jobs), args.cpus, log_path))
+    with open(log_path, 'w') as log:
+        # A single link at a time, bound to all the CPUs (LTRANS runs in
+        # parallel)
+        link_runner = runner.Runner([args.cpus], log, compiler_env(args), args.verbose,
+                                    wall_time=True)
+        try:
+            link_runner.run(jobs)
+        except runner.RunnerError as ex:
+            error(str(ex))
+    print('Done!')
+
+def load_build_list(path):
+    '''Read the list of builds for --bisect: one directory (or revision, if
+       --build-command is used) per line, lines starting with '#' are
+       comments'''
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+def resolve_build(args, label):
+    '''Directory of the build: the label itself or the last line printed by
+       --build-command'''
+    path = label
+    if args.build_command:
+        if '{}' in args.build_command:
+            cmd = args.build_command.replace('{}', label)
+        else:
+            cmd = '{} {}'.format(args.build_command, label)
+        print('Running \'{}\''.format(cmd))
+        try:
+            output = subprocess.check_output(cmd, shell=True).decode()
+        except subprocess.CalledProcessError as ex:
+            error('build command failed with exit code {}'.format(ex.returncode))
+        lines = [line.strip() for line in output.splitlines() if line.strip()]
+        if not lines:
+            error('build command printed no directory for {}'.format(label))
+        path = lines[-1]
+    paths = dict((lang, pjoin(path, fname)) for (lang, fname) in COMPILER_FNAME.items())
+    for compiler in paths.values():
+        if not pexists(compiler):
+            error('\'{}\' not found (build {})'.format(compiler, label))
+    return paths
+
+def bisect_builds(args):
+    '''Find the first build (of an ordered list), which compiles the units of
+       the subset slower than the first build'''
+    try:
+        labels = load_build_list(args.bisect)
+        cpus = runner.parse_cpu_list(args.cpus)
+    except (IOError, runner.RunnerError) as ex:
+        error(str(ex))
+    if len(labels) < 2:
+        error('at least two builds are required for bisection')
+    env = compiler_env(args)
+    log_path = args.log or pjoin(ROOT_PATH, 'bisect_log.txt')
+    log = open(log_path, 'w')
+    builds = [gcc_bisect.Build(label) for label in labels]
+    jobs = {}
+
+    def measure(build):
+        '''A round of measurement: compile each unit once, return the sum of
+           the counter'''
+        if build.label not in jobs:
+            jobs[build.label] = timed_jobs(args, resolve_build(args, build.label))
+        output = StringIO()
+        try:
+            runner.Runner(cpus, output, env, args.verbose,
+                          staging_dir=args.staging).run(jobs[build.label])
+        except runner.RunnerError as ex:
+            error('{}: {}'.format(build.label, ex))
+        output = output.getvalue()
+        log.write('# BUILD: {}\n'.format(build.label))
+        log.write(output)
+        log.flush()
+        total = 0
+        for run in perf_report.iter_runs(output.splitlines()):
+            value = run.get_value(args.adaptive_counter)
+            if value is None:
+                error('\'{}\' not measured'.format(args.adaptive_counter))
+            total += value
+        return total
+
+    print('Bisecting {} builds using {} unit(s), writing measurements to \'{}\''.format(
+            len(builds), len(args.subset), log_path))
+    bisector = gcc_bisect.Bisector(builds, measure, args.min_repeat, args.max_repeat,
+                                   args.confidence / 100.0)
+    try:
+        with log:
+            last_good, first_bad = bisector.run()
+    except gcc_bisect.BisectError as ex:
+        error(str(ex))
+    print('First bad build: {} (last good build: {})'.format(
+            builds[first_bad].label, builds[last_good].label))
+    print('{:<40} {:>8} {:>7} {:>14} {:>8}'.format('build', 'verdict', 'rounds',
+                                                  args.adaptive_counter, 'change'))
+    base = builds[0].mean()
+    for build in builds:
+        if build.samples:
+            print('{:<40} {:>8} {:>7} {:>14.6g} {:>+8.1%}'.format(
+                    build.label, build.verdict or '', len(build.samples), build.mean(),
+                    build.mean() / base - 1))
+
+def serve_benchmarks(args):
+    '''Run timed compilations on behalf of a coordinator (build_spec.py --run
+       --workers ...) on the local CPUs'''
+    try:
+        cpus = runner.parse_cpu_list(args.cpus)
+        address = cluster.parse_address(args.listen)
+    except (runner.RunnerError, cluster.ClusterError) as ex:
+        error(str(ex))
+    secret = load_secret(args)
+    if secret is None and address[0] not in cluster.LOOPBACK_HOSTS:
+        error('--secret-file is required to listen on \'{}\''.format(address[0]))
+    count_malloc = build_malloc_count(args) if args.count_malloc else None
+    worker = cluster.Worker(address, cpus, compiler_env(args), args.alloc,
+                            worker_job_builder(args), args.verbose, count_malloc, secret)
+    try:
+        worker.serve_forever()
+    except socket.error as ex:
+        error('failed to listen on {}:{}: {}'.format(address[0], address[1], ex))
+    except KeyboardInterrupt:
+        print('Stopped')
+
 def main():
     parser = argparse.ArgumentParser(description=
 '''This script compiles or preprocesses SPEC CPU2006 benchmark sources
@@ -378,19 +1246,110 @@ affect codegen)''')
     action_grp.add_argument('--preprocess', action='store_const', const=preprocess_sources,
                         dest='action', help='preprocess SPEC CPU2006 sources')
 
-# FIXME: see comments in compile_with_checksums
-#    action_grp.add_argument('--checksums', action='store_const', const=compile_with_checksums,
-#                        dest='action', help='compile proceprocessed sources and calculate '
-#                        'checksum of assembly')
+    action_grp.add_argument('--checksums', action='store_const', const=compile_with_checksums,
+                        dest='action', help='compile preprocessed sources and calculate '
+                        'checksum of assembly')
+    parser.add_argument('--manifest', help='file to save checksums to'
+                        ' (default: checksums.md5 in the working directory)')
+    parser.add_argument('--baseline', metavar='MANIFEST',
+                        help='compare checksums against a previously saved manifest')
+    parser.add_argument('--stop-on-diff', action='store_true',
+                        help='with --baseline, stop at the first unit which differs')
 
     action_grp.add_argument('--shell', action='store_const', const=gen_shell_scripts,
                         dest='action', help='generate shell script for timed compilation (default)')
+    action_grp.add_argument('--run', action='store_const', const=run_benchmarks,
+                        dest='action', help='perform timed compilation in parallel on'
+                        ' isolated CPUs (see --cpus)')
+    action_grp.add_argument('--serve', action='store_const', const=serve_benchmarks,
+                        dest='action', help='run as a worker: perform timed compilations'
+                        ' requested by \'--run --workers\' on the CPUs given by --cpus')
+    action_grp.add_argument('--bisect', metavar='BUILDS',
+                        help='find the first build in the ordered list of GCC build'
+                        ' directories (one per line in file BUILDS; the first one is'
+                        ' good, the last one is bad), which compiles the units given'
+                        ' by --subset or --units slower (see --confidence)')
+    action_grp.add_argument('--lto', action='store_const', const=lto_links,
+                        dest='action', help='compile the units of each benchmark into LTO'
+                        ' objects, then measure the link of each benchmark with each'
+                        ' -flto=N given by --lto-jobs (each link uses all the CPUs given'
+                        ' by --cpus)')
+    parser.add_argument('--lto-jobs', default='1,2,4,8', metavar='N,...',
+                        help='with --lto, comma-separated list of the numbers of LTRANS'
+                        ' jobs (-flto=N) (default: %(default)s)')
+    parser.add_argument('--link-flags', default='-lm', metavar='FLAGS',
+                        help='with --lto, additional options of the link (default:'
+                        ' %(default)s)')
+    parser.add_argument('--build-command', metavar='CMD',
+                        help='with --bisect, BUILDS lists revisions; CMD (a shell command,'
+                        ' \'{}\' is replaced by the revision or the revision is appended)'
+                        ' builds a revision and prints the build directory as its'
+                        ' last line')
+    parser.add_argument('--units', metavar='LIST',
+                        help='comma-separated list of units (bench/file), an alternative to'
+                        ' --subset')
+    parser.add_argument('--confidence', type=float, default=99.0, metavar='PERCENT',
+                        help='with --bisect, confidence level of each good/bad decision'
+                        ' (default: %(default)s)')
+    parser.add_argument('--listen', metavar='[HOST:]PORT',
+                        default=str(cluster.DEFAULT_PORT),
+                        help='address to listen on with --serve (default: %(default)s, host'
+                        ' defaults to 127.0.0.1)')
+    parser.add_argument('--workers', metavar='HOST:PORT,...',
+                        help='with --run, distribute compilations among the workers'
+                        ' (started with --serve) instead of local CPUs')
+    parser.add_argument('--secret-file', metavar='FILE',
+                        help='with --serve and --workers, file containing a secret shared'
+                        ' by the workers and the coordinator (required by workers, which'
+                        ' listen on other addresses than localhost)')
+    parser.add_argument('--costs', metavar='LOG',
+                        help='with --workers, balance the workers using the mean task-clock'
+                        ' of each unit in a previous log (or CSV file produced by'
+                        ' convert_result.py); otherwise the size of units is used')
+    parser.add_argument('--cpus', default='0',
+                        help='list of CPUs used by --run and --serve, e.g. 2-15'
+                        ' (default: %(default)s)')
+    parser.add_argument('--log', help='log file for --run (default: log.txt in the'
+                        ' working directory) and --lto (default: lto_log.txt)')
+    parser.add_argument('--journal', action='store_true',
+                        help='with --run, record finished compilations in <log>.journal;'
+                        ' failed compilations do not stop the run, running again resumes'
+                        ' it (finished compilations are skipped, failed ones are retried)')
+    parser.add_argument('--calibrate', type=int, nargs='?', const=CALIBRATE_RUNS, default=0,
+                        metavar='RUNS',
+                        help='with --run, measure the fixed cost of a timed compilation'
+                        ' (an empty unit compiled RUNS times, default: %(const)s) and'
+                        ' record it in the log, so that overhead-corrected values can be'
+                        ' reported')
     parser.add_argument('--alloc', choices=[DEFAULT_ALLOC, 'tcmalloc', 'jemalloc'],
                         default='ptmalloc', help='alloctor to use (default: %(default)s)')
+    parser.add_argument('--sweep-opt', action='append', metavar='OPTS',
+                        help='with --run, measure each unit with several optimization'
+                        ' options (in the format of -O, repeat the option for each'
+                        ' set); combined with --sweep-alloc and --sweep-gcc, all the'
+                        ' configurations are interleaved in a random order and written'
+                        ' into a single log')
+    parser.add_argument('--sweep-alloc', action='append',
+                        choices=[DEFAULT_ALLOC, 'tcmalloc', 'jemalloc'],
+                        help='with --run, measure each unit with several allocators'
+                        ' (repeat the option for each allocator)')
+    parser.add_argument('--sweep-gcc', action='append', metavar='[LABEL=]GCC_DIR',
+                        help='with --run, measure each unit with several GCC builds'
+                        ' (repeat the option for each build)')
+    parser.add_argument('--seed', type=int,
+                        help='seed of the random order of a --sweep-* run (default:'
+                        ' random, the seed is printed)')
+    parser.add_argument('--count-malloc', action='store_true',
+                        help='with --run and --serve, count memory allocations and'
+                        ' allocated bytes of each compilation (using malloc_count.so'
+                        ' preloaded before the allocator)')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='output timing information for each translation unit')
     parser.add_argument('--mem-report', action='store_true',
                         help='output memory report (implies verbose)')
+    parser.add_argument('--time-report', action='store_true',
+                        help='with --shell and --run, save time report (-ftime-report) and'
+                        ' memory report (with --mem-report) of each unit into the log')
     compiler_grp = parser.add_mutually_exclusive_group()
     compiler_grp.add_argument('--clang', action='store_true', help='benchmark Clang/Clang++')
     compiler_grp.add_argument('--gcc', action='store_true', help='benchmark GCC (default)')
@@ -400,29 +1359,164 @@ affect codegen)''')
                         help='when benchmarking Clang, produce assembly instead of object code')
     parser.add_argument('--cxx98', action='store_true', help='compile C++ code as C++98')
 
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use the cache of preprocessed sources')
+    parser.add_argument('--cache-size', type=int, default=4096, metavar='MB',
+                        help='size limit of the preprocessed sources cache'
+                        ' (default: %(default)s)')
+    parser.add_argument('--compress', action='store_true',
+                        help='with --preprocess, store preprocessed sources compressed'
+                        ' (gzip); each unit is decompressed into a staging directory before'
+                        ' its timed compilation (see --staging)')
+    parser.add_argument('--staging', metavar='DIR', default=runner.DEFAULT_STAGING_DIR,
+                        help='directory for decompressed units, preferably on tmpfs'
+                        ' (default: %(default)s)')
+
     # Perf can aggregate results, but we will work with lots of raw data anyway,
     # so using perf's average/std calculation does not make much sense -
     # we will loose precision. Instead, we just run the command several times
     parser.add_argument('-r', '--repeat', type=int, default=1,
                         help='number of times to compile each unit')
-
+    parser.add_argument('--adaptive', action='store_true',
+                        help='with --run, repeat each compilation until the confidence'
+                        ' interval of the measured value is narrow enough (see --rel-ci)')
+    parser.add_argument('--adaptive-counter', default='task-clock',
+                        help='counter used by --adaptive and --bisect (default: %(default)s)')
+    parser.add_argument('--rel-ci', type=float, default=1.0, metavar='PERCENT',
+                        help='target half-width of 95%% confidence interval relative'
+                        ' to the mean (default: %(default)s)')
+    parser.add_argument('--min-repeat', type=int, default=3,
+                        help='minimal number of repeats with --adaptive and --bisect'
+                        ' (default: %(default)s)')
+    parser.add_argument('--max-repeat', type=int, default=20,
+                        help='maximal number of repeats with --adaptive and --bisect'
+                        ' (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of parallel jobs for preprocessing and checksums'
+                        ' (default: %(default)s)')
+
+    parser.add_argument('--subset', metavar='FILE',
+                        help='with --shell, --run and --checksums, compile only the units'
+                        ' listed in FILE (see select_subset.py)')
     parser.add_argument('-O', '--optimization', default='O3',
                         help='optimization options (default: %(default)s)')
     parser.set_defaults(action=gen_shell_scripts, alloc='ptmalloc')
     args = parser.parse_args()
     if args.clang and args.mem_report:
         parser.error('--mem-report is supported only with GCC')
+    if args.time_report:
+        if args.clang:
+            parser.error('--time-report is supported only with GCC')
+        if args.action not in [gen_shell_scripts, run_benchmarks]:
+            parser.error('--time-report is only usable with --shell and --run')
     if args.asm and not args.clang:
         print('Warning: --asm (--assembly) is only meaningful for Clang'
               ' (GCC outputs assembly by default)')
     if args.action == preprocess_sources and args.with_gcc:
         parser.error('preprocessing can only be done using an installed version of GCC.'
                      ' Please set GCC_ROOT_PATH in config.py and use --gcc option')
+    if args.jobs < 1:
+        parser.error('--jobs must be positive')
+    if args.compress and args.action != preprocess_sources:
+        parser.error('--compress is only usable with --preprocess (other actions handle'
+                     ' compressed sources automatically)')
+    if args.staging is not None and not isdir(args.staging):
+        parser.error('staging directory \'{}\' does not exist'.format(args.staging))
+    if args.bisect:
+        args.action = bisect_builds
+        if args.clang:
+            parser.error('--bisect is supported only with GCC')
+        if not (args.subset or args.units):
+            parser.error('--bisect requires --subset or --units')
+        if not 2 <= args.min_repeat <= args.max_repeat:
+            parser.error('--min-repeat must be at least 2 and must not exceed --max-repeat')
+        if not 50 < args.confidence < 100:
+            parser.error('--confidence must be between 50 and 100')
+    elif args.build_command:
+        parser.error('--build-command is only usable with --bisect')
+    if args.units:
+        if args.subset:
+            parser.error('--units and --subset are mutually exclusive')
+        args.subset = set(name.strip() for name in args.units.split(',') if name.strip())
+        if not args.subset:
+            parser.error('--units is empty')
+        if args.action == preprocess_sources:
+            parser.error('--units is not usable with --preprocess')
+    elif args.subset:
+        if args.action == preprocess_sources:
+            parser.error('--subset is not usable with --preprocess')
+        try:
+            args.subset = load_subset(args.subset)
+        except IOError as ex:
+            parser.error('failed to read subset: {}'.format(ex))
+        if not args.subset:
+            parser.error('subset is empty')
+    if args.workers:
+        if args.action != run_benchmarks:
+            parser.error('--workers is only usable with --run')
+        if args.adaptive:
+            parser.error('--adaptive is incompatible with --workers')
+    if args.count_malloc and args.action not in [run_benchmarks, serve_benchmarks]:
+        parser.error('--count-malloc is only usable with --run and --serve')
+    if args.count_malloc and args.workers:
+        parser.error('--count-malloc is incompatible with --workers'
+                     ' (start the workers with --count-malloc instead)')
+    if args.journal:
+        if args.action != run_benchmarks:
+            parser.error('--journal is only usable with --run')
+        if args.adaptive or args.workers:
+            parser.error('--journal is incompatible with --adaptive and --workers')
+    if args.sweep_opt or args.sweep_alloc or args.sweep_gcc:
+        if args.action != run_benchmarks:
+            parser.error('--sweep-opt, --sweep-alloc and --sweep-gcc are only usable'
+                         ' with --run')
+        if args.adaptive or args.workers or args.journal:
+            parser.error('--sweep-* options are incompatible with --adaptive, --workers'
+                         ' and --journal')
+        if args.sweep_gcc and args.clang:
+            parser.error('--sweep-gcc can not be used with --clang')
+    elif args.seed is not None:
+        parser.error('--seed is only usable with --sweep-* options')
+    if args.calibrate:
+        if args.action != run_benchmarks:
+            parser.error('--calibrate is only usable with --run')
+        if args.workers or args.sweep_opt or args.sweep_alloc or args.sweep_gcc:
+            parser.error('--calibrate is incompatible with --workers and --sweep-* options'
+                         ' (the overhead depends on the host and the configuration)')
+        if args.calibrate < 0:
+            parser.error('--calibrate must be positive')
+    if args.action == lto_links:
+        if args.clang:
+            parser.error('--lto is supported only with GCC')
+        try:
+            args.lto_jobs = sorted(set(int(n) for n in args.lto_jobs.split(',') if n.strip()))
+        except ValueError:
+            parser.error('invalid --lto-jobs list')
+        if not args.lto_jobs or args.lto_jobs[0] < 1:
+            parser.error('--lto-jobs must be a list of positive numbers')
+    if args.costs and not args.workers:
+        parser.error('--costs is only usable with --workers')
+    if args.secret_file and not (args.workers or args.action == serve_benchmarks):
+        parser.error('--secret-file is only usable with --serve and --workers')
+    if args.baseline and args.action != compile_with_checksums:
+        parser.error('--baseline is only usable with --checksums')
+    if args.mem_report and not args.time_report:
+        args.verbose = True
+    if args.adaptive:
+        if args.action != run_benchmarks:
+            parser.error('--adaptive is only usable with --run')
+        if args.repeat > 1:
+            parser.error('--adaptive is incompatible with --repeat')
+        if not 2 <= args.min_repeat <= args.max_repeat:
+            parser.error('--min-repeat must be at least 2 and must not exceed --max-repeat')
+        if args.rel_ci <= 0:
+            parser.error('--rel-ci must be positive')
     if args.repeat > 1:
-        if args.action != gen_shell_scripts:
-            parser.error('--repeat is only usable with --shell')
-        if args.mem_report:
-            parser.error('--repeat is incompatible with --mem-report')
+        if args.action not in [gen_shell_scripts, run_benchmarks, lto_links]:
+            parser.error('--repeat is only usable with --shell, --run and --lto')
+        if args.mem_report and not args.time_report:
+            parser.error('--repeat is incompatible with --mem-report'
+                         ' (unless --time-report is used)')
 
     if not args.clang:
         global GCC_PATH
@@ -430,7 +1524,7 @@ affect codegen)''')
 
     if args.alloc != DEFAULT_ALLOC:
         global ALLOCATOR
-        ALLOCATOR = find_allocator(args)
+        ALLOCATOR = find_allocator(args.alloc)
 
     perform_sanity_checks(args)
 
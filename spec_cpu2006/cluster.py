@@ -0,0 +1,372 @@
+# Distributed benchmark execution.
+#
+# Benchmark hosts run build_spec.py --serve: each one is a worker, which
+# accepts a shard of compilation jobs from a coordinator (build_spec.py
+# --run --workers ...) and runs them on its CPUs using runner.Runner. The
+# coordinator balances shards by the expected cost of each job and writes
+# the results received from all workers into a single log (in the same
+# format as runner.Runner and the generated scripts do).
+#
+# The protocol is line-based: each message is a JSON object followed by a
+# newline.
+#   worker -> coordinator: challenge
+#   coordinator -> worker: hello, job (repeated), done
+#   worker -> coordinator: hello, result (repeated), then bye or error
+# The coordinator sends only the settings of the run (in its hello message)
+# and the names of the units to compile: workers build the commands
+# themselves from their own configuration and preprocessed sources, and
+# accept only a safe subset of optimization options. If a shared secret is
+# configured, the hello message must contain the HMAC of the challenge
+# computed with the secret.
+
+import os, os.path
+import sys
+import csv
+import json
+import hmac
+import socket
+import hashlib
+import binascii
+import threading
+
+# Local modules
+import perf_report
+import runner
+
+class ClusterError(Exception): pass
+
+PROTOCOL_VERSION    = 2
+DEFAULT_PORT        = 7450
+NONCE_SIZE          = 16
+LOOPBACK_HOSTS      = ['127.0.0.1', 'localhost']
+
+def auth_digest(secret, nonce):
+    '''Response to the challenge of a worker'''
+    return hmac.new(secret, nonce.encode('ascii'), hashlib.sha256).hexdigest()
+
+def load_secret(path):
+    '''Read the shared secret of workers and coordinators from a file'''
+    with open(path, 'rb') as f:
+        secret = f.read().strip()
+    if not secret:
+        raise ClusterError('secret file \'{}\' is empty'.format(path))
+    return secret
+
+def parse_address(s, default_host='127.0.0.1'):
+    '''Parse [HOST:]PORT. Returns (host, port)'''
+    host, sep, port = s.rpartition(':')
+    if not sep:
+        host = default_host
+    try:
+        port = int(port)
+    except ValueError:
+        raise ClusterError('invalid address: \'{}\''.format(s))
+    if not 0 < port < 65536:
+        raise ClusterError('invalid port in address: \'{}\''.format(s))
+    return (host or default_host, port)
+
+class Connection:
+    '''JSON message stream over a socket'''
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.lock = threading.Lock()
+
+    def send(self, msg_type, **fields):
+        fields['type'] = msg_type
+        data = (json.dumps(fields) + '\n').encode('utf-8')
+        with self.lock:
+            self.sock.sendall(data)
+
+    def recv(self, expected=None):
+        '''Receive a message (dictionary). Raises ClusterError if the
+           connection is closed or the message type is not the expected one'''
+        line = self.reader.readline()
+        if not line:
+            raise ClusterError('connection closed')
+        try:
+            msg = json.loads(line.decode('utf-8'))
+        except ValueError:
+            raise ClusterError('malformed message')
+        if msg.get('type') == 'error':
+            raise ClusterError(msg.get('reason', 'unknown error'))
+        if expected is not None and msg.get('type') != expected:
+            raise ClusterError('expected \'{}\' message, got \'{}\''.format(
+                                expected, msg.get('type')))
+        return msg
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+def format_result(workload, perf_output, report=None):
+    '''Log entry of a single run (see runner.Runner._write_result)'''
+    parts = ['# WORKLOAD: {}\n'.format(workload)]
+    if report:
+        parts += ['{} {}\n'.format(perf_report.REPORT_PREFIX, line)
+                  for line in report.splitlines()]
+    parts.append(perf_output)
+    return ''.join(parts)
+
+class RemoteJob(runner.Job):
+    def __init__(self, job_id, workload, argv, compressed=None):
+        runner.Job.__init__(self, workload, argv, compressed=compressed)
+        self.id = job_id
+
+class WorkerRunner(runner.Runner):
+    '''Runner which sends results to the coordinator instead of writing
+       them to a log'''
+    def __init__(self, conn, cpus, env, verbose, capture_report, count_malloc):
+        runner.Runner.__init__(self, cpus, None, env, verbose,
+                               capture_report=capture_report, count_malloc=count_malloc)
+        self.conn = conn
+
+    def _write_result(self, job, perf_output, report=None):
+        self.conn.send('result', id=job.id, workload=job.workload,
+                       output=format_result(job.workload, perf_output, report))
+        with self._lock:
+            self.done += 1
+
+class Worker:
+    '''Serves coordinators (one at a time)'''
+    def __init__(self, address, cpus, env, alloc, job_builder, verbose=False,
+                 count_malloc=None, secret=None):
+        '''job_builder - function, which takes the settings sent by the
+           coordinator (dictionary) and returns a function mapping a workload
+           name to (command, compressed input or None); both functions raise
+           ClusterError for settings and workloads the worker refuses,
+           alloc - name of the allocator (must match the coordinator's one),
+           count_malloc - path of malloc_count.so (see runner.Runner),
+           secret - shared secret, which coordinators must prove to know'''
+        self.address = address
+        self.cpus = cpus
+        self.env = env
+        self.alloc = alloc
+        self.job_builder = job_builder
+        self.verbose = verbose
+        self.count_malloc = count_malloc
+        self.secret = secret
+
+    def serve_forever(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(self.address)
+        server.listen(1)
+        print('Worker listening on {}:{}, CPU(s) {}'.format(
+                self.address[0], self.address[1], ','.join(str(c) for c in self.cpus)))
+        sys.stdout.flush()
+        try:
+            while True:
+                sock, peer = server.accept()
+                print('Session with {}:{}'.format(*peer))
+                conn = Connection(sock)
+                try:
+                    self.serve_session(conn)
+                except (ClusterError, socket.error) as ex:
+                    print('Session aborted: {}'.format(ex))
+                finally:
+                    conn.close()
+                sys.stdout.flush()
+        finally:
+            server.close()
+
+    def _reject(self, conn, reason):
+        conn.send('error', reason=reason)
+        raise ClusterError(reason)
+
+    def serve_session(self, conn):
+        nonce = binascii.hexlify(os.urandom(NONCE_SIZE)).decode('ascii')
+        conn.send('challenge', nonce=nonce)
+        hello = conn.recv('hello')
+        if hello.get('version') != PROTOCOL_VERSION:
+            self._reject(conn, 'unsupported protocol version')
+        if self.secret is not None:
+            auth = hello.get('auth')
+            if not isinstance(auth, type(u'')) or \
+                    not hmac.compare_digest(auth_digest(self.secret, nonce).encode('ascii'),
+                                            auth.encode('utf-8')):
+                self._reject(conn, 'authentication failed')
+        if hello.get('alloc') != self.alloc:
+            self._reject(conn, 'worker uses allocator \'{}\', coordinator - \'{}\''.format(
+                                self.alloc, hello.get('alloc')))
+        settings = hello.get('settings')
+        if not isinstance(settings, dict):
+            self._reject(conn, 'malformed hello message')
+        try:
+            make_job = self.job_builder(settings)
+        except ClusterError as ex:
+            self._reject(conn, '{}: {}'.format(socket.gethostname(), ex))
+        conn.send('hello', host=socket.gethostname(), cpus=len(self.cpus))
+        jobs = []
+        while True:
+            msg = conn.recv()
+            if msg['type'] == 'done':
+                break
+            if msg['type'] != 'job':
+                self._reject(conn, 'unexpected message \'{}\''.format(msg['type']))
+            workload = msg.get('workload')
+            if not isinstance(workload, type(u'')):
+                self._reject(conn, 'malformed job message')
+            try:
+                argv, compressed = make_job(workload)
+            except ClusterError as ex:
+                self._reject(conn, '{}: {}'.format(socket.gethostname(), ex))
+            jobs.append(RemoteJob(msg.get('id'), workload, argv, compressed))
+        print('Running {} compilations'.format(len(jobs)))
+        sys.stdout.flush()
+        worker_runner = WorkerRunner(conn, self.cpus, self.env, self.verbose,
+                                     bool(settings.get('time_report')), self.count_malloc)
+        try:
+            worker_runner.run(jobs)
+        except runner.RunnerError as ex:
+            conn.send('error', reason='{}: {}'.format(socket.gethostname(), ex))
+            raise ClusterError(str(ex))
+        conn.send('bye')
+
+def load_costs(path):
+    '''Mean task-clock of each workload in a log (or CSV file produced by
+       convert_result.py). Returns dictionary: workload -> cost'''
+    sums = {}
+    with open(path, 'r') as f:
+        if path.endswith('.csv'):
+            reader = csv.reader(f)
+            header = next(reader, [])
+            try:
+                name_col = header.index('name')
+                cost_col = header.index('task-clock')
+            except ValueError:
+                raise ClusterError('\'{}\' has no \'name\' or \'task-clock\' column'.format(path))
+            pairs = []
+            for values in reader:
+                if len(values) == len(header) and values[cost_col]:
+                    pairs.append((values[name_col], float(values[cost_col])))
+        else:
+            pairs = [(run.name, run.get_value('task-clock'))
+                     for run in perf_report.iter_runs(f)]
+    for (name, cost) in pairs:
+        if name is None or cost is None:
+            continue
+        total, count = sums.get(name, (0.0, 0))
+        sums[name] = (total + cost, count + 1)
+    return dict((name, total / count) for (name, (total, count)) in sums.items())
+
+def estimate_costs(jobs, known):
+    '''Expected cost of each job: the cost measured earlier (known is a
+       dictionary returned by load_costs) or, for new workloads, the size of
+       the preprocessed source scaled by the median cost per byte of known
+       workloads'''
+    sizes = [os.path.getsize(job.argv[-1]) for job in jobs]
+    ratios = sorted(known[job.workload] / size for (job, size) in zip(jobs, sizes)
+                    if job.workload in known and size > 0)
+    scale = ratios[len(ratios) // 2] if ratios else 1.0
+    return [known.get(job.workload, size * scale) for (job, size) in zip(jobs, sizes)]
+
+def assign_shards(costs, capacities):
+    '''Longest processing time first: assign jobs (list of costs) to workers
+       (list of numbers of CPUs) minimizing the expected finish time. Returns
+       list of job indices for each worker'''
+    shards = [[] for _ in capacities]
+    loads = [0.0] * len(capacities)
+    order = sorted(range(len(costs)), key=lambda i: -costs[i])
+    for ind in order:
+        worker = min(range(len(capacities)),
+                     key=lambda w: ((loads[w] + costs[ind]) / capacities[w], w))
+        shards[worker].append(ind)
+        loads[worker] += costs[ind]
+    return shards
+
+class Coordinator:
+    '''Distributes jobs among workers and collects the results into a log'''
+    def __init__(self, addresses, log, alloc, settings, verbose=False, secret=None):
+        '''settings - dictionary, from which workers build the commands (see
+           Worker), secret - shared secret of the workers'''
+        self.addresses = addresses
+        self.log = log
+        self.alloc = alloc
+        self.settings = settings
+        self.verbose = verbose
+        self.secret = secret
+        self.failed = []
+        self.done = 0
+        self._lock = threading.Lock()
+
+    def _connect(self, address):
+        try:
+            sock = socket.create_connection(address)
+        except socket.error as ex:
+            raise ClusterError('failed to connect to {}:{}: {}'.format(
+                                address[0], address[1], ex))
+        conn = Connection(sock)
+        nonce = conn.recv('challenge').get('nonce')
+        auth = None
+        if self.secret is not None:
+            if not isinstance(nonce, type(u'')):
+                conn.close()
+                raise ClusterError('malformed challenge from {}:{}'.format(*address))
+            auth = auth_digest(self.secret, nonce)
+        conn.send('hello', version=PROTOCOL_VERSION, alloc=self.alloc, settings=self.settings,
+                  auth=auth)
+        return conn, conn.recv('hello')
+
+    def _collect(self, label, conn, jobs):
+        '''Receive results of jobs (dictionary: id -> Job) from a worker'''
+        try:
+            while True:
+                msg = conn.recv()
+                if msg['type'] == 'bye':
+                    break
+                if msg['type'] != 'result' or msg.get('id') not in jobs:
+                    raise ClusterError('unexpected message')
+                del jobs[msg['id']]
+                with self._lock:
+                    self.log.write(msg['output'])
+                    self.log.flush()
+                    self.done += 1
+                    if self.verbose:
+                        sys.stdout.write('# {}\n'.format(msg.get('workload')))
+                    else:
+                        sys.stdout.write('.')
+                    sys.stdout.flush()
+            if jobs:
+                raise ClusterError('{} results missing'.format(len(jobs)))
+        except (ClusterError, socket.error) as ex:
+            with self._lock:
+                self.failed.append('{}: {}'.format(label, ex))
+        finally:
+            conn.close()
+
+    def run(self, jobs, costs):
+        '''Run jobs (list of runner.Job), costs - expected cost of each job'''
+        sessions = []
+        try:
+            for address in self.addresses:
+                conn, hello = self._connect(address)
+                label = '{}:{}'.format(*address)
+                sessions.append((label, conn, max(1, int(hello.get('cpus', 1)))))
+                print('Worker {} ({}): {} CPU(s)'.format(label, hello.get('host'),
+                                                        sessions[-1][2]))
+        except (ClusterError, socket.error) as ex:
+            for (_, conn, _) in sessions:
+                conn.close()
+            raise ClusterError(str(ex))
+
+        shards = assign_shards(costs, [cpus for (_, _, cpus) in sessions])
+        threads = []
+        for ((label, conn, _), shard) in zip(sessions, shards):
+            shard_jobs = {}
+            print('{}: {} compilations, expected cost {:.1f}'.format(
+                    label, len(shard), sum(costs[i] for i in shard)))
+            for ind in shard:
+                conn.send('job', id=ind, workload=jobs[ind].workload)
+                shard_jobs[ind] = jobs[ind]
+            conn.send('done')
+            thread = threading.Thread(target=self._collect, args=(label, conn, shard_jobs))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1.0)
+        sys.stdout.write('\n')
+        if self.failed:
+            raise ClusterError('; '.join(self.failed))
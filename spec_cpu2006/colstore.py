@@ -0,0 +1,349 @@
+#!/usr/bin/env python2.7
+
+# This script converts benchmark results (CSV files produced by
+# convert_result.py, e.g. the ones in bench_results/data) into a columnar
+# binary format. The module also provides a loader, which memory-maps the
+# converted files, so that many datasets can be opened at once without
+# parsing or copying them.
+#
+# File format (all numbers are little-endian):
+#   magic (8 bytes), header length (uint64), header (JSON), columns.
+# The header describes the number of rows, data type and offset of each
+# column. Numeric columns are stored as int64 or float64 arrays (float64
+# if some values are fractional or missing; missing values are NaN). Text
+# columns (e.g. 'name' and 'opt') are dictionary-encoded: the column
+# contains uint32 codes, the dictionary is stored in the header. Each
+# column is aligned to 8 bytes.
+
+from __future__ import print_function
+
+# System modules
+import os, os.path
+import sys
+import csv
+import json
+import mmap
+import struct
+import bisect
+import numbers
+import argparse
+
+# Local modules
+import perf_report
+
+def error(msg):
+    '''Print error message to stderr and exit with non-zero status'''
+    sys.stderr.write('Error: {}\n'.format(msg))
+    sys.exit(1)
+
+try:
+    import numpy as np
+except ImportError:
+    error('required package \'numpy\' not found')
+
+class StoreError(Exception): pass
+
+MAGIC       = b'GCCPCOL1'
+ALIGN       = 8
+EXT         = '.col'
+
+DTYPE_INT   = '<i8'
+DTYPE_FLOAT = '<f8'
+DTYPE_CODE  = '<u4'
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def _parse_column(values):
+    '''Convert a list of strings into a numpy array. Return (array, dictionary),
+       dictionary is None for numeric columns'''
+    try:
+        return np.array([int(v) for v in values], dtype=DTYPE_INT), None
+    except ValueError:
+        pass
+    try:
+        return np.array([float(v) if v != '' else float('nan') for v in values],
+                        dtype=DTYPE_FLOAT), None
+    except ValueError:
+        pass
+    return _text_column(values)
+
+def _text_column(values):
+    '''Dictionary-encode a list of strings. Return (array, dictionary)'''
+    dictionary = sorted(set(values))
+    codes = dict((v, i) for (i, v) in enumerate(dictionary))
+    return np.array([codes[v] for v in values], dtype=DTYPE_CODE), dictionary
+
+def read_csv(path):
+    '''Read a CSV file with a header. Return list of (name, array, dictionary)'''
+    with open(path, 'r') as f:
+        reader = csv.reader(f)
+        try:
+            header = next(reader)
+        except StopIteration:
+            raise StoreError('\'{}\' is empty'.format(path))
+        rows = [row for row in reader if row]
+    for (ind, row) in enumerate(rows):
+        if len(row) != len(header):
+            raise StoreError('{}:{}: expected {} values, got {}'.format(
+                                path, ind + 2, len(header), len(row)))
+    columns = zip(*rows) if rows else [[] for _ in header]
+    return [(name,) + _parse_column(list(values))
+            for (name, values) in zip(header, columns)]
+
+def write_store(path, columns):
+    '''Write columns (list of (name, array, dictionary)) to path'''
+    num_rows = len(columns[0][1]) if columns else 0
+    meta = []
+    offset = 0
+    for (name, array, dictionary) in columns:
+        col = {'name': name, 'dtype': array.dtype.str, 'offset': offset}
+        if dictionary is not None:
+            col['dict'] = dictionary
+        meta.append(col)
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({'rows': num_rows, 'columns': meta}).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        f.write(b'\0' * (data_start - f.tell()))
+        for (col, (_, array, _)) in zip(meta, columns):
+            f.write(b'\0' * (data_start + col['offset'] - f.tell()))
+            f.write(array.tobytes() if hasattr(array, 'tobytes') else array.tostring())
+
+def convert_file(src_path, dest_path):
+    write_store(dest_path, read_csv(src_path))
+
+class Dataset:
+    '''A memory-mapped dataset. Columns are read-only numpy arrays which
+       refer directly to the mapped file'''
+    def __init__(self, path, columns=None):
+        '''Open column store file. If columns (list of (name, array, dictionary))
+           are given, create an in-memory dataset instead'''
+        self.path = path
+        self.names = []
+        self._columns = {}
+        self._dicts = {}
+        self._benchmarks = None
+        self._bench_codes = None
+        self._mmap = None
+        if columns is not None:
+            self.num_rows = len(columns[0][1]) if columns else 0
+            for (name, array, dictionary) in columns:
+                self._add_column(name, array, dictionary)
+            return
+
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self._mmap
+        if buf[:len(MAGIC)] != MAGIC:
+            raise StoreError('\'{}\' is not a column store file'.format(path))
+        header_len = struct.unpack('<Q', buf[len(MAGIC):len(MAGIC) + 8])[0]
+        header_start = len(MAGIC) + 8
+        header = json.loads(buf[header_start:header_start + header_len].decode('utf-8'))
+        data_start = _align(header_start + header_len)
+        self.num_rows = header['rows']
+        for col in header['columns']:
+            array = np.frombuffer(buf, dtype=col['dtype'], count=self.num_rows,
+                                  offset=data_start + col['offset'])
+            self._add_column(col['name'], array, col.get('dict'))
+
+    def _add_column(self, name, array, dictionary):
+        self.names.append(name)
+        self._columns[name] = array
+        if dictionary is not None:
+            self._dicts[name] = dictionary
+
+    def __len__(self):
+        return self.num_rows
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        '''Return column (codes for dictionary-encoded columns)'''
+        try:
+            return self._columns[name]
+        except KeyError:
+            raise StoreError('no column \'{}\' in \'{}\''.format(name, self.path))
+
+    def counters(self):
+        '''Names of numeric columns'''
+        return [name for name in self.names if name not in self._dicts]
+
+    def dictionary(self, name):
+        '''Dictionary of a text column'''
+        return self._dicts[name]
+
+    def code(self, name, value):
+        '''Code of value in a text column (None, if not present)'''
+        dictionary = self._dicts[name]
+        # Dictionaries are sorted
+        ind = bisect.bisect_left(dictionary, value)
+        if ind < len(dictionary) and dictionary[ind] == value:
+            return int(ind)
+        return None
+
+    def decode(self, name, rows=None):
+        '''Return values of a text column as a list of strings'''
+        dictionary = self._dicts[name]
+        codes = self[name] if rows is None else self[name][rows]
+        return [dictionary[c] for c in codes]
+
+    def benchmarks(self):
+        '''Sorted list of benchmark names (derived from the 'name' column,
+           which contains "benchmark/file" values)'''
+        if self._benchmarks is None:
+            self._benchmarks = sorted(set(n.split('/', 1)[0] for n in self._dicts['name']))
+        return self._benchmarks
+
+    def bench_codes(self):
+        '''Per-row indices into benchmarks() list'''
+        if self._bench_codes is None:
+            benchmarks = self.benchmarks()
+            index = dict((b, i) for (i, b) in enumerate(benchmarks))
+            name_to_bench = np.array([index[n.split('/', 1)[0]] for n in self._dicts['name']],
+                                     dtype=DTYPE_CODE)
+            self._bench_codes = name_to_bench[self['name']]
+        return self._bench_codes
+
+    def mask(self, bench=None, opt=None, name=None):
+        '''Boolean mask of rows matching the given benchmark, optimization
+           level and workload name (None matches anything)'''
+        mask = np.ones(self.num_rows, dtype=bool)
+        if bench is not None:
+            benchmarks = self.benchmarks()
+            if bench not in benchmarks:
+                return np.zeros(self.num_rows, dtype=bool)
+            mask &= self.bench_codes() == benchmarks.index(bench)
+        for (col, value) in [('opt', opt), ('name', name)]:
+            if value is None:
+                continue
+            code = self.code(col, value) if col in self._dicts else None
+            if code is None:
+                return np.zeros(self.num_rows, dtype=bool)
+            mask &= self[col] == code
+        return mask
+
+    def select(self, bench=None, opt=None, name=None):
+        '''Indices of rows matching the given criteria (see mask)'''
+        return np.flatnonzero(self.mask(bench, opt, name))
+
+    def close(self):
+        self._columns = {}
+        self._bench_codes = None
+        if self._mmap is not None:
+            self._mmap.close()
+
+def runs_to_columns(runs, overhead=None):
+    '''Convert RunReport objects (see perf_report) into list of columns.
+       overhead - see perf_report.iter_runs (overhead-corrected values are
+       added as columns with perf_report.NET_PREFIX). Each key of the run
+       configuration (see perf_report.parse_config) becomes a text column
+       ('' for runs without it)'''
+    names = []
+    values = {}
+    config = {}
+    for (ind, run) in enumerate(runs):
+        names.append(run.name or '')
+        for (key, value) in run.config or ():
+            if key not in config:
+                config[key] = [''] * ind
+            config[key].append(value)
+        for column in config.values():
+            if len(column) == ind:
+                column.append('')
+        for (key, value) in list(run.items()) + perf_report.net_items(run, overhead):
+            if key not in values:
+                values[key] = [None] * ind
+            values[key].append(value)
+        for column in values.values():
+            if len(column) == ind:
+                column.append(None)
+    columns = [('name',) + _parse_column(names)]
+    columns += [(key,) + _text_column(config[key]) for key in sorted(config)]
+    for key in sorted(values):
+        column = values[key]
+        if all(isinstance(v, numbers.Integral) for v in column):
+            array = np.array(column, dtype=DTYPE_INT)
+        else:
+            array = np.array([float('nan') if v is None else v for v in column],
+                             dtype=DTYPE_FLOAT)
+        columns.append((key, array, None))
+    return columns
+
+def open_dataset(path):
+    '''Open benchmark results in any supported format: column store file,
+       CSV file (e.g. produced by convert_result.py) or perf log'''
+    with open(path, 'rb') as f:
+        is_store = f.read(len(MAGIC)) == MAGIC
+    if is_store:
+        return Dataset(path)
+    if path.endswith('.csv'):
+        return Dataset(path, read_csv(path))
+    with open(path, 'r') as f:
+        overhead = {}
+        try:
+            return Dataset(path, runs_to_columns(perf_report.iter_runs(f, ',', overhead),
+                                                 overhead))
+        except perf_report.ReportError as ex:
+            raise StoreError('failed to parse \'{}\': {}'.format(path, ex))
+
+def load_all(root):
+    '''Open all column store files under root directory. Return dictionary:
+       relative path without extension (e.g. "ivybridge/by_alloc/tcmalloc") -> Dataset'''
+    result = {}
+    for (dirpath, _, fnames) in os.walk(root):
+        for fname in fnames:
+            if not fname.endswith(EXT):
+                continue
+            full_path = os.path.join(dirpath, fname)
+            key = os.path.relpath(full_path, root)[:-len(EXT)]
+            result[key.replace(os.sep, '/')] = Dataset(full_path)
+    return result
+
+def run(args):
+    if os.path.isdir(args.input):
+        pairs = []
+        for (dirpath, _, fnames) in os.walk(args.input):
+            for fname in sorted(fnames):
+                if fname.endswith('.csv'):
+                    src = os.path.join(dirpath, fname)
+                    rel = os.path.relpath(src, args.input)
+                    dest = os.path.join(args.output or args.input, rel[:-4] + EXT)
+                    pairs.append((src, dest))
+        if not pairs:
+            error('no CSV files in the input directory')
+    elif os.path.isfile(args.input):
+        dest = args.output or os.path.splitext(args.input)[0] + EXT
+        pairs = [(args.input, dest)]
+    else:
+        error('invalid input file')
+    for (src, dest) in pairs:
+        dest_dir = os.path.dirname(dest)
+        if dest_dir and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        print('{} -> {}'.format(src, dest))
+        try:
+            convert_file(src, dest)
+        except StoreError as ex:
+            error(str(ex))
+
+def main():
+    parser = argparse.ArgumentParser(description='convert benchmark results'
+                ' from CSV into memory-mappable column store files')
+    parser.add_argument('input',
+                help='the directory containing CSV files (searched recursively)'
+                     ' or a single CSV file')
+    parser.add_argument('output', nargs='?',
+                help='output directory (or file, if input is a file). By default'
+                     ' output files are written next to the input files')
+    args = parser.parse_args()
+    if not os.path.exists(args.input):
+        parser.error('input file/directory does not exist')
+    run(args)
+
+if __name__ == '__main__':
+    main()
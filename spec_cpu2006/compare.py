@@ -0,0 +1,348 @@
+#!/usr/bin/env python2.7
+
+# This script compares two or more sets of benchmark results (e.g. results
+# obtained with different compilers, memory allocators or hosts).
+# Datasets are joined on (name, opt); the first dataset is the baseline.
+# Results of configuration sweeps are joined on the whole configuration
+# (opt, alloc, compiler, see perf_report.config_label) instead of opt.
+# For each of the chosen counters the script reports geometric means of
+# per-TU ratios for each benchmark and optimization level and a list of
+# the most regressed TUs.
+# If datasets contain repeated measurements of the same TU, confidence
+# intervals of the geometric means are computed using bootstrap
+# (repeats of each TU are resampled).
+
+from __future__ import print_function
+
+# System modules
+import os, os.path
+import sys
+import warnings
+import argparse
+
+# Local modules
+import colstore
+import perf_report
+
+def error(msg):
+    '''Print error message to stderr and exit with non-zero status'''
+    sys.stderr.write('Error: {}\n'.format(msg))
+    sys.exit(1)
+
+try:
+    import numpy as np
+except ImportError:
+    error('required package \'numpy\' not found')
+
+class CompareError(Exception): pass
+
+NO_OPT = ''
+
+# Number of bootstrap samples computed at once
+BOOTSTRAP_CHUNK = 25
+
+def column_values(ds, name):
+    '''Values of a key column of a dataset: (list of distinct values as
+       strings, per-row indices into it). Missing columns have one value '' '''
+    if name not in ds:
+        return [''], np.zeros(len(ds), dtype=np.int64)
+    if name not in ds.counters():
+        return ds.dictionary(name), ds[name]
+    # Numeric columns (e.g. flto in CSV files)
+    uniq, inverse = np.unique(ds[name], return_inverse=True)
+    return ['' if np.isnan(v) else '{:g}'.format(v) for v in uniq], inverse
+
+def config_labels(ds):
+    '''Configuration of each row of a dataset: (list of labels, per-row
+       indices into it), see perf_report.config_label'''
+    combined = np.zeros(len(ds), dtype=np.int64)
+    values = []
+    for key in perf_report.CONFIG_KEYS:
+        key_values, codes = column_values(ds, key)
+        combined = combined * len(key_values) + codes
+        values.append(key_values)
+    uniq, inverse = np.unique(combined, return_inverse=True)
+    labels = []
+    for code in uniq:
+        row = []
+        for key_values in reversed(values):
+            code, ind = divmod(int(code), len(key_values))
+            row.append(key_values[ind])
+        labels.append(perf_report.config_label(row[::-1]))
+    return labels, inverse
+
+class Grouped:
+    '''Measurements of a dataset grouped by (name, opt) key. Rows are sorted
+       by key, so that repeats of each TU are contiguous'''
+    def __init__(self, keys, values):
+        '''keys - per-row global key ids, values - dictionary: counter -> per-row array'''
+        order = np.argsort(keys, kind='mergesort')
+        sorted_keys = keys[order]
+        self.keys, self.starts, self.counts = np.unique(sorted_keys, return_index=True,
+                                                        return_counts=True)
+        self.row_group = np.repeat(np.arange(len(self.keys)), self.counts)
+        self.values = dict((k, np.asarray(v, dtype=float)[order]) for (k, v) in values.items())
+
+    def has_repeats(self):
+        return len(self.counts) != 0 and self.counts.max() > 1
+
+    def means(self, counter, rows=None):
+        '''Per-key mean of counter. rows - optional resampled row indices'''
+        values = self.values[counter]
+        if rows is not None:
+            values = values[rows]
+        sums = np.bincount(self.row_group, weights=values, minlength=len(self.keys))
+        return sums / self.counts
+
+    def resampled_means(self, counter, rng, num_samples):
+        '''Per-key means of counter for num_samples bootstrap samples, in each
+           sample repeats are resampled within each key. Returns array of
+           shape (num_samples, number of keys)'''
+        num_rows = len(self.row_group)
+        num_keys = len(self.keys)
+        offsets = np.floor(rng.random_sample((num_samples, num_rows)) *
+                           self.counts[self.row_group]).astype(np.int64)
+        values = self.values[counter][self.starts[self.row_group] + offsets]
+        ids = np.arange(num_samples)[:, np.newaxis] * num_keys + self.row_group
+        sums = np.bincount(ids.ravel(), weights=values.ravel(),
+                           minlength=num_samples * num_keys)
+        return sums.reshape(num_samples, num_keys) / self.counts
+
+class Comparison:
+    '''Two or more datasets joined on (name, opt)'''
+    def __init__(self, datasets, counters):
+        self.counters = counters
+        names = {}
+        opts = {NO_OPT: 0}
+        name_maps = []
+        opt_maps = []
+        for ds in datasets:
+            for counter in counters:
+                if counter not in ds:
+                    raise CompareError('\'{}\' has no \'{}\' column'.format(ds.path, counter))
+            name_maps.append(np.array([names.setdefault(n, len(names))
+                                       for n in ds.dictionary('name')], dtype=np.int64))
+            labels, rows = config_labels(ds)
+            opt_maps.append(np.array([opts.setdefault(o, len(opts)) for o in labels],
+                                     dtype=np.int64)[rows])
+        self.num_opts = len(opts)
+        self.opt_names = [o for (o, _) in sorted(opts.items(), key=lambda p: p[1])]
+        self.tu_names = [n for (n, _) in sorted(names.items(), key=lambda p: p[1])]
+
+        self.groups = []
+        for (ds, name_map, opt_map) in zip(datasets, name_maps, opt_maps):
+            keys = name_map[ds['name']] * self.num_opts + opt_map
+            self.groups.append(Grouped(keys, dict((c, ds[c]) for c in counters)))
+
+        # Inner join: keys present in all datasets
+        common = self.groups[0].keys
+        for group in self.groups[1:]:
+            common = np.intersect1d(common, group.keys, assume_unique=True)
+        if len(common) == 0:
+            raise CompareError('datasets have no common (name, opt) pairs')
+        self.keys = common
+        self.positions = [np.searchsorted(group.keys, common) for group in self.groups]
+
+        # Benchmark of each common key
+        benchmarks = sorted(set(n.split('/', 1)[0] for n in self.tu_names))
+        bench_index = dict((b, i) for (i, b) in enumerate(benchmarks))
+        bench_of_name = np.array([bench_index[n.split('/', 1)[0]] for n in self.tu_names],
+                                 dtype=np.int64)
+        self.benchmarks = benchmarks
+        self.name_ids = common // self.num_opts
+        self.opt_ids = common % self.num_opts
+        self.bench_ids = bench_of_name[self.name_ids]
+
+    def has_repeats(self):
+        return any(group.has_repeats() for group in self.groups)
+
+    def tu_means(self, counter):
+        '''List of per-TU means of counter (one array per dataset, aligned with
+           self.keys)'''
+        return [group.means(counter)[pos] for (group, pos) in zip(self.groups, self.positions)]
+
+    def log_ratios(self, means):
+        '''Per-TU log ratios of each dataset vs. the baseline (NaN if a ratio
+           is undefined, e.g. a counter is zero)'''
+        base = means[0]
+        result = []
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for values in means[1:]:
+                ratio = np.log(values / base)
+                ratio[~np.isfinite(ratio)] = np.nan
+                result.append(ratio)
+        return result
+
+    def group_ids(self):
+        '''Group id of each TU: one group per (benchmark, opt) pair, followed
+           by a group per opt ("all benchmarks")'''
+        per_bench = self.bench_ids * self.num_opts + self.opt_ids
+        total = len(self.benchmarks) * self.num_opts + self.opt_ids
+        return per_bench, total
+
+    def geomeans(self, log_ratios):
+        '''Geometric means of ratios for each group, array of shape
+           (number of datasets - 1, number of groups)'''
+        per_bench, total = self.group_ids()
+        ids = np.concatenate([per_bench, total])
+        num_groups = (len(self.benchmarks) + 1) * self.num_opts
+        result = np.empty((len(log_ratios), num_groups))
+        for (ind, ratios) in enumerate(log_ratios):
+            ratios = np.concatenate([ratios, ratios])
+            valid = ~np.isnan(ratios)
+            counts = np.bincount(ids[valid], minlength=num_groups)
+            sums = np.bincount(ids[valid], weights=ratios[valid], minlength=num_groups)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result[ind] = sums / counts
+        return np.exp(result)
+
+    def group_label(self, group):
+        bench_ind, opt_ind = divmod(group, self.num_opts)
+        bench = self.benchmarks[bench_ind] if bench_ind < len(self.benchmarks) else 'ALL'
+        return bench, self.opt_names[opt_ind]
+
+    def bootstrap(self, counter, num_samples, confidence, rng):
+        '''Confidence intervals of geometric means (arrays of lower and upper
+           bounds, same shape as geomeans)'''
+        samples = []
+        for first in range(0, num_samples, BOOTSTRAP_CHUNK):
+            chunk = min(BOOTSTRAP_CHUNK, num_samples - first)
+            resampled = [group.resampled_means(counter, rng, chunk)[:, pos]
+                         for (group, pos) in zip(self.groups, self.positions)]
+            for ind in range(chunk):
+                means = [m[ind] for m in resampled]
+                samples.append(self.geomeans(self.log_ratios(means)))
+        samples = np.array(samples)
+        alpha = (1.0 - confidence) / 2
+        with warnings.catch_warnings():
+            # Groups which are absent in all datasets are NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            lower = np.nanpercentile(samples, 100 * alpha, axis=0)
+            upper = np.nanpercentile(samples, 100 * (1 - alpha), axis=0)
+        return lower, upper
+
+def dataset_labels(paths):
+    '''Short labels for datasets: shortest unique trailing parts of paths
+       without extensions (e.g. "tcmalloc" or "haswell/by_compiler/boot")'''
+    parts = [os.path.splitext(os.path.normpath(p))[0].split(os.sep) for p in paths]
+    for num in range(1, max(len(p) for p in parts) + 1):
+        labels = ['/'.join(p[-num:]) for p in parts]
+        if len(set(labels)) == len(labels):
+            return labels
+    return paths
+
+def fmt_ratio(value, lower=None, upper=None):
+    if np.isnan(value):
+        return '-'
+    if lower is None:
+        return '{:.3f}'.format(value)
+    return '{:.3f} [{:.3f}, {:.3f}]'.format(value, lower, upper)
+
+def report_counter(comp, counter, labels, args, rng, out):
+    means = comp.tu_means(counter)
+    log_ratios = comp.log_ratios(means)
+    geomeans = comp.geomeans(log_ratios)
+    use_bootstrap = args.bootstrap > 0 and comp.has_repeats()
+    if use_bootstrap:
+        lower, upper = comp.bootstrap(counter, args.bootstrap, args.confidence, rng)
+
+    out.write('\n# {}: ratio vs. \'{}\' (geometric mean{})\n'.format(
+                counter, labels[0],
+                ', {:.0%} bootstrap CI'.format(args.confidence) if use_bootstrap else ''))
+    width = 26 if use_bootstrap else 10
+    out.write('{:<20} {:<8} '.format('benchmark', 'opt') +
+              ' '.join('{:>{}}'.format(l, width) for l in labels[1:]) + '\n')
+    num_groups = geomeans.shape[1]
+    order = sorted(range(num_groups), key=lambda g: comp.group_label(g)[::-1])
+    for group in order:
+        if np.all(np.isnan(geomeans[:, group])):
+            continue
+        bench, opt = comp.group_label(group)
+        cells = []
+        for ind in range(len(labels) - 1):
+            if use_bootstrap:
+                cell = fmt_ratio(geomeans[ind, group], lower[ind, group], upper[ind, group])
+            else:
+                cell = fmt_ratio(geomeans[ind, group])
+            cells.append('{:>{}}'.format(cell, width))
+        out.write('{:<20} {:<8} '.format(bench, opt or '-') + ' '.join(cells) + '\n')
+
+    base = means[0]
+    for (ind, ratios) in enumerate(log_ratios):
+        candidates = np.flatnonzero(~np.isnan(ratios) & (base >= args.min_value))
+        top = candidates[np.argsort(-ratios[candidates], kind='mergesort')][:args.top]
+        out.write('\n# {}: most regressed TUs, \'{}\' vs. \'{}\'\n'.format(
+                    counter, labels[ind + 1], labels[0]))
+        out.write('{:>8} {:>14} {:>14}  {:<8} {}\n'.format(
+                    'ratio', labels[0][:14], labels[ind + 1][:14], 'opt', 'name'))
+        for tu in top:
+            out.write('{:>8.3f} {:>14.6g} {:>14.6g}  {:<8} {}\n'.format(
+                        np.exp(ratios[tu]), base[tu], means[ind + 1][tu],
+                        comp.opt_names[comp.opt_ids[tu]] or '-',
+                        comp.tu_names[comp.name_ids[tu]]))
+
+def write_tu_csv(comp, labels, dest):
+    '''Write per-TU means and ratios of all counters in CSV format'''
+    header = ['name', 'opt']
+    columns = []
+    for counter in comp.counters:
+        means = comp.tu_means(counter)
+        header += ['{}:{}'.format(counter, l) for l in labels]
+        columns += means
+        header += ['{}:{}/{}'.format(counter, l, labels[0]) for l in labels[1:]]
+        columns += [np.exp(r) for r in comp.log_ratios(means)]
+    dest.write(','.join('"{}"'.format(h) for h in header) + '\n')
+    for (row, (name_id, opt_id)) in enumerate(zip(comp.name_ids, comp.opt_ids)):
+        values = ['' if np.isnan(col[row]) else repr(float(col[row])) for col in columns]
+        dest.write('"{}","{}",'.format(comp.tu_names[name_id], comp.opt_names[opt_id]) +
+                   ','.join(values) + '\n')
+
+def run(args):
+    try:
+        datasets = [colstore.open_dataset(path) for path in args.datasets]
+        comp = Comparison(datasets, args.counters)
+    except (colstore.StoreError, CompareError) as ex:
+        error(str(ex))
+    labels = dataset_labels(args.datasets)
+    rng = np.random.RandomState(args.seed)
+    out = sys.stdout
+    out.write('# {} common (name, opt) pairs\n'.format(len(comp.keys)))
+    for counter in args.counters:
+        report_counter(comp, counter, labels, args, rng, out)
+    if args.output:
+        write_tu_csv(comp, labels, args.output)
+
+def main():
+    parser = argparse.ArgumentParser(description='compare two or more sets of'
+                ' benchmark results (the first one is the baseline)')
+    parser.add_argument('datasets', nargs='+', metavar='DATASET',
+                help='benchmark results: CSV files (e.g. produced by convert_result.py),'
+                     ' column store files (see colstore.py) or perf logs')
+    parser.add_argument('-c', '--counter', action='append', dest='counters',
+                help='counter to compare (can be specified several times,'
+                     ' default: task-clock)')
+    parser.add_argument('--top', type=int, default=20,
+                help='number of most regressed TUs to show (default: %(default)s)')
+    parser.add_argument('--min-value', type=float, default=0,
+                help='ignore TUs with baseline value below this threshold when'
+                     ' ranking regressions (default: %(default)s)')
+    parser.add_argument('--bootstrap', type=int, default=200, metavar='N',
+                help='number of bootstrap samples, 0 disables confidence intervals'
+                     ' (default: %(default)s)')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                help='confidence level (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                help='random seed for bootstrap (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                help='write per-TU means and ratios to a CSV file')
+    args = parser.parse_args()
+    if len(args.datasets) < 2:
+        parser.error('at least two datasets are required')
+    if not args.counters:
+        args.counters = ['task-clock']
+    if not 0 < args.confidence < 1:
+        parser.error('--confidence must be between 0 and 1')
+    run(args)
+
+if __name__ == '__main__':
+    main()
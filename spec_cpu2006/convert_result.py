@@ -9,9 +9,15 @@ import re
 import os, os.path
 import sys
 import argparse
+import csv
+import itertools
+import multiprocessing
+import shutil
+import tempfile
 
 # Local modules
-from perf_report import PerfReport, ReportError
+from perf_report import iter_runs, net_items, ReportError
+import noise
 
 def error(msg):
     '''Print error message to stderr and exit with non-zero status'''
@@ -24,55 +30,305 @@ def to_num(s):
     except ValueError:
         return float(s)
 
-def process_file(src_name, dest, keys=[]):
-    with open(src_name, 'r') as src:
+# Number of runs used to guess which values have been measured (only when
+# reading from a pipe, files are converted using the exact set of values)
+HEADER_LOOKAHEAD = 10
+# Number of rows written at once
+WRITE_CHUNK = 4096
+
+# Column added by --weights
+WEIGHT_COLUMN = 'weight'
+
+def csv_writer(dest):
+    '''CSV writer of the output: text (names, configuration values) is quoted,
+       numbers are not, missing values (None) are written as empty strings'''
+    return csv.writer(dest, lineterminator='\n', quoting=csv.QUOTE_NONNUMERIC)
+
+def parse_field(s):
+    '''Convert a field read by csv.reader back into the value written by
+       csv_writer'''
+    if s == '':
+        return None
+    try:
+        return to_num(s)
+    except ValueError:
+        return s
+
+def load_weights(path):
+    '''Read weights of units from a CSV file with "name" and "weight" columns
+       (e.g. written by import_compdb.py). Returns dictionary: name -> weight'''
+    with open(path, 'r') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if 'name' not in header or WEIGHT_COLUMN not in header:
+            raise ValueError('\'{}\' has no \'name\' or \'{}\' column'.format(
+                                path, WEIGHT_COLUMN))
+        name_col, weight_col = header.index('name'), header.index(WEIGHT_COLUMN)
+        return dict((row[name_col], to_num(row[weight_col])) for row in reader if row)
+
+def run_items(run, passes, weights=None, overhead=None):
+    items = run.items()
+    if overhead:
+        # Values corrected for the overhead measured by build_spec.py --calibrate
+        items = list(items) + net_items(run, overhead)
+    if passes:
+        items = list(items) + run.report_items()
+    if run.config:
+        # Configuration of a sweep run (string columns, e.g. 'opt')
+        items = list(items) + list(run.config)
+    if weights is not None:
+        # Units missing from the weights file represent themselves only
+        items = list(items) + [(WEIGHT_COLUMN, weights.get(run.name, 1))]
+    return items
+
+def process_stream(src, dest, passes=False, weights=None):
+    '''Convert perf report read from src (any iterable of lines, e.g. a file
+       or a pipe) and write it to dest. Runs are processed one at a time, so
+       memory usage does not depend on the size of the input. If passes is
+       True, values parsed from compiler reports (-ftime-report, -fmem-report)
+       are converted as well. weights - dictionary returned by load_weights.
+       If the log has OVERHEAD markers, overhead-corrected values are added
+       (see perf_report.net_items)'''
+    overhead = {}
+    runs = iter_runs(src, ',', overhead)
+    head = list(itertools.islice(runs, HEADER_LOOKAHEAD))
+    if len(head) == 0:
+        raise ReportError('no data')
+
+    keys_set = set()
+    for run in head:
+        keys_set |= set(k for (k, _) in run_items(run, passes, weights, overhead))
+    keys = list(sorted(keys_set))
+    assert(len(keys) != 0)
+    writer = csv_writer(dest)
+    writer.writerow(['name'] + keys)
+
+    for run in itertools.chain(head, runs):
+        values = dict(run_items(run, passes, weights, overhead))
+        writer.writerow([run.name] + [values.get(k) for k in keys])
+
+NOISE_KEYS = [noise.MIGRATIONS, noise.CONTEXT_SWITCHES, noise.PAGE_FAULTS]
+
+def convert_worker_func(job):
+    '''Worker function for child processes in multi-file aggregation.
+       Converts a log into a temporary CSV file without header. Columns are
+       appended in the order in which values first appear, so rows written
+       before a value appeared are shorter than the others. If noise_filter
+       is given, runs are also checked for disturbances (see noise.py).
+       Returns (keys, complete, noise, error message), complete is True if
+       all rows have all the columns, noise is the result of
+       NoiseFilter.classify (or None)'''
+    src_path, tmp_path, source, passes, noise_filter, weights = job
+    keys = []
+    index = {}
+    num_rows = 0
+    complete = True
+    if noise_filter is not None:
+        noise_keys = NOISE_KEYS + [noise_filter.counter]
+    prefix = [] if source is None else [source]
+    overhead = {}
+    try:
+        with open(src_path, 'r') as src:
+            with open(tmp_path, 'w') as dest:
+                writer = csv_writer(dest)
+                lines = []
+                for run in iter_runs(src, ',', overhead):
+                    values = [None] * len(keys)
+                    for (key, value) in run_items(run, passes, weights, overhead):
+                        ind = index.get(key)
+                        if ind is None:
+                            ind = index[key] = len(keys)
+                            keys.append(key)
+                            values.append(None)
+                            complete = complete and num_rows == 0
+                        values[ind] = value
+                    lines.append([run.name] + prefix + values)
+                    if noise_filter is not None:
+                        noise_filter.add(num_rows, run.name,
+                                         dict((k, run.get_value(k)) for k in noise_keys),
+                                         run.config)
+                    num_rows += 1
+                    if len(lines) == WRITE_CHUNK:
+                        writer.writerows(lines)
+                        lines = []
+                writer.writerows(lines)
+    except (ReportError, IOError) as ex:
+        return (None, False, None, str(ex))
+    if num_rows == 0:
+        return (None, False, None, 'no data')
+    result = None if noise_filter is None else noise_filter.classify()
+    return (keys, complete, result, None)
+
+def merge_file(src, dest, keys, complete, all_keys, num_fixed, noise_mode=None,
+               noise_result=None):
+    '''Append a temporary file produced by convert_worker_func to dest,
+       reordering its columns according to all_keys. num_fixed is the number
+       of leading columns (name, source), which are copied as is.
+       noise_mode - noise.MODE_MARK (add the column with reasons),
+       noise.MODE_DROP (skip disturbed runs) or None'''
+    if complete and keys == all_keys and noise_mode is None:
+        shutil.copyfileobj(src, dest)
+        return
+    # Position of each output column in the rows of src (None if absent)
+    index = dict((k, i + num_fixed) for (i, k) in enumerate(keys))
+    positions = [index.get(k) for k in all_keys]
+    reasons, dropped, _ = noise_result or ({}, set(), None)
+    writer = csv_writer(dest)
+    lines = []
+    for (row, values) in enumerate(csv.reader(src)):
+        if noise_mode == noise.MODE_DROP and row in dropped:
+            continue
+        size = len(values)
+        out = values[:num_fixed]
+        out += [parse_field(values[pos]) if pos is not None and pos < size else None
+                for pos in positions]
+        if noise_mode == noise.MODE_MARK:
+            out.append(reasons.get(row, ''))
+        lines.append(out)
+        if len(lines) == WRITE_CHUNK:
+            writer.writerows(lines)
+            lines = []
+    writer.writerows(lines)
+
+def aggregate(inputs, dest, jobs, passes=False, tag=False, noise_filter=None,
+              noise_mode=None, weights=None):
+    '''Convert several logs in parallel and write a single CSV file.
+       inputs - list of (path, source name), the source name is written into
+       the "source" column if tag is True. The header is the union of values
+       measured in all the files. If noise_filter (noise.NoiseFilter) is given,
+       disturbed runs are marked or discarded (depending on noise_mode); each
+       file is filtered separately. weights - see process_stream.
+       Returns dictionary: benchmark -> noise.BenchNoise (empty, if noise
+       filtering is not used)'''
+    tmp_dir = tempfile.mkdtemp(prefix='convert-')
+    try:
+        queue = [(path, os.path.join(tmp_dir, str(ind)), source if tag else None, passes,
+                  noise_filter, weights)
+                 for (ind, (path, source)) in enumerate(inputs)]
+        pool = multiprocessing.Pool(min(jobs, len(queue)))
         try:
-            report = PerfReport(src, ',')
-            if len(report) == 0:
-                error('No data in ' + src_name)
-
-            if len(keys) == 0:
-                keys_set = set()
-                # Use first 10 rows to guess which values have been measured
-                for run in report[:10]:
-                    keys_set |= set(run.keys())
-                keys = list(sorted(keys_set))
-                assert(len(keys) != 0)
-                # FIXME!!! This gets written several times
-                dest.write(','.join(['"{}"'.format(k) for k in ['name'] + keys] + '\n'))
-
-            for run in report:
-                dest.write('"{}",'.format(run.name))
-                line = ','.join([str(run[k].value) if k in run else '' for k in keys])
-                dest.write(line + '\n')
-        except ReportError as ex:
-            error('Failed to parse \'{}\': {}'.format(src_name, ex))
+            results = pool.map_async(convert_worker_func, queue, 1).get()
+            pool.close()
+            pool.join()
+        except KeyboardInterrupt:
+            pool.terminate()
+            error('interrupted')
+        all_keys = set()
+        bench_stats = {}
+        for ((path, _), (keys, _, noise_result, msg)) in zip(inputs, results):
+            if msg is not None:
+                error('Failed to parse \'{}\': {}'.format(path, msg))
+            all_keys.update(keys)
+            if noise_result is not None:
+                for (bench, bs) in noise_result[2].items():
+                    bench_stats.setdefault(bench, noise.BenchNoise()).update(bs)
+        all_keys = sorted(all_keys)
+        fixed = ['name', 'source'] if tag else ['name']
+        header = fixed + all_keys
+        if noise_mode == noise.MODE_MARK:
+            header.append(noise.NOISE_COLUMN)
+        csv_writer(dest).writerow(header)
+        for (job, (keys, complete, noise_result, _)) in zip(queue, results):
+            with open(job[1], 'r') as src:
+                merge_file(src, dest, keys, complete, all_keys, len(fixed),
+                           noise_mode, noise_result)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return bench_stats
 
+def list_inputs(root):
+    '''Find logs in a directory (recursively). Returns list of (path, path
+       relative to root), sorted by the relative path'''
+    inputs = []
+    for (dirpath, dirnames, fnames) in os.walk(root):
+        dirnames.sort()
+        for fname in sorted(fnames):
+            # Skip hidden files and CSV files (e.g. conversion results)
+            if fname.startswith('.') or fname.endswith('.csv'):
+                continue
+            full_path = os.path.join(dirpath, fname)
+            rel_path = os.path.relpath(full_path, root).replace(os.sep, '/')
+            inputs.append((full_path, rel_path))
+    return inputs
 
 def run(args):
+    noise_filter = None
+    if args.noise:
+        noise_filter = noise.NoiseFilter(args.noise_counter, args.noise_threshold,
+                                         args.noise_floor / 100.0)
+    weights = None
+    if args.weights:
+        try:
+            weights = load_weights(args.weights)
+        except (IOError, ValueError) as ex:
+            error('Failed to read weights: {}'.format(ex))
     if os.path.isdir(args.input):
-        files = [os.path.join(args.input, f) for f in os.listdir(args.input)]
-        files = filter(os.path.isfile, files)
-        if len(files) == 0:
+        inputs = list_inputs(args.input)
+        if len(inputs) == 0:
             error('no files in the input directory')
-        keys = []
-        for full_path in files:
-            process_file(full_path, args.output, keys)
+        jobs = args.jobs
+    elif args.input == '-':
+        try:
+            process_stream(sys.stdin, args.output, args.passes, weights)
+        except ReportError as ex:
+            error('Failed to parse standard input: {}'.format(ex))
+        return
     elif os.path.isfile(args.input):
-        process_file(args.input, args.output)
+        inputs = [(args.input, os.path.basename(args.input))]
+        jobs = 1
     else:
         error('invalid input file')
+    bench_stats = aggregate(inputs, args.output, jobs, args.passes, args.tag_source,
+                            noise_filter, args.noise, weights)
+    if noise_filter is not None:
+        # Do not mix the summary with the converted data
+        noise.print_summary(bench_stats, args.noise_counter,
+                            sys.stderr if args.output is sys.stdout else sys.stdout)
 
 def main():
     parser = argparse.ArgumentParser('aggregate and convert'
                 ' GCC performance statistics produced by build_spec.py scripts')
     parser.add_argument('input',
-                help='the directory containing input files or a single input file')
+                help='the directory containing input files (searched recursively,'
+                     ' CSV files are skipped) or a single input file'
+                     ' (\'-\' for standard input)')
     parser.add_argument('output', type=argparse.FileType('w'),
                 help='output file (in CSV format)')
+    parser.add_argument('--passes', action='store_true',
+                help='add per-pass time and GGC memory columns (requires logs'
+                     ' produced by build_spec.py --time-report)')
+    parser.add_argument('--tag-source', action='store_true',
+                help='add "source" column containing the path of the input file'
+                     ' (relative to the input directory)')
+    parser.add_argument('--weights', metavar='CSV',
+                help='add "{}" column: the weight of each unit from a CSV file with "name"'
+                     ' and "{}" columns (e.g. written by import_compdb.py; units missing'
+                     ' from the file get weight 1)'.format(WEIGHT_COLUMN, WEIGHT_COLUMN))
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                help='number of files converted in parallel (default: %(default)s)')
+    parser.add_argument('--noise', choices=[noise.MODE_MARK, noise.MODE_DROP],
+                help='find disturbed runs (using cpu-migrations, context-switches,'
+                     ' page-faults and outliers among repeats of each TU) and mark'
+                     ' them (add \'{}\' column) or drop them'.format(noise.NOISE_COLUMN))
+    parser.add_argument('--noise-counter', default=noise.DEFAULT_COUNTER,
+                help='counter checked for outliers by --noise (default: %(default)s)')
+    parser.add_argument('--noise-threshold', type=float, default=noise.DEFAULT_THRESHOLD,
+                help='robust z-score threshold for outliers (default: %(default)s)')
+    parser.add_argument('--noise-floor', type=float, default=noise.DEFAULT_FLOOR * 100,
+                metavar='PERCENT',
+                help='lower bound of the spread (MAD) of repeats relative to their median,'
+                     ' i.e. the expected run-to-run noise (default: %(default)s)')
     args = parser.parse_args()
-    if not os.path.exists(args.input):
+    if args.input != '-' and not os.path.exists(args.input):
         parser.error('input file/directory does not exist')
+    if args.jobs < 1:
+        parser.error('--jobs must be positive')
+    if args.input == '-' and args.tag_source:
+        parser.error('--tag-source can not be used with standard input')
+    if args.noise_floor < 0:
+        parser.error('--noise-floor must not be negative')
+    if args.input == '-' and args.noise:
+        parser.error('--noise can not be used with standard input')
     run(args)
 
 if __name__ == '__main__':
@@ -0,0 +1,209 @@
+#!/usr/bin/env python2.7
+
+# This script searches for possible compile time hogs: translation units
+# whose compilation with optimization takes suspiciously long compared to
+# other units of similar size.
+#
+# The cost of compiling each TU without optimization (the baseline, -O0 by
+# default) is used as a measure of its size. For each benchmark and
+# optimization level the script fits a power law model
+#     log(cost) = a + b * log(baseline cost)
+# and flags TUs, whose residuals are outliers (robust z-score, computed
+# using median and MAD of residuals, exceeds the threshold). Flagged TUs
+# are ranked by absolute excess cost (actual minus predicted).
+
+from __future__ import print_function
+
+# System modules
+import os, os.path
+import sys
+import argparse
+
+# Local modules
+import colstore
+from compare import Grouped
+
+def error(msg):
+    '''Print error message to stderr and exit with non-zero status'''
+    sys.stderr.write('Error: {}\n'.format(msg))
+    sys.exit(1)
+
+try:
+    import numpy as np
+except ImportError:
+    error('required package \'numpy\' not found')
+
+class HogError(Exception): pass
+
+# Benchmarks with fewer TUs are fitted together with all other benchmarks
+MIN_TUS         = 8
+# Scale factor which makes MAD a consistent estimator of standard deviation
+MAD_SCALE       = 1.4826
+
+class Hog:
+    def __init__(self, name, opt, baseline, actual, predicted, score):
+        self.name = name
+        self.opt = opt
+        self.baseline = baseline
+        self.actual = actual
+        self.predicted = predicted
+        self.score = score
+
+    @property
+    def excess(self):
+        return self.actual - self.predicted
+
+def robust_scores(residuals):
+    '''Robust z-scores of residuals'''
+    median = np.median(residuals)
+    mad = np.median(np.abs(residuals - median)) * MAD_SCALE
+    if mad == 0:
+        return np.zeros_like(residuals)
+    return (residuals - median) / mad
+
+def fit_model(x, y, threshold):
+    '''Fit y = a + b * x (in log space), refitting once without outliers.
+       Return (a, b)'''
+    b, a = np.polyfit(x, y, 1)
+    inliers = np.abs(robust_scores(y - (a + b * x))) <= threshold
+    if inliers.sum() >= MIN_TUS and not inliers.all():
+        b, a = np.polyfit(x[inliers], y[inliers], 1)
+    return a, b
+
+def load_measurements(inputs, counter):
+    '''Load datasets and compute mean counter value for each (name, opt).
+       inputs - list of (opt, path), opt overrides the 'opt' column.
+       Return (names, opts, name_ids, opt_ids, means)'''
+    names = {}
+    opts = {}
+    all_keys = []
+    all_values = []
+    for (opt, path) in inputs:
+        ds = colstore.open_dataset(path)
+        if counter not in ds:
+            raise HogError('\'{}\' has no \'{}\' column'.format(path, counter))
+        name_map = np.array([names.setdefault(n, len(names)) for n in ds.dictionary('name')],
+                            dtype=np.int64)
+        if opt is not None:
+            opt_ids = np.repeat(opts.setdefault(opt, len(opts)), len(ds))
+        elif 'opt' in ds:
+            opt_map = np.array([opts.setdefault(o, len(opts)) for o in ds.dictionary('opt')],
+                               dtype=np.int64)
+            opt_ids = opt_map[ds['opt']]
+        else:
+            raise HogError('\'{}\' has no \'opt\' column, please specify optimization'
+                           ' level as OPT=FILE'.format(path))
+        all_keys.append(np.column_stack([name_map[ds['name']], opt_ids]))
+        all_values.append(np.asarray(ds[counter], dtype=float))
+    # Build keys after all optimization levels are known
+    pairs = np.concatenate(all_keys)
+    num_opts = len(opts)
+    group = Grouped(pairs[:, 0] * num_opts + pairs[:, 1],
+                    {counter: np.concatenate(all_values)})
+    name_list = [n for (n, _) in sorted(names.items(), key=lambda p: p[1])]
+    opt_list = [o for (o, _) in sorted(opts.items(), key=lambda p: p[1])]
+    return (name_list, opt_list, group.keys // num_opts, group.keys % num_opts,
+            group.means(counter))
+
+def find_hogs(inputs, counter, baseline_opt, threshold):
+    '''Return list of Hog objects (unsorted)'''
+    names, opts, name_ids, opt_ids, means = load_measurements(inputs, counter)
+    if baseline_opt not in opts:
+        raise HogError('no measurements for baseline optimization level \'{}\''.format(
+                        baseline_opt))
+    base_opt = opts.index(baseline_opt)
+    baseline = np.full(len(names), np.nan)
+    is_base = opt_ids == base_opt
+    baseline[name_ids[is_base]] = means[is_base]
+    bench_of_name = np.array([n.split('/', 1)[0] for n in names])
+
+    hogs = []
+    for (opt_ind, opt) in enumerate(opts):
+        if opt_ind == base_opt:
+            continue
+        rows = np.flatnonzero(opt_ids == opt_ind)
+        base = baseline[name_ids[rows]]
+        valid = (base > 0) & (means[rows] > 0)
+        rows, base = rows[valid], base[valid]
+        if len(rows) < MIN_TUS:
+            continue
+        x = np.log(base)
+        y = np.log(means[rows])
+        benchmarks = bench_of_name[name_ids[rows]]
+        # Small benchmarks use the model and residual statistics of all TUs
+        a, b = fit_model(x, y, threshold)
+        predicted = a + b * x
+        scores = robust_scores(y - predicted)
+        for bench in np.unique(benchmarks):
+            sel = benchmarks == bench
+            if sel.sum() < MIN_TUS:
+                continue
+            a, b = fit_model(x[sel], y[sel], threshold)
+            predicted[sel] = a + b * x[sel]
+            scores[sel] = robust_scores(y[sel] - predicted[sel])
+        for ind in np.flatnonzero(scores > threshold):
+            row = rows[ind]
+            hogs.append(Hog(names[name_ids[row]], opt, base[ind], means[row],
+                            np.exp(predicted[ind]), scores[ind]))
+    return hogs
+
+def parse_input(arg):
+    '''Parse input specification: FILE or OPT=FILE'''
+    if not os.path.exists(arg) and '=' in arg:
+        opt, path = arg.split('=', 1)
+        return (opt, path)
+    return (None, arg)
+
+def run(args):
+    inputs = [parse_input(arg) for arg in args.inputs]
+    for (_, path) in inputs:
+        if not os.path.isfile(path):
+            error('file \'{}\' does not exist'.format(path))
+    try:
+        hogs = find_hogs(inputs, args.counter, args.baseline, args.threshold)
+    except (colstore.StoreError, HogError) as ex:
+        error(str(ex))
+    # Ties are broken by name to keep the output reproducible
+    hogs.sort(key=lambda h: (-h.excess, h.name, h.opt))
+    hogs = hogs[:args.top]
+
+    # task-clock is measured in milliseconds
+    scale, unit = (1e-3, 's') if args.counter == 'task-clock' else (1, '')
+    print('# {} possible compile time hogs ({}, baseline: {})'.format(
+            len(hogs), args.counter, args.baseline))
+    print('{:>4} {:>12} {:>12} {:>12} {:>12} {:>7}  {:<8} {}'.format(
+            'rank', 'baseline', 'actual', 'predicted', 'excess' + (', ' + unit if unit else ''),
+            'score', 'opt', 'name'))
+    for (rank, hog) in enumerate(hogs):
+        print('{:>4} {:>12.6g} {:>12.6g} {:>12.6g} {:>12.6g} {:>7.1f}  {:<8} {}'.format(
+                rank + 1, hog.baseline, hog.actual, hog.predicted, hog.excess * scale,
+                hog.score, hog.opt, hog.name))
+    if args.output:
+        args.output.write('"rank","name","opt","baseline","actual","predicted","excess","score"\n')
+        for (rank, hog) in enumerate(hogs):
+            args.output.write('{},"{}","{}",{!r},{!r},{!r},{!r},{!r}\n'.format(
+                rank + 1, hog.name, hog.opt, float(hog.baseline), float(hog.actual),
+                float(hog.predicted), float(hog.excess), float(hog.score)))
+
+def main():
+    parser = argparse.ArgumentParser(description='find translation units which'
+                ' take suspiciously long time to compile with optimization')
+    parser.add_argument('inputs', nargs='+', metavar='[OPT=]FILE',
+                help='benchmark results: CSV files (bench_results data or convert_result.py'
+                     ' output), column store files or perf logs. Files without \'opt\''
+                     ' column must be prefixed with optimization level, e.g. O2=result.csv')
+    parser.add_argument('-c', '--counter', default='task-clock',
+                help='counter used as the measure of compilation cost (default: %(default)s)')
+    parser.add_argument('-b', '--baseline', default='O0',
+                help='baseline optimization level (default: %(default)s)')
+    parser.add_argument('-t', '--threshold', type=float, default=3.5,
+                help='robust z-score threshold for outliers (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=30,
+                help='maximal number of TUs to report (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                help='save the list of TUs in CSV format')
+    args = parser.parse_args()
+    run(args)
+
+if __name__ == '__main__':
+    main()
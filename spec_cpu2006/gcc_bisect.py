@@ -0,0 +1,131 @@
+# Bisection of compile time regressions.
+#
+# Given an ordered list of compiler builds, where the first one is known to
+# be good (fast) and the last one is bad (slow), binary search finds the
+# first bad build. Each build is measured in rounds: a round compiles each
+# of the regressed TUs once and yields a single value (the sum of the
+# measured counter over the TUs). A build is classified by comparing the
+# mean of its rounds with the midpoint between the means of the first and
+# the last builds: more rounds are run (of the build whose uncertainty
+# dominates) until the difference is significant at the given confidence
+# level or the maximal number of rounds is reached.
+#
+# The measurement itself (compiling TUs and reading perf output) is done
+# by build_spec.py --bisect.
+
+from __future__ import print_function
+
+import math
+
+# Local modules
+import stats
+
+class BisectError(Exception): pass
+
+GOOD    = 'good'
+BAD     = 'bad'
+
+class Build:
+    '''A compiler build and its measurements'''
+    def __init__(self, label):
+        # Label, as given in the list of builds (directory or revision)
+        self.label = label
+        # Directory containing cc1 and cc1plus (resolved when needed)
+        self.path = None
+        # Value measured in each round
+        self.samples = []
+        self.verdict = None
+
+    def mean(self):
+        return stats.mean(self.samples)
+
+    def var_of_mean(self):
+        '''Variance of the mean value'''
+        return stats.stdev(self.samples) ** 2 / len(self.samples)
+
+class Bisector:
+    def __init__(self, builds, measure, min_repeat, max_repeat, confidence=0.99):
+        '''builds - list of Build (the first one is good, the last one is bad),
+           measure - function, which performs a round of measurement of a build
+           and returns the measured value'''
+        if len(builds) < 2:
+            raise BisectError('at least two builds are required')
+        self.builds = builds
+        self.measure = measure
+        self.min_repeat = min_repeat
+        self.max_repeat = max_repeat
+        self.confidence = confidence
+
+    def _sample(self, build):
+        build.samples.append(self.measure(build))
+
+    def _prepare(self, builds):
+        for build in builds:
+            while len(build.samples) < self.min_repeat:
+                self._sample(build)
+
+    def _quantile(self, builds):
+        df = min(len(build.samples) for build in builds) - 1
+        return stats.t_ppf(1 - (1 - self.confidence) / 2, df)
+
+    def _refine(self, contributions, what):
+        '''Run another round of the build, whose contribution to the variance
+           is the largest. contributions - list of (variance, build)'''
+        for (_, build) in sorted(contributions, key=lambda c: -c[0]):
+            if len(build.samples) < self.max_repeat:
+                self._sample(build)
+                return
+        raise BisectError('failed to decide whether {} after {} rounds (try larger'
+                          ' --max-repeat or lower confidence)'.format(what, self.max_repeat))
+
+    def check_endpoints(self):
+        '''Make sure that the last build is significantly slower than the
+           first one. Returns the relative slowdown'''
+        good, bad = self.builds[0], self.builds[-1]
+        self._prepare([good, bad])
+        while True:
+            diff = bad.mean() - good.mean()
+            contributions = [(good.var_of_mean(), good), (bad.var_of_mean(), bad)]
+            se = math.sqrt(sum(var for (var, _) in contributions))
+            if abs(diff) > self._quantile([good, bad]) * se:
+                if diff < 0:
+                    raise BisectError('the last build ({}) is faster than the first one'
+                                      ' ({})'.format(bad.label, good.label))
+                good.verdict, bad.verdict = GOOD, BAD
+                return diff / good.mean()
+            self._refine(contributions, 'the last build is slower than the first one')
+
+    def classify(self, build):
+        '''Classify build as GOOD or BAD'''
+        good, bad = self.builds[0], self.builds[-1]
+        self._prepare([build])
+        while True:
+            midpoint = (good.mean() + bad.mean()) / 2
+            diff = build.mean() - midpoint
+            contributions = [(build.var_of_mean(), build), (good.var_of_mean() / 4, good),
+                             (bad.var_of_mean() / 4, bad)]
+            se = math.sqrt(sum(var for (var, _) in contributions))
+            if abs(diff) > self._quantile([good, bad, build]) * se:
+                build.verdict = BAD if diff > 0 else GOOD
+                return build.verdict
+            self._refine(contributions, '{} is good or bad'.format(build.label))
+
+    def run(self):
+        '''Find the first bad build. Returns (index of the last good build,
+           index of the first bad build)'''
+        slowdown = self.check_endpoints()
+        print('{} is {:.1%} slower than {}'.format(self.builds[-1].label, slowdown,
+                                                  self.builds[0].label))
+        lo, hi = 0, len(self.builds) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            build = self.builds[mid]
+            verdict = self.classify(build)
+            print('{}: {} ({} rounds, {:+.1%} relative to {})'.format(
+                    build.label, verdict, len(build.samples),
+                    build.mean() / self.builds[0].mean() - 1, self.builds[0].label))
+            if verdict == BAD:
+                hi = mid
+            else:
+                lo = mid
+        return lo, hi
@@ -0,0 +1,463 @@
+#!/usr/bin/env python2.7
+
+# Regression history. Results of benchmark runs (CSV files produced by
+# convert_result.py) are loaded into a local SQLite database keyed by
+# (revision, host, config, opt, TU); repeats of each TU are averaged on
+# ingestion. Runs are appended incrementally, e.g. after each nightly
+# build. The database can be queried for the time series of a TU and for
+# change points: step changes of a counter between revisions.
+# Results of configuration sweeps (alloc, compiler columns, see
+# build_spec.py --sweep-*) are stored under composite optimization levels,
+# e.g. "O2_g alloc=tcmalloc" (see perf_report.config_label).
+#
+# Revisions are ordered by their position: the SVN revision number, if the
+# revision looks like "r228065" or ".../trunk@228065", otherwise the next
+# position after the last ingested run (use --position to set it).
+#
+# Change points of each series are found by binary segmentation: the split
+# which maximizes the difference of segment means (scaled by its standard
+# error) is accepted if the difference is significant (the noise level of
+# the series is estimated from successive differences, so it is not
+# inflated by the steps themselves) and the medians of the segments differ
+# by at least the given threshold; then both segments are searched again.
+
+from __future__ import print_function
+
+# System modules
+import re
+import os, os.path
+import sys
+import csv
+import math
+import time
+import socket
+import sqlite3
+import argparse
+import itertools
+
+# Local modules
+import stats
+import perf_report
+
+def error(msg):
+    '''Print error message to stderr and exit with non-zero status'''
+    sys.stderr.write('Error: {}\n'.format(msg))
+    sys.exit(1)
+
+class HistoryError(Exception): pass
+
+DEFAULT_COUNTER     = 'task-clock'
+# Columns of convert_result.py output, which are not counters
+KEY_COLUMNS         = ['name', 'source'] + perf_report.CONFIG_KEYS
+NOISE_COLUMN        = 'noise'
+# Columns of the results table, which are not counters
+RESULT_COLUMNS      = ['tu', 'opt', 'run', 'repeats']
+REVISION_RE         = re.compile(r'(?:^r|@)(\d+)$')
+
+DEFAULT_THRESHOLD   = 5.0
+DEFAULT_Z_SCORE     = 5.0
+DEFAULT_MIN_SIZE    = 2
+# Lower bound of the noise level relative to the median (some series are
+# almost deterministic)
+MIN_REL_NOISE       = 0.002
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    revision    TEXT NOT NULL,
+    host        TEXT NOT NULL,
+    config      TEXT NOT NULL,
+    position    REAL NOT NULL,
+    source      TEXT,
+    ingested    TEXT,
+    UNIQUE (revision, host, config));
+CREATE TABLE IF NOT EXISTS tus (
+    id          INTEGER PRIMARY KEY,
+    name        TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS results (
+    tu          INTEGER NOT NULL,
+    opt         TEXT NOT NULL,
+    run         INTEGER NOT NULL,
+    repeats     INTEGER NOT NULL,
+    PRIMARY KEY (tu, opt, run)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_run ON results (run);
+'''
+
+def quote(name):
+    '''Quote SQL identifier'''
+    return '"{}"'.format(name.replace('"', '""'))
+
+def read_results(path):
+    '''Read CSV file produced by convert_result.py, average repeats of each
+       TU. Runs marked as disturbed (non-empty "noise" column) are skipped.
+       Returns (counters, rows): rows is a list of (name, opt, repeats, means),
+       opt is the configuration label (see perf_report.config_label), means
+       is a list of mean values of counters (None if not measured)'''
+    with open(path, 'r') as f:
+        reader = csv.reader(f)
+        try:
+            header = next(reader)
+        except StopIteration:
+            raise HistoryError('\'{}\' is empty'.format(path))
+        if 'name' not in header:
+            raise HistoryError('\'{}\' has no \'name\' column'.format(path))
+        index = dict((k, i) for (i, k) in enumerate(header))
+        counters = [k for k in header if k not in KEY_COLUMNS and k != NOISE_COLUMN]
+        columns = [index[k] for k in counters]
+        name_col = index['name']
+        config_cols = [index.get(k) for k in perf_report.CONFIG_KEYS]
+        noise_col = index.get(NOISE_COLUMN)
+        # (name, opt) -> [repeats, sums, counts]
+        groups = {}
+        order = []
+        for row in reader:
+            if not row or (noise_col is not None and row[noise_col]):
+                continue
+            key = (row[name_col], perf_report.config_label(
+                        ['' if col is None else row[col] for col in config_cols]))
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, [0.0] * len(columns), [0] * len(columns)]
+                order.append(key)
+            group[0] += 1
+            sums, counts = group[1], group[2]
+            for (i, col) in enumerate(columns):
+                if row[col] != '':
+                    sums[i] += float(row[col])
+                    counts[i] += 1
+    rows = []
+    for key in order:
+        repeats, sums, counts = groups[key]
+        rows.append(key + (repeats, [s / c if c else None for (s, c) in zip(sums, counts)]))
+    return counters, rows
+
+class Run:
+    '''A benchmark run (a CSV file loaded into the database)'''
+    def __init__(self, row):
+        self.id, self.revision, self.host, self.config, self.position = row
+
+class Change:
+    '''Change point of a series'''
+    def __init__(self, name, opt, before_run, after_run, before, after, z_score):
+        self.name = name
+        self.opt = opt
+        # The last run before the change and the first run after it
+        self.before_run = before_run
+        self.after_run = after_run
+        # Medians of the segments
+        self.before = before
+        self.after = after
+        self.z_score = z_score
+
+    @property
+    def rel_change(self):
+        return self.after / self.before - 1 if self.before else 0.0
+
+def best_split(values, lo, hi, min_size):
+    '''Find the split point of values[lo:hi], which maximizes the difference
+       of means of the two segments divided by sqrt(1/n1 + 1/n2). Returns
+       (index, difference of means, scale) or None'''
+    total = sum(values[lo:hi])
+    prefix = sum(values[lo:lo + min_size - 1])
+    best = None
+    for k in range(lo + min_size, hi - min_size + 1):
+        prefix += values[k - 1]
+        num_left = k - lo
+        num_right = hi - k
+        diff = (total - prefix) / num_right - prefix / num_left
+        scale = math.sqrt(1.0 / num_left + 1.0 / num_right)
+        if best is None or abs(diff) / scale > abs(best[1]) / best[2]:
+            best = (k, diff, scale)
+    return best
+
+def detect_changes(values, threshold, z_score=DEFAULT_Z_SCORE, min_size=DEFAULT_MIN_SIZE):
+    '''Find change points of a series (binary segmentation). threshold -
+       minimal relative change of medians (e.g. 0.05). Returns sorted list
+       of (index of the first value after the change, median before, median
+       after, z-score)'''
+    num = len(values)
+    if num < 2 * min_size:
+        return []
+    med = stats.median(values)
+    # A change can not exceed the range of values
+    if max(values) - min(values) < threshold * abs(med):
+        return []
+    diffs = [abs(b - a) for (a, b) in zip(values, values[1:])]
+    noise = max(stats.median(diffs) * stats.MAD_SCALE / math.sqrt(2),
+                abs(med) * MIN_REL_NOISE)
+    result = []
+    segments = [(0, num)]
+    while segments:
+        lo, hi = segments.pop()
+        if hi - lo < 2 * min_size:
+            continue
+        k, diff, scale = best_split(values, lo, hi, min_size)
+        z = abs(diff) / (scale * noise)
+        before = stats.median(values[lo:k])
+        after = stats.median(values[k:hi])
+        if z < z_score or before == 0 or abs(after / before - 1) < threshold:
+            continue
+        result.append((k, before, after, z))
+        segments += [(lo, k), (k, hi)]
+    return sorted(result)
+
+class History:
+    '''Regression history database'''
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.counters = set(row[1] for row in self.conn.execute('PRAGMA table_info(results)'))
+        self.counters -= set(RESULT_COLUMNS)
+
+    def close(self):
+        self.conn.close()
+
+    def _add_counters(self, counters):
+        for name in counters:
+            if name in self.counters:
+                continue
+            if name in RESULT_COLUMNS:
+                raise HistoryError('invalid counter name \'{}\''.format(name))
+            self.conn.execute('ALTER TABLE results ADD COLUMN {} REAL'.format(quote(name)))
+            self.counters.add(name)
+
+    def _tu_ids(self, names):
+        '''Get (add, if needed) ids of TUs. Returns dictionary: name -> id'''
+        ids = dict(self.conn.execute('SELECT name, id FROM tus'))
+        new = sorted(set(name for name in names if name not in ids))
+        self.conn.executemany('INSERT INTO tus (name) VALUES (?)', [(name,) for name in new])
+        if new:
+            ids = dict(self.conn.execute('SELECT name, id FROM tus'))
+        return ids
+
+    def next_position(self):
+        row = self.conn.execute('SELECT MAX(position) FROM runs').fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def ingest(self, path, revision, host, config, position=None, replace=False):
+        '''Load CSV file produced by convert_result.py. Returns the number of
+           (TU, opt) rows loaded'''
+        counters, rows = read_results(path)
+        if not rows:
+            raise HistoryError('\'{}\' contains no results'.format(path))
+        if position is None:
+            match = REVISION_RE.search(revision)
+            position = int(match.group(1)) if match else self.next_position()
+        # ALTER TABLE is done before the transaction (sqlite3 module commits
+        # before DDL statements)
+        self._add_counters(counters)
+        with self.conn:
+            existing = self.conn.execute('SELECT id FROM runs WHERE revision = ? AND host = ?'
+                                         ' AND config = ?', (revision, host, config)).fetchone()
+            if existing is not None:
+                if not replace:
+                    raise HistoryError('revision {} ({}, {}) is already in the database'
+                                       ' (use --replace)'.format(revision, host, config))
+                self.conn.execute('DELETE FROM results WHERE run = ?', existing)
+                self.conn.execute('DELETE FROM runs WHERE id = ?', existing)
+            run_id = self.conn.execute(
+                    'INSERT INTO runs (revision, host, config, position, source, ingested)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)',
+                    (revision, host, config, position, os.path.abspath(path),
+                     time.strftime('%Y-%m-%d %H:%M:%S'))).lastrowid
+            ids = self._tu_ids(name for (name, _, _, _) in rows)
+            query = 'INSERT INTO results (tu, opt, run, repeats, {}) VALUES ({})'.format(
+                        ', '.join(quote(k) for k in counters),
+                        ', '.join(['?'] * (len(counters) + 4)))
+            self.conn.executemany(query, ((ids[name], opt, run_id, repeats) + tuple(means)
+                                          for (name, opt, repeats, means) in rows))
+        return len(rows)
+
+    def runs(self, host=None, config=None):
+        '''List of runs (sorted by position)'''
+        query = 'SELECT id, revision, host, config, position FROM runs'
+        conds, params = self._run_filter(host, config)
+        if conds:
+            query += ' WHERE ' + ' AND '.join(conds)
+        return [Run(row) for row in self.conn.execute(query + ' ORDER BY position, id', params)]
+
+    def _run_filter(self, host, config):
+        conds = []
+        params = []
+        for (column, value) in [('host', host), ('config', config)]:
+            if value is not None:
+                conds.append('{} = ?'.format(column))
+                params.append(value)
+        return conds, params
+
+    def _check_counter(self, counter):
+        if counter not in self.counters:
+            raise HistoryError('counter \'{}\' not found in the database'.format(counter))
+
+    def series(self, name, counter=DEFAULT_COUNTER, opt=None, host=None, config=None):
+        '''Time series of a TU: list of (Run, opt, value, repeats), sorted by
+           host, config, opt and position'''
+        self._check_counter(counter)
+        conds, params = self._run_filter(host, config)
+        conds = ['tus.name = ?'] + ['runs.' + c for c in conds]
+        params = [name] + params
+        if opt is not None:
+            conds.append('results.opt = ?')
+            params.append(opt)
+        query = ('SELECT runs.id, runs.revision, runs.host, runs.config, runs.position,'
+                 ' results.opt, results.{}, results.repeats FROM results'
+                 ' JOIN tus ON tus.id = results.tu JOIN runs ON runs.id = results.run'
+                 ' WHERE {} ORDER BY runs.host, runs.config, results.opt,'
+                 ' runs.position, runs.id'.format(quote(counter), ' AND '.join(conds)))
+        return [(Run(row[:5]),) + tuple(row[5:]) for row in self.conn.execute(query, params)]
+
+    def changes(self, counter=DEFAULT_COUNTER, opt=None, host=None, config=None, bench=None,
+                threshold=DEFAULT_THRESHOLD / 100.0, z_score=DEFAULT_Z_SCORE,
+                min_size=DEFAULT_MIN_SIZE):
+        '''Find change points of all TUs (optionally, only of a benchmark) in
+           the runs of a single host and config. Returns list of Change'''
+        self._check_counter(counter)
+        runs = self.runs(host, config)
+        combos = sorted(set((run.host, run.config) for run in runs))
+        if len(combos) > 1:
+            raise HistoryError('runs of several hosts/configs match, use --host and --config:'
+                               ' {}'.format(', '.join('{}/{}'.format(*c) for c in combos)))
+        if not runs:
+            return []
+        position = dict((run.id, ind) for (ind, run) in enumerate(runs))
+        names = dict((tu_id, name) for (name, tu_id) in self.conn.execute(
+                        'SELECT name, id FROM tus'))
+        conds = ['run IN ({})'.format(','.join(str(run.id) for run in runs))]
+        params = []
+        if opt is not None:
+            conds.append('opt = ?')
+            params.append(opt)
+        # Results are read in the primary key order (TU, opt, run), thus
+        # series of each TU are contiguous
+        query = 'SELECT tu, opt, run, {} FROM results WHERE {} ORDER BY tu, opt'.format(
+                    quote(counter), ' AND '.join(conds))
+        prefix = None if bench is None else bench + '/'
+        result = []
+        for ((tu_id, tu_opt), rows) in itertools.groupby(self.conn.execute(query, params),
+                                                          key=lambda row: row[:2]):
+            name = names[tu_id]
+            if prefix is not None and not name.startswith(prefix):
+                continue
+            points = sorted((position[run_id], value) for (_, _, run_id, value) in rows
+                            if value is not None)
+            values = [value for (_, value) in points]
+            for (k, before, after, z) in detect_changes(values, threshold, z_score, min_size):
+                result.append(Change(name, tu_opt, runs[points[k - 1][0]], runs[points[k][0]],
+                                     before, after, z))
+        return result
+
+def default_config(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def run_ingest(history, args):
+    if args.config is not None and len(args.inputs) > 1:
+        error('--config can not be used with several input files')
+    for path in args.inputs:
+        config = args.config or default_config(path)
+        count = history.ingest(path, args.revision, args.host, config, args.position,
+                               args.replace)
+        print('{}: {} TUs loaded (revision {}, host {}, config {})'.format(
+                path, count, args.revision, args.host, config))
+
+def run_runs(history, args):
+    print('{:<24} {:>12} {:<16} {:<16}'.format('revision', 'position', 'host', 'config'))
+    for run in history.runs(args.host, args.config):
+        print('{:<24} {:>12g} {:<16} {:<16}'.format(run.revision, run.position, run.host,
+                                                    run.config))
+
+def run_series(history, args):
+    rows = history.series(args.tu, args.counter, args.opt, args.host, args.config)
+    if not rows:
+        error('no results for \'{}\''.format(args.tu))
+    print('{:<16} {:<16} {:<8} {:<24} {:>14} {:>8} {:>8}'.format(
+            'host', 'config', 'opt', 'revision', args.counter, 'change', 'repeats'))
+    prev = None
+    for (run, opt, value, repeats) in rows:
+        group = (run.host, run.config, opt)
+        change = ''
+        if prev is not None and prev[0] == group and prev[1] and value is not None:
+            change = '{:+.1%}'.format(value / prev[1] - 1)
+        print('{:<16} {:<16} {:<8} {:<24} {:>14} {:>8} {:>8}'.format(
+                run.host, run.config, opt, run.revision,
+                '' if value is None else '{:.6g}'.format(value), change, repeats))
+        prev = (group, value)
+
+def run_changes(history, args):
+    changes = history.changes(args.counter, args.opt, args.host, args.config, args.bench,
+                              args.threshold / 100.0, args.z_score, args.min_size)
+    if args.regressions:
+        changes = [c for c in changes if c.rel_change > 0]
+    changes.sort(key=lambda c: -abs(c.rel_change))
+    print('{} change point(s) of {} found'.format(len(changes), args.counter))
+    if not changes:
+        return
+    print('{:<40} {:<8} {:<24} {:>12} {:>12} {:>8} {:>6}'.format(
+            'TU', 'opt', 'revisions', 'before', 'after', 'change', 'z'))
+    for c in changes[:args.top]:
+        print('{:<40} {:<8} {:<24} {:>12.6g} {:>12.6g} {:>+8.1%} {:>6.1f}'.format(
+                c.name, c.opt, '{}..{}'.format(c.before_run.revision, c.after_run.revision),
+                c.before, c.after, c.rel_change, c.z_score))
+
+def main():
+    parser = argparse.ArgumentParser(description='regression history: load benchmark results'
+                ' (produced by convert_result.py) into an SQLite database, show time series'
+                ' of TUs and find change points')
+    parser.add_argument('database', help='SQLite database (created, if it does not exist)')
+    subparsers = parser.add_subparsers(dest='command')
+
+    ingest = subparsers.add_parser('ingest', help='load results of a run')
+    ingest.add_argument('inputs', nargs='+', metavar='CSV', help='results (convert_result.py'
+                ' output; runs marked by --noise mark are skipped)')
+    ingest.add_argument('-r', '--revision', required=True,
+                help='compiler revision, e.g. r228065 or a git commit')
+    ingest.add_argument('--position', type=float,
+                help='position of the revision in the history (default: SVN revision'
+                ' number or the position after the last run)')
+    ingest.add_argument('--host', default=socket.gethostname(),
+                help='host name (default: %(default)s)')
+    ingest.add_argument('--config',
+                help='configuration name (default: name of the CSV file without extension)')
+    ingest.add_argument('--replace', action='store_true',
+                help='replace results, which are already in the database')
+    ingest.set_defaults(func=run_ingest)
+
+    runs = subparsers.add_parser('runs', help='list runs')
+    series = subparsers.add_parser('series', help='show time series of a TU')
+    series.add_argument('tu', help='TU name (bench/file)')
+    changes = subparsers.add_parser('changes', help='find change points')
+    changes.add_argument('--bench', help='check only TUs of this benchmark')
+    changes.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                metavar='PERCENT', help='minimal change (default: %(default)s)')
+    changes.add_argument('-z', '--z-score', type=float, default=DEFAULT_Z_SCORE,
+                help='minimal difference of segment means relative to the noise level'
+                ' (default: %(default)s)')
+    changes.add_argument('--min-size', type=int, default=DEFAULT_MIN_SIZE,
+                help='minimal number of runs between change points (default: %(default)s)')
+    changes.add_argument('--regressions', action='store_true',
+                help='show only increases of the counter')
+    changes.add_argument('--top', type=int, default=50,
+                help='number of changes to show (default: %(default)s)')
+    for (sub, func) in [(runs, run_runs), (series, run_series), (changes, run_changes)]:
+        sub.add_argument('--host', help='show only runs on this host')
+        sub.add_argument('--config', help='show only runs of this configuration')
+        if sub is not runs:
+            sub.add_argument('-O', '--opt', help='optimization level or configuration label,'
+                        ' e.g. "O2_g alloc=tcmalloc" (default: all)')
+            sub.add_argument('-c', '--counter', default=DEFAULT_COUNTER,
+                        help='counter (default: %(default)s)')
+        sub.set_defaults(func=func)
+    args = parser.parse_args()
+    if getattr(args, 'min_size', 1) < 1:
+        parser.error('--min-size must be positive')
+    history = History(args.database)
+    try:
+        args.func(history, args)
+    except (HistoryError, sqlite3.Error, IOError, ValueError) as ex:
+        error(str(ex))
+    finally:
+        history.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python2.7
+
+# This script imports a code base described by a compilation database
+# (compile_commands.json, written e.g. by CMake with
+# -DCMAKE_EXPORT_COMPILE_COMMANDS=ON or by Bear) as a benchmark: each C and
+# C++ entry is preprocessed (in parallel, using the compiler and options of
+# the entry) into preproc/<project>/ in the working directory, so the units
+# are measured by build_spec.py just like SPEC benchmarks.
+#
+# Identical preprocessed units (e.g. a source compiled into several targets
+# with the same options or identical generated files at different paths)
+# are stored once; units are compared ignoring file names in line markers. The weight of each unit
+# (the number of entries it stands for) is written into
+# compdb/<project>.csv in the working directory; the file can be used as a
+# subset (build_spec.py --subset) and by convert_result.py --weights.
+
+from __future__ import print_function
+
+# System modules
+import re
+import os, os.path
+import sys
+import json
+import shlex
+import hashlib
+import argparse
+import subprocess
+import multiprocessing
+
+def error(msg):
+    '''Print error message to stderr and exit with non-zero status'''
+    sys.stderr.write('Error: {}\n'.format(msg))
+    sys.exit(1)
+
+class CompdbError(Exception): pass
+
+# Extension of preprocessed units by source extension
+PREPROC_EXT = {'.c': '.i'}
+PREPROC_EXT.update((ext, '.ii') for ext in ['.cc', '.cp', '.cxx', '.cpp', '.c++', '.C', '.CPP'])
+# Options of compile commands, which are dropped when preprocessing: output
+# and dependency generation options (ARG_OPTIONS have an argument)
+DROP_OPTIONS    = set(['-c', '-S', '-E', '-M', '-MM', '-MD', '-MMD', '-MP', '-MG'])
+ARG_OPTIONS     = ['-o', '-MF', '-MT', '-MQ']
+# Line marker, e.g. '# 1 "/src/a/x.c"' (the file name is replaced by "" when
+# computing digests of units)
+LINEMARKER_RE   = re.compile(br'^(#\s*\d+\s+)"(?:[^"\\]|\\.)*"')
+
+class Entry(object):
+    '''An entry of the compilation database'''
+    __slots__ = ('directory', 'source', 'argv', 'unit')
+
+    def __init__(self, obj):
+        try:
+            self.directory = obj['directory']
+            self.source = os.path.normpath(os.path.join(self.directory, obj['file']))
+            if 'arguments' in obj:
+                argv = list(obj['arguments'])
+            else:
+                argv = shlex.split(obj['command'])
+        except (KeyError, TypeError, AttributeError, ValueError):
+            raise CompdbError('malformed entry: {}'.format(json.dumps(obj)))
+        if not argv:
+            raise CompdbError('empty command for \'{}\''.format(self.source))
+        self.argv = argv
+        # Name of the preprocessed unit (set by assign_units)
+        self.unit = None
+
+    def preprocess_argv(self, out_path):
+        '''Command, which preprocesses the source into out_path'''
+        result = [self.argv[0]]
+        skip = False
+        for arg in self.argv[1:]:
+            if skip:
+                skip = False
+                continue
+            if arg in DROP_OPTIONS:
+                continue
+            if arg in ARG_OPTIONS:
+                skip = True
+                continue
+            if any(arg.startswith(opt) for opt in ARG_OPTIONS):
+                continue
+            if os.path.normpath(os.path.join(self.directory, arg)) == self.source:
+                continue
+            result.append(arg)
+        return result + ['-E', '-o', out_path, self.source]
+
+def load_compdb(path):
+    '''Read the compilation database. Returns (entries, number of skipped
+       entries, i.e. those which are not C or C++)'''
+    with open(path, 'r') as f:
+        try:
+            data = json.load(f)
+        except ValueError as ex:
+            raise CompdbError('failed to parse \'{}\': {}'.format(path, ex))
+    if not isinstance(data, list):
+        raise CompdbError('\'{}\' is not a compilation database'.format(path))
+    entries = [Entry(obj) for obj in data]
+    supported = [e for e in entries if os.path.splitext(e.source)[1] in PREPROC_EXT]
+    return supported, len(entries) - len(supported)
+
+def assign_units(entries):
+    '''Name preprocessed units after the paths of the sources relative to
+       their common directory ('/' is replaced by '__'). A source compiled by
+       several entries gets a numeric suffix'''
+    root = os.path.commonprefix([os.path.dirname(e.source) + os.sep for e in entries])
+    root = root[:root.rfind(os.sep) + 1]
+    used = set()
+    for entry in entries:
+        base, ext = os.path.splitext(entry.source[len(root):])
+        base = base.replace(os.sep, '__')
+        name = base + PREPROC_EXT[ext]
+        count = 1
+        while name in used:
+            count += 1
+            name = '{}.{}{}'.format(base, count, PREPROC_EXT[ext])
+        used.add(name)
+        entry.unit = name
+
+def preprocess_worker_func(job):
+    '''Worker function for child processes in parallel preprocessing.
+       Returns (index of the job, MD5 digest of the output with file names
+       in line markers removed, error message)'''
+    ind, directory, argv, out_path = job
+    try:
+        proc = subprocess.Popen(argv, cwd=directory, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+    except OSError as ex:
+        return (ind, None, '{}: {}'.format(argv[0], ex))
+    if proc.returncode != 0:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        # Report the first error (the last line is usually "compilation terminated")
+        lines = output.decode('utf-8', 'replace').strip().splitlines()
+        errors = [line for line in lines if 'error' in line] or lines
+        return (ind, None, errors[0] if errors else 'exit code {}'.format(proc.returncode))
+    digest = hashlib.md5()
+    with open(out_path, 'rb') as f:
+        for line in f:
+            digest.update(LINEMARKER_RE.sub(br'\1""', line))
+    sys.stdout.write('.')
+    sys.stdout.flush()
+    return (ind, digest.hexdigest(), None)
+
+def import_compdb(args):
+    try:
+        entries, skipped = load_compdb(args.compdb)
+    except (CompdbError, IOError) as ex:
+        error(str(ex))
+    if not entries:
+        error('no C or C++ sources in \'{}\''.format(args.compdb))
+    assign_units(entries)
+    project_dir = os.path.join(args.preproc_dir, args.project)
+    if os.path.isdir(project_dir):
+        # Remove units of the previous import
+        for fname in os.listdir(project_dir):
+            if os.path.splitext(fname)[1] in ['.i', '.ii']:
+                os.remove(os.path.join(project_dir, fname))
+    else:
+        os.makedirs(project_dir)
+
+    print('Preprocessing {} sources ({} entries skipped) into \'{}\' using {} jobs'.format(
+            len(entries), skipped, project_dir, args.jobs))
+    queue = [(ind, e.directory, e.preprocess_argv(os.path.join(project_dir, e.unit)),
+              os.path.join(project_dir, e.unit)) for (ind, e) in enumerate(entries)]
+    digests = [None] * len(entries)
+    failed = []
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        for (ind, digest, msg) in pool.imap_unordered(preprocess_worker_func, queue):
+            if msg is not None:
+                failed.append('{}: {}'.format(entries[ind].source, msg))
+            digests[ind] = digest
+        pool.close()
+        pool.join()
+    except KeyboardInterrupt:
+        pool.terminate()
+        error('interrupted')
+    sys.stdout.write('\n')
+
+    # digest -> list of indices of entries (the first one is kept)
+    groups = {}
+    for (ind, digest) in enumerate(digests):
+        if digest is not None:
+            groups.setdefault(digest, []).append(ind)
+    units = []
+    for group in groups.values():
+        for ind in group[1:]:
+            os.remove(os.path.join(project_dir, entries[ind].unit))
+        units.append((entries[group[0]].unit, [entries[ind].source for ind in group]))
+    units.sort()
+
+    weights_dir = os.path.join(args.work_path, 'compdb')
+    if not os.path.isdir(weights_dir):
+        os.makedirs(weights_dir)
+    weights_path = os.path.join(weights_dir, args.project + '.csv')
+    with open(weights_path, 'w') as f:
+        f.write('"name","weight","sources"\n')
+        for (unit, sources) in units:
+            f.write('"{}/{}",{},"{}"\n'.format(args.project, unit, len(sources),
+                                              ';'.join(sources).replace('"', '""')))
+    num_done = len(entries) - len(failed)
+    print('{} units written ({} duplicates removed), weights saved to \'{}\''.format(
+            len(units), num_done - len(units), weights_path))
+    if failed:
+        error('failed to preprocess {} source(s):\n{}'.format(len(failed),
+                                                             '\n'.join(failed[:10])))
+
+def main():
+    parser = argparse.ArgumentParser(description='import a code base described by a'
+                ' compilation database (compile_commands.json): preprocess its sources'
+                ' into the preproc directory, so that they can be measured by'
+                ' build_spec.py')
+    parser.add_argument('compdb', help='compilation database (compile_commands.json)')
+    parser.add_argument('-p', '--project',
+                help='benchmark name (default: name of the directory containing the'
+                     ' database)')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(),
+                help='number of parallel jobs (default: %(default)s)')
+    parser.add_argument('-w', '--work-path', metavar='DIR',
+                help='working directory (default: WORK_PATH from config.py)')
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be positive')
+    if args.project is None:
+        args.project = os.path.basename(os.path.dirname(os.path.abspath(args.compdb)))
+    if not args.project or args.project.startswith('.') or os.sep in args.project:
+        parser.error('invalid project name: \'{}\''.format(args.project))
+    if args.work_path is None:
+        try:
+            import config
+        except ImportError:
+            error('config.py not found (create it or use --work-path)')
+        args.work_path = config.WORK_PATH
+    args.preproc_dir = os.path.join(args.work_path, 'preproc')
+    import_compdb(args)
+
+if __name__ == '__main__':
+    main()
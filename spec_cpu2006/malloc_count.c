@@ -0,0 +1,197 @@
+/* Counting malloc shim.
+
+   Counts calls of the memory allocation functions and the number of bytes
+   requested. The calls are forwarded to the next definition in the lookup
+   order, so the shim can be stacked with an allocator library:
+
+     LD_PRELOAD="malloc_count.so libtcmalloc_minimal.so" cc1 ...
+
+   At exit the counters are appended to the file named by the
+   MALLOC_COUNT_OUT environment variable as a line:
+
+     <program name>,<allocations>,<frees>,<bytes>
+
+   Each process of a command (e.g. perf and the compiler run by it) writes
+   its own line. Allocations are calls of malloc, calloc, realloc,
+   posix_memalign, aligned_alloc and memalign; frees are calls of free with
+   a non-null pointer.
+
+   Built by build_spec.py --count-malloc:
+     cc -shared -fPIC -O2 -o malloc_count.so malloc_count.c -ldl  */
+
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+static void *(*real_malloc) (size_t);
+static void *(*real_calloc) (size_t, size_t);
+static void *(*real_realloc) (void *, size_t);
+static void (*real_free) (void *);
+static int (*real_posix_memalign) (void **, size_t, size_t);
+static void *(*real_aligned_alloc) (size_t, size_t);
+static void *(*real_memalign) (size_t, size_t);
+
+static unsigned long num_allocs;
+static unsigned long num_frees;
+static unsigned long num_bytes;
+
+#define COUNT(counter, n) __atomic_fetch_add (&(counter), (n), __ATOMIC_RELAXED)
+
+/* dlsym can allocate memory before the real functions are resolved: such
+   requests are served from a static buffer, which is never freed.  */
+static char bootstrap_buf[8192] __attribute__ ((aligned (16)));
+static size_t bootstrap_used;
+static int initializing;
+
+static void *
+bootstrap_alloc (size_t size)
+{
+  void *result;
+  size = (size + 15) & ~(size_t) 15;
+  if (size > sizeof (bootstrap_buf) - bootstrap_used)
+    return NULL;
+  result = bootstrap_buf + bootstrap_used;
+  bootstrap_used += size;
+  return result;
+}
+
+static int
+is_bootstrap (void *ptr)
+{
+  return (char *) ptr >= bootstrap_buf
+	 && (char *) ptr < bootstrap_buf + sizeof (bootstrap_buf);
+}
+
+static void
+init (void)
+{
+  initializing = 1;
+  real_malloc = dlsym (RTLD_NEXT, "malloc");
+  real_calloc = dlsym (RTLD_NEXT, "calloc");
+  real_realloc = dlsym (RTLD_NEXT, "realloc");
+  real_free = dlsym (RTLD_NEXT, "free");
+  real_posix_memalign = dlsym (RTLD_NEXT, "posix_memalign");
+  real_aligned_alloc = dlsym (RTLD_NEXT, "aligned_alloc");
+  real_memalign = dlsym (RTLD_NEXT, "memalign");
+  initializing = 0;
+}
+
+void *
+malloc (size_t size)
+{
+  if (!real_malloc)
+    {
+      if (initializing)
+	return bootstrap_alloc (size);
+      init ();
+    }
+  COUNT (num_allocs, 1);
+  COUNT (num_bytes, size);
+  return real_malloc (size);
+}
+
+void *
+calloc (size_t nmemb, size_t size)
+{
+  if (!real_calloc)
+    {
+      /* The static buffer is zero-initialized.  */
+      if (initializing)
+	return size && nmemb > (size_t) -1 / size
+	       ? NULL : bootstrap_alloc (nmemb * size);
+      init ();
+    }
+  COUNT (num_allocs, 1);
+  COUNT (num_bytes, nmemb * size);
+  return real_calloc (nmemb, size);
+}
+
+void *
+realloc (void *ptr, size_t size)
+{
+  if (!real_realloc && !initializing)
+    init ();
+  if (initializing || is_bootstrap (ptr))
+    {
+      /* The size of the old block is unknown: copy as much as possible.  */
+      void *result = malloc (size);
+      if (result && ptr)
+	{
+	  size_t avail = bootstrap_buf + sizeof (bootstrap_buf) - (char *) ptr;
+	  memcpy (result, ptr, size < avail ? size : avail);
+	}
+      return result;
+    }
+  COUNT (num_allocs, 1);
+  COUNT (num_bytes, size);
+  return real_realloc (ptr, size);
+}
+
+void
+free (void *ptr)
+{
+  if (!ptr || is_bootstrap (ptr))
+    return;
+  if (!real_free)
+    init ();
+  COUNT (num_frees, 1);
+  real_free (ptr);
+}
+
+int
+posix_memalign (void **memptr, size_t alignment, size_t size)
+{
+  if (!real_posix_memalign)
+    init ();
+  COUNT (num_allocs, 1);
+  COUNT (num_bytes, size);
+  return real_posix_memalign (memptr, alignment, size);
+}
+
+void *
+aligned_alloc (size_t alignment, size_t size)
+{
+  if (!real_aligned_alloc)
+    init ();
+  COUNT (num_allocs, 1);
+  COUNT (num_bytes, size);
+  return real_aligned_alloc (alignment, size);
+}
+
+void *
+memalign (size_t alignment, size_t size)
+{
+  if (!real_memalign)
+    init ();
+  COUNT (num_allocs, 1);
+  COUNT (num_bytes, size);
+  return real_memalign (alignment, size);
+}
+
+static void __attribute__ ((destructor))
+report (void)
+{
+  const char *path = getenv ("MALLOC_COUNT_OUT");
+  char buf[512];
+  int fd, len;
+
+  if (!path)
+    return;
+  fd = open (path, O_WRONLY | O_APPEND | O_CREAT, 0644);
+  if (fd < 0)
+    return;
+  len = snprintf (buf, sizeof (buf), "%s,%lu,%lu,%lu\n",
+		  program_invocation_short_name, num_allocs, num_frees,
+		  num_bytes);
+  if (len > 0 && (size_t) len < sizeof (buf))
+    {
+      ssize_t written = write (fd, buf, len);
+      (void) written;
+    }
+  close (fd);
+}
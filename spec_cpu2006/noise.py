@@ -0,0 +1,275 @@
+#!/usr/bin/env python2.7
+
+# Detection of disturbed runs. A run is considered disturbed if:
+#  - the compiler was migrated to another CPU (cpu-migrations > 0; all
+#    runs are bound to a single core, so this should never happen);
+#  - it had clearly more context switches than most repeats of the same TU
+#    (with FIFO scheduling a context switch means that something preempted
+#    us), i.e. more than the median plus a tolerance;
+#  - the number of page faults or the measured counter (task-clock by
+#    default) is an outlier among repeats of the same TU: its robust
+#    z-score (computed using median and MAD) exceeds the threshold.
+# The last check needs at least MIN_REPEATS repeats. Only values above the
+# median are considered outliers: noise can not make compilation faster.
+# MAD is bounded from below by a realistic level of run-to-run noise (the
+# floor, relative to the median): otherwise a few repeats, which happen to
+# be very close to each other, make any ordinary run an outlier.
+#
+# The module is used by convert_result.py (--noise) and can also be run
+# as a script to filter an existing CSV file.
+
+from __future__ import print_function
+
+# System modules
+import sys
+import csv
+import argparse
+
+# Local modules
+import stats
+
+class NoiseError(Exception): pass
+
+MIGRATIONS          = 'cpu-migrations'
+CONTEXT_SWITCHES    = 'context-switches'
+PAGE_FAULTS         = 'page-faults'
+DEFAULT_COUNTER     = 'task-clock'
+DEFAULT_THRESHOLD   = 3.5
+# Minimal number of repeats for the outlier checks
+MIN_REPEATS         = 5
+# Columns, which distinguish configurations of the same TU (written by
+# build_spec.py --sweep-* and --lto runs; 'opt' is also added to
+# bench_results)
+CONFIG_COLUMNS      = ['opt', 'alloc', 'compiler', 'flto']
+# Default lower bound of MAD relative to the median (see --noise-floor of
+# convert_result.py): typical run-to-run noise of the counters
+DEFAULT_FLOOR       = 0.01
+# A run is disturbed, if it has more context switches than the median plus
+# max(absolute, relative * median) of the repeats
+CONTEXT_SWITCHES_ABS_TOL = 2
+CONTEXT_SWITCHES_REL_TOL = 0.5
+
+MODE_MARK           = 'mark'
+MODE_DROP           = 'drop'
+# Name of the column added in MODE_MARK
+NOISE_COLUMN        = 'noise'
+
+class BenchNoise(object):
+    '''Per-benchmark filtering statistics'''
+    __slots__ = ('tus', 'runs', 'flagged', 'kept_all', 'reasons',
+                 'var_tus', 'var_before', 'var_after')
+
+    def __init__(self):
+        self.tus = 0
+        self.runs = 0
+        # Number of disturbed runs
+        self.flagged = 0
+        # Number of TUs, whose repeats were all disturbed (and kept)
+        self.kept_all = 0
+        # Reason -> number of runs
+        self.reasons = {}
+        # Sums of squared coefficients of variation over TUs with several
+        # clean repeats (before and after filtering)
+        self.var_tus = 0
+        self.var_before = 0.0
+        self.var_after = 0.0
+
+    def update(self, other):
+        for name in ['tus', 'runs', 'flagged', 'kept_all', 'var_tus', 'var_before', 'var_after']:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for (reason, count) in other.reasons.items():
+            self.reasons[reason] = self.reasons.get(reason, 0) + count
+
+    @property
+    def removed(self):
+        '''Fraction of variance removed by filtering'''
+        if self.var_before == 0:
+            return 0.0
+        return 1.0 - self.var_after / self.var_before
+
+def rel_var(values):
+    '''Squared coefficient of variation'''
+    m = stats.mean(values)
+    if m == 0:
+        return 0.0
+    return (stats.stdev(values) / m) ** 2
+
+def outliers(values, threshold, floor=DEFAULT_FLOOR):
+    '''Indices of values, whose robust z-score is above threshold. floor - lower
+       bound of MAD relative to the median'''
+    med = stats.median(values)
+    mad = max(stats.mad(values), abs(med) * floor)
+    if mad == 0:
+        return []
+    return [i for (i, v) in enumerate(values) if (v - med) / mad > threshold]
+
+class NoiseFilter:
+    '''Collects runs of each TU and finds disturbed ones'''
+    def __init__(self, counter=DEFAULT_COUNTER, threshold=DEFAULT_THRESHOLD,
+                 floor=DEFAULT_FLOOR):
+        self.counter = counter
+        self.threshold = threshold
+        self.floor = floor
+        # (name, group) -> list of (row, counter, migrations, context switches,
+        # page faults)
+        self._tus = {}
+
+    def add(self, row, name, values, group=None):
+        '''Add a run. row - row identifier (e.g. index in the output file),
+           values - any object with get(key) method (e.g. RunReport or dict),
+           group - distinguishes runs of the same TU with different
+           configuration (e.g. optimization level)'''
+        self._tus.setdefault((name, group), []).append(
+            (row, values.get(self.counter), values.get(MIGRATIONS),
+             values.get(CONTEXT_SWITCHES), values.get(PAGE_FAULTS)))
+
+    def _classify_tu(self, runs):
+        '''Return list of reasons (lists of strings) for each run'''
+        reasons = [[] for _ in runs]
+        for (ind, run) in enumerate(runs):
+            if run[2]:
+                reasons[ind].append(MIGRATIONS)
+        switches = [run[3] for run in runs if run[3] is not None]
+        if len(switches) >= 2:
+            med = stats.median(switches)
+            limit = med + max(CONTEXT_SWITCHES_ABS_TOL, med * CONTEXT_SWITCHES_REL_TOL)
+            for (ind, run) in enumerate(runs):
+                if run[3] is not None and run[3] > limit:
+                    reasons[ind].append(CONTEXT_SWITCHES)
+        if len(runs) >= MIN_REPEATS:
+            for (col, reason) in [(4, PAGE_FAULTS), (1, self.counter)]:
+                present = [ind for (ind, run) in enumerate(runs) if run[col] is not None]
+                if len(present) < MIN_REPEATS:
+                    continue
+                for i in outliers([runs[ind][col] for ind in present], self.threshold,
+                                  self.floor):
+                    reasons[present[i]].append(reason)
+        return reasons
+
+    def classify(self):
+        '''Find disturbed runs. Returns (reasons, dropped, statistics):
+           reasons - dictionary: row -> reasons (separated by ';'),
+           dropped - set of rows, which should be discarded (all disturbed
+           runs, except for TUs, whose runs are all disturbed),
+           statistics - dictionary: benchmark -> BenchNoise'''
+        result = {}
+        dropped = set()
+        bench_stats = {}
+        for ((name, _), runs) in self._tus.items():
+            bench = name.split('/', 1)[0]
+            bs = bench_stats.get(bench)
+            if bs is None:
+                bs = bench_stats[bench] = BenchNoise()
+            bs.tus += 1
+            bs.runs += len(runs)
+            reasons = self._classify_tu(runs)
+            clean = [run for (run, r) in zip(runs, reasons) if not r]
+            for (run, r) in zip(runs, reasons):
+                if not r:
+                    continue
+                result[run[0]] = ';'.join(r)
+                bs.flagged += 1
+                for reason in r:
+                    bs.reasons[reason] = bs.reasons.get(reason, 0) + 1
+                if clean:
+                    dropped.add(run[0])
+            if not clean:
+                bs.kept_all += 1
+                clean = runs
+            before = [run[1] for run in runs if run[1] is not None]
+            after = [run[1] for run in clean if run[1] is not None]
+            if len(after) >= 2:
+                bs.var_tus += 1
+                bs.var_before += rel_var(before)
+                bs.var_after += rel_var(after)
+        return result, dropped, bench_stats
+
+def print_summary(bench_stats, counter, out=sys.stdout):
+    '''Print per-benchmark filtering statistics'''
+    reasons = [MIGRATIONS, CONTEXT_SWITCHES, PAGE_FAULTS, counter]
+    total = BenchNoise()
+    for bs in bench_stats.values():
+        total.update(bs)
+    out.write('# Disturbed runs (variance of {} removed by filtering)\n'.format(counter))
+    out.write('{:<20} {:>6} {:>7} {:>7} {:>10} {:>10} {:>10} {:>10} {:>9}\n'.format(
+                'benchmark', 'TUs', 'runs', 'flagged', 'migrations', 'ctx-sw', 'pg-faults',
+                'outliers', 'removed'))
+    for (bench, bs) in sorted(bench_stats.items()) + [('ALL', total)]:
+        out.write('{:<20} {:>6} {:>7} {:>7} {:>10} {:>10} {:>10} {:>10} {:>9.1%}\n'.format(
+                    bench, bs.tus, bs.runs, bs.flagged,
+                    *([bs.reasons.get(r, 0) for r in reasons] + [bs.removed])))
+    if total.kept_all:
+        out.write('# {} TU(s) have no clean runs, their runs were kept\n'.format(total.kept_all))
+
+def filter_csv(src, dest, mode, counter=DEFAULT_COUNTER, threshold=DEFAULT_THRESHOLD,
+               floor=DEFAULT_FLOOR):
+    '''Filter CSV file (e.g. produced by convert_result.py). Runs are grouped
+       by name and configuration columns (CONFIG_COLUMNS), which are present.
+       Returns dictionary: benchmark -> BenchNoise'''
+    reader = csv.reader(src)
+    try:
+        header = next(reader)
+    except StopIteration:
+        raise NoiseError('empty input')
+    if 'name' not in header:
+        raise NoiseError('no \'name\' column')
+    index = dict((k, i) for (i, k) in enumerate(header))
+    if counter not in index:
+        raise NoiseError('no \'{}\' column'.format(counter))
+    name_col = index['name']
+    config_cols = [index[k] for k in CONFIG_COLUMNS if k in index]
+    rows = [row for row in reader if row]
+    noise_filter = NoiseFilter(counter, threshold, floor)
+    for (ind, row) in enumerate(rows):
+        values = {}
+        for key in [counter, MIGRATIONS, CONTEXT_SWITCHES, PAGE_FAULTS]:
+            col = index.get(key)
+            if col is not None and row[col] != '':
+                values[key] = float(row[col])
+        noise_filter.add(ind, row[name_col], values,
+                         tuple(row[col] for col in config_cols) or None)
+    reasons, dropped, bench_stats = noise_filter.classify()
+    quote = lambda v: '"{}"'.format(v)
+    numeric = set(i for (i, k) in enumerate(header)
+                  if k not in ['name', 'source'] + CONFIG_COLUMNS)
+    out_header = header + [NOISE_COLUMN] if mode == MODE_MARK else header
+    dest.write(','.join(quote(k) for k in out_header) + '\n')
+    for (ind, row) in enumerate(rows):
+        if mode == MODE_DROP and ind in dropped:
+            continue
+        out = [v if i in numeric else quote(v) for (i, v) in enumerate(row)]
+        if mode == MODE_MARK:
+            out.append(quote(reasons.get(ind, '')))
+        dest.write(','.join(out) + '\n')
+    return bench_stats
+
+def main():
+    parser = argparse.ArgumentParser(description='mark or discard disturbed runs'
+                ' in benchmark results (CSV files produced by convert_result.py)')
+    parser.add_argument('input', type=argparse.FileType('r'), help='input CSV file')
+    parser.add_argument('output', type=argparse.FileType('w'), help='output CSV file')
+    parser.add_argument('--mark', action='store_const', dest='mode', const=MODE_MARK,
+                default=MODE_DROP, help='add \'{}\' column with the reasons instead of'
+                ' discarding disturbed runs'.format(NOISE_COLUMN))
+    parser.add_argument('-c', '--counter', default=DEFAULT_COUNTER,
+                help='counter checked for outliers (default: %(default)s)')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                help='robust z-score threshold for outliers (default: %(default)s)')
+    parser.add_argument('-f', '--floor', type=float, default=DEFAULT_FLOOR * 100,
+                metavar='PERCENT',
+                help='lower bound of the spread (MAD) of repeats relative to their median,'
+                     ' i.e. the expected run-to-run noise (default: %(default)s)')
+    args = parser.parse_args()
+    if args.floor < 0:
+        parser.error('--floor must not be negative')
+    try:
+        bench_stats = filter_csv(args.input, args.output, args.mode, args.counter,
+                                 args.threshold, args.floor / 100.0)
+    except (NoiseError, ValueError) as ex:
+        sys.stderr.write('Error: {}\n'.format(ex))
+        sys.exit(1)
+    print_summary(bench_stats, args.counter,
+                  sys.stderr if args.output is sys.stdout else sys.stdout)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python2.7
+
+# This script shows which compiler passes dominate compile time. It reads
+# logs produced by build_spec.py with --time-report (i.e. logs, which
+# contain -ftime-report output of each TU) and sums the time and GGC memory
+# of each pass over all translation units (repeated runs of a TU are
+# averaged). Each log corresponds to an optimization level.
+
+from __future__ import print_function
+
+# System modules
+import os, os.path
+import sys
+import argparse
+
+# Local modules
+import perf_report
+
+def error(msg):
+    '''Print error message to stderr and exit with non-zero status'''
+    sys.stderr.write('Error: {}\n'.format(msg))
+    sys.exit(1)
+
+TOTAL           = 'TOTAL'
+PHASE_PREFIX    = 'phase '
+# Nested timers (e.g. '|name lookup'), their time is included into other passes
+NESTED_PREFIX   = '|'
+METRICS         = ['usr', 'sys', 'wall', 'ggc']
+
+class PassStats:
+    '''Per-pass totals over all TUs'''
+    def __init__(self):
+        self.usr = 0.0
+        self.sys = 0.0
+        self.wall = 0.0
+        self.ggc = 0.0
+        # Number of TUs, in which the pass was run
+        self.tus = 0
+
+def is_selected(name, phases):
+    if name == TOTAL:
+        return False
+    if phases:
+        return name.startswith(PHASE_PREFIX)
+    return not name.startswith(PHASE_PREFIX) and not name.startswith(NESTED_PREFIX)
+
+def load_passes(path):
+    '''Read log, return (number of runs, dictionary: pass name -> PassStats).
+       The result includes TOTAL, phases and nested timers'''
+    # workload -> (number of runs, pass name -> PassTime)
+    workloads = {}
+    num_runs = 0
+    with open(path, 'r') as f:
+        for run in perf_report.iter_runs(f):
+            passes = run.passes()
+            if not passes:
+                continue
+            num_runs += 1
+            count, sums = workloads.get(run.name, (0, {}))
+            for (name, entry) in passes.items():
+                total = sums.setdefault(name, perf_report.PassTime())
+                for metric in METRICS:
+                    setattr(total, metric, getattr(total, metric) + getattr(entry, metric))
+            workloads[run.name] = (count + 1, sums)
+    result = {}
+    for (count, sums) in workloads.values():
+        for (name, entry) in sums.items():
+            stats = result.setdefault(name, PassStats())
+            for metric in METRICS:
+                setattr(stats, metric, getattr(stats, metric) + getattr(entry, metric) / count)
+            stats.tus += 1
+    return num_runs, result
+
+def get_total(passes, metric):
+    '''Total value of metric over all passes'''
+    if TOTAL in passes:
+        return getattr(passes[TOTAL], metric)
+    return sum(getattr(stats, metric) for (name, stats) in passes.items()
+               if name.startswith(PHASE_PREFIX))
+
+def share(value, total):
+    return value / total if total > 0 else 0.0
+
+def parse_input(arg):
+    '''Parse input specification: LOG or OPT=LOG'''
+    if not os.path.exists(arg) and '=' in arg:
+        opt, path = arg.split('=', 1)
+        return (opt, path)
+    return (arg, arg)
+
+def print_level(opt, num_runs, passes, args):
+    selected = sorted([(name, stats) for (name, stats) in passes.items()
+                       if is_selected(name, args.phases)],
+                      key=lambda p: (-getattr(p[1], args.sort), p[0]))
+    total = dict((metric, get_total(passes, metric)) for metric in METRICS)
+    print('# {}: {} runs, {} TUs, total: usr {:.2f} s, wall {:.2f} s, GGC {:.1f} MB'.format(
+            opt, num_runs, passes[TOTAL].tus if TOTAL in passes else 0,
+            total['usr'], total['wall'], total['ggc'] / 1024))
+    print('{:>4} {:>10} {:>7} {:>10} {:>7} {:>10} {:>7} {:>6}  {}'.format(
+            'rank', 'usr, s', 'share', 'wall, s', 'share', 'GGC, MB', 'share', 'TUs',
+            'phase' if args.phases else 'pass'))
+    for (rank, (name, stats)) in enumerate(selected[:args.top]):
+        print('{:>4} {:>10.2f} {:>7.1%} {:>10.2f} {:>7.1%} {:>10.1f} {:>7.1%} {:>6}  {}'.format(
+                rank + 1, stats.usr, share(stats.usr, total['usr']),
+                stats.wall, share(stats.wall, total['wall']),
+                stats.ggc / 1024, share(stats.ggc, total['ggc']), stats.tus, name))
+    print()
+
+def print_summary(levels, args):
+    '''Share of the top passes at each optimization level'''
+    names = set()
+    for (_, _, passes) in levels:
+        ranked = sorted([name for name in passes if is_selected(name, args.phases)],
+                        key=lambda n: (-getattr(passes[n], args.sort), n))
+        names.update(ranked[:args.top])
+    totals = [get_total(passes, args.sort) for (_, _, passes) in levels]
+    rows = []
+    for name in names:
+        shares = [share(getattr(passes[name], args.sort), total) if name in passes else 0.0
+                  for ((_, _, passes), total) in zip(levels, totals)]
+        rows.append((name, shares))
+    rows.sort(key=lambda r: (-max(r[1]), r[0]))
+    print('# Share of {} time by optimization level'.format(args.sort)
+          if args.sort != 'ggc' else '# Share of GGC memory by optimization level')
+    print(' '.join('{:>8}'.format(opt[-8:]) for (opt, _, _) in levels) + '  ' +
+          ('phase' if args.phases else 'pass'))
+    for (name, shares) in rows:
+        print(' '.join('{:>8.1%}'.format(s) for s in shares) + '  ' + name)
+
+def run(args):
+    inputs = [parse_input(arg) for arg in args.inputs]
+    levels = []
+    for (opt, path) in inputs:
+        if not os.path.isfile(path):
+            error('file \'{}\' does not exist'.format(path))
+        try:
+            num_runs, passes = load_passes(path)
+        except perf_report.ReportError as ex:
+            error('failed to parse \'{}\': {}'.format(path, ex))
+        if not passes:
+            error('\'{}\' contains no time reports (use build_spec.py --time-report)'.format(path))
+        levels.append((opt, num_runs, passes))
+
+    for (opt, num_runs, passes) in levels:
+        print_level(opt, num_runs, passes, args)
+    if len(levels) > 1:
+        print_summary(levels, args)
+    if args.output:
+        args.output.write('"opt","pass","usr","sys","wall","ggc","tus","share"\n')
+        for (opt, _, passes) in levels:
+            total = get_total(passes, args.sort)
+            for name in sorted(passes):
+                stats = passes[name]
+                args.output.write('"{}","{}",{!r},{!r},{!r},{!r},{},{!r}\n'.format(
+                    opt, name, stats.usr, stats.sys, stats.wall, stats.ggc, stats.tus,
+                    share(getattr(stats, args.sort), total)))
+
+def main():
+    parser = argparse.ArgumentParser(description='show compiler passes which dominate'
+                ' compile time (requires logs produced by build_spec.py --time-report)')
+    parser.add_argument('inputs', nargs='+', metavar='[OPT=]LOG',
+                help='logs, one per optimization level, e.g. O2=log_O2.txt (the file'
+                     ' name is used as the label, if optimization level is not given)')
+    parser.add_argument('-s', '--sort', choices=['usr', 'wall', 'ggc'], default='usr',
+                help='sort passes by user time, wall time or GGC memory'
+                     ' (default: %(default)s)')
+    parser.add_argument('--phases', action='store_true',
+                help='show compilation phases (parsing, optimization, etc.) instead of passes')
+    parser.add_argument('--top', type=int, default=25,
+                help='number of passes to show for each optimization level'
+                     ' (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                help='save per-pass totals of all passes in CSV format')
+    args = parser.parse_args()
+    run(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 import re
+import os.path
+import numbers
 
 class ReportError(Exception): pass
 
@@ -11,95 +13,361 @@ def to_num(s):
         except:
             raise ReportError('Failed to convert: '+s)
 
-class ReportLine:
+def parse_line(line, separator):
+    '''Parse a line of 'perf stat -x' output. Return (name, value) tuple,
+       name is None for events which were not counted'''
+    data = line.split(separator)
+    if len(data) < 3:
+        raise ReportError('Failed to parse: '+line)
+    if data[0] in ['<not counted>', '<not supported>']:
+        return (None, None)
+    name = data[2]
+    if name.endswith(':HG'):
+        name = name[:-3]
+    return (name, to_num(data[0]))
+
+class ReportLine(object):
+    __slots__ = ('name', 'value')
+
     def __init__(self, line, separator):
-        data = line.split(separator)
-        if len(data) < 3:
-            raise ReportError('Failed to parse: '+line)
-        if data[0] in ['<not counted>', '<not supported>']:
-            self.name = None
-            self.value = None
-            return
-        self.name = data[2]
-        if self.name.endswith(':HG'):
-            self.name = self.name[:-3]
-        self.value = to_num(data[0])
+        self.name, self.value = parse_line(line, separator)
+
+    @classmethod
+    def make(cls, name, value):
+        res = cls.__new__(cls)
+        res.name = name
+        res.value = value
+        return res
 
     def __str__(self):
         return '{}: {}'.format(self.name, self.value)
 
-class RunReport:
-    def __init__(self, name, lines, separator):
-        self.values = {}
+class KeyCache:
+    '''Shares key tuples and key -> index maps between runs, which have the
+       same set of measured values (normally, all runs in a log do)'''
+    def __init__(self):
+        self.indices = {}
+
+    def get(self, names):
+        names = tuple(names)
+        entry = self.indices.get(names)
+        if entry is None:
+            entry = (names, dict((k, i) for (i, k) in enumerate(names)))
+            self.indices[names] = entry
+        return entry
+
+class RunReport(object):
+    '''Results of a single run. Values are stored in a tuple, names of
+       values and the index are shared between runs (see KeyCache)'''
+    __slots__ = ('name', 'report', 'config', '_keys', '_index', '_data')
+
+    def __init__(self, name, lines, separator, key_cache=None, report=None, config=None):
+        '''report - compiler report output (-ftime-report, -fmem-report), list
+           of lines, config - configuration of the run (tuple of (key, value)
+           pairs, see CONFIG_RE)'''
         self.name = name
-        self.cycles = None
-        self.insns = None
-        self.task_clock = None
+        self.report = report
+        self.config = config
+        names = []
+        data = []
+        positions = {}
         for line in lines:
-            rep_line = ReportLine(line, separator)
-            if rep_line.name is None:
+            key, value = parse_line(line, separator)
+            if key is None:
+                continue
+            if key in positions:
+                data[positions[key]] = value
                 continue
-            self.values[rep_line.name] = rep_line
-            if rep_line.name == 'cycles':
-                self.cycles = rep_line
-            elif rep_line.name == 'instructions':
-                self.insns = rep_line
-            elif rep_line.name == 'task-clock':
-                self.task_clock = rep_line
+            positions[key] = len(names)
+            names.append(key)
+            data.append(value)
+        if key_cache is None:
+            key_cache = KeyCache()
+        self._keys, self._index = key_cache.get(names)
+        self._data = tuple(data)
 
     def keys(self):
-        return self.values.keys()
+        return self._keys
+
+    def get_value(self, key, default=None):
+        '''Return the value of key (a number, not a ReportLine)'''
+        ind = self._index.get(key)
+        return default if ind is None else self._data[ind]
+
+    def items(self):
+        '''Iterate over (key, value) pairs'''
+        return zip(self._keys, self._data)
+
+    @property
+    def values(self):
+        return dict((k, ReportLine.make(k, v)) for (k, v) in self.items())
+
+    def _line(self, key):
+        ind = self._index.get(key)
+        return None if ind is None else ReportLine.make(key, self._data[ind])
+
+    @property
+    def cycles(self):
+        return self._line('cycles')
+
+    @property
+    def insns(self):
+        return self._line('instructions')
+
+    @property
+    def task_clock(self):
+        return self._line('task-clock')
 
     def __repr__(self):
         res = '<RunReport '
         if self.name is not None:
             res += self.name + ' '
-        return res + ', '.join(str(v) for v in self.values.values()) + '>'
+        return res + ', '.join('{}: {}'.format(k, v) for (k, v) in self.items()) + '>'
 
     def __getitem__(self, key):
-        return self.values[key]
+        return ReportLine.make(key, self._data[self._index[key]])
 
     def __contains__(self, key):
-        return key in self.values
+        return key in self._index
 
-class PerfReport:
-    WORKLOAD_RE = re.compile(r'^\s*#\s*WORKLOAD:\s*(.*?)\s*$')
+    def passes(self):
+        '''Parse -ftime-report output: dictionary pass name -> PassTime'''
+        return parse_time_report(self.report or [])
+
+    def mem_stats(self):
+        '''Parse -fmem-report output: dictionary statistic name -> kB'''
+        return parse_mem_report(self.report or [])
+
+    def report_items(self):
+        '''Values parsed from compiler reports as (key, value) pairs, sorted by
+           key. Keys are "pass:<name>:usr", "pass:<name>:wall" (seconds),
+           "pass:<name>:ggc" and "mem:<statistic>" (kB)'''
+        items = []
+        for (name, entry) in self.passes().items():
+            items += [('pass:{}:usr'.format(name), entry.usr),
+                      ('pass:{}:wall'.format(name), entry.wall),
+                      ('pass:{}:ggc'.format(name), entry.ggc)]
+        for (name, value) in self.mem_stats().items():
+            items.append(('mem:' + name, value))
+        return sorted(items)
+
+class PassTime(object):
+    '''Time (in seconds) and GGC memory (in kB) used by a compiler pass'''
+    __slots__ = ('usr', 'sys', 'wall', 'ggc')
+
+    def __init__(self, usr=0.0, sys=0.0, wall=0.0, ggc=0.0):
+        self.usr = usr
+        self.sys = sys
+        self.wall = wall
+        self.ggc = ggc
 
+    def __repr__(self):
+        return '<PassTime usr: {}, sys: {}, wall: {}, ggc: {} kB>'.format(
+                    self.usr, self.sys, self.wall, self.ggc)
+
+# GCC up to 8.x:
+#  Execution times (seconds)
+#   phase parsing   :   0.20 (17%) usr   0.04 (29%) sys   0.24 (18%) wall   21453 kB (26%) ggc
+#   TOTAL           :   1.17             0.14             1.32              82313 kB
+# GCC 9 and later:
+#  Time variable                 usr           sys          wall           GGC
+#   phase parsing   :   0.20 ( 17%)   0.04 ( 29%)   0.24 ( 18%)    21M ( 26%)
+#   TOTAL           :   1.17          0.14          1.32           82M
+# Only lines between the header and the TOTAL line are parsed: -fmem-report
+# output (which can precede the table) contains "name: number" lines too
+TIME_HEADER_RE  = re.compile(r'^\s*(Execution times \(seconds\)|Time variable\s)')
+TIME_REPORT_RE  = re.compile(r'^\s*([^:]*?)\s*:\s*(\d.*)$')
+# Values of a pass (unlike the TOTAL line) have percentages
+TIME_PASS_RE    = re.compile(r'^\d+(?:\.\d*)?\s*\(\s*\d+%\)')
+TIME_TOTAL      = 'TOTAL'
+TIME_VALUE_RE   = re.compile(r'(\d+(?:\.\d*)?)\s*(kB|[kMG])?\s*(?:\(\s*\d+%\))?\s*(usr|sys|wall|ggc)?')
+MEM_REPORT_RE   = re.compile(r'^\s*(Total\s+[A-Za-z ]*?)\s*:\s*(\d+(?:\.\d*)?)\s*(kB|[kMG])?\s*$')
+TIME_COLUMNS    = ['usr', 'sys', 'wall', 'ggc']
+
+def to_kb(value, unit):
+    '''Convert memory amount printed by GCC to kB'''
+    if unit in ['k', 'kB']:
+        return value
+    if unit == 'M':
+        return value * 1024
+    if unit == 'G':
+        return value * 1024 * 1024
+    return value / 1024.0
+
+def parse_time_report(lines):
+    '''Parse -ftime-report output. Return dictionary: pass name -> PassTime
+       (the total is stored under the 'TOTAL' key)'''
+    result = {}
+    in_table = False
+    for line in lines:
+        if TIME_HEADER_RE.match(line):
+            in_table = True
+            continue
+        if not in_table:
+            continue
+        match = TIME_REPORT_RE.match(line)
+        if not match:
+            continue
+        name = match.group(1)
+        if name == TIME_TOTAL:
+            in_table = False
+        elif not name or not TIME_PASS_RE.match(match.group(2)):
+            continue
+        values = TIME_VALUE_RE.findall(match.group(2))
+        if not values:
+            continue
+        entry = result.setdefault(name, PassTime())
+        for (ind, (value, unit, label)) in enumerate(values):
+            column = label or (TIME_COLUMNS[ind] if ind < len(TIME_COLUMNS) else None)
+            if column is None:
+                break
+            value = float(value)
+            if column == 'ggc':
+                value = to_kb(value, unit)
+            setattr(entry, column, getattr(entry, column) + value)
+    return result
+
+def parse_mem_report(lines):
+    '''Parse summary lines of -fmem-report output (e.g. "Total Allocated").
+       Return dictionary: name -> kB'''
+    result = {}
+    for line in lines:
+        match = MEM_REPORT_RE.match(line)
+        if match:
+            name = ' '.join(match.group(1).split())
+            result[name] = to_kb(float(match.group(2)), match.group(3))
+    return result
+
+WORKLOAD_RE = re.compile(r'^\s*#\s*WORKLOAD:\s*(.*?)\s*$')
+# Lines of compiler reports (-ftime-report, -fmem-report) are written to the
+# log with this prefix between the WORKLOAD marker and perf output
+REPORT_PREFIX = '#|'
+# Configuration of a run in a configuration sweep, e.g.:
+#  # CONFIG: opt=O2 alloc=tcmalloc compiler=gcc-6
+# (follows the WORKLOAD marker)
+CONFIG_RE = re.compile(r'^\s*#\s*CONFIG:\s*(.*?)\s*$')
+
+def format_config(config):
+    '''Format configuration (list of (key, value) pairs) for CONFIG marker'''
+    return ' '.join('{}={}'.format(k, v) for (k, v) in config)
+
+def parse_config(s):
+    '''Parse configuration written by format_config'''
+    return tuple(tuple(item.split('=', 1)) for item in s.split() if '=' in item)
+
+# Keys of CONFIG markers written by build_spec.py (configuration sweeps and
+# LTO links). The analysis scripts treat them as key columns, not counters
+CONFIG_KEYS = ['opt', 'alloc', 'compiler', 'flto']
+
+def config_label(values):
+    '''Label of a configuration used by the analysis scripts instead of the
+       optimization level. values - list of values (strings, '' if missing)
+       of CONFIG_KEYS, e.g. "O2_g alloc=tcmalloc" ('' if all are missing)'''
+    opt = values[0]
+    other = ['{}={}'.format(k, v) for (k, v) in zip(CONFIG_KEYS[1:], values[1:]) if v != '']
+    return ' '.join(([opt] if opt != '' else []) + other)
+
+# Fixed cost of a timed compilation (the compiler run on an empty unit
+# through the taskset/chrt/perf wrappers), measured by build_spec.py
+# --calibrate and written at the beginning of the log, e.g.:
+#  # OVERHEAD: .ii task-clock=4.52 cycles=15123400 instructions=20034011
+# The key is the extension of the units, to which the overhead applies
+OVERHEAD_RE = re.compile(r'^\s*#\s*OVERHEAD:\s*(\S+)\s*(.*?)\s*$')
+# Prefix of values corrected for the overhead (e.g. 'net:task-clock')
+NET_PREFIX  = 'net:'
+
+def parse_overhead(s):
+    '''Parse values of an OVERHEAD marker: dictionary name -> value'''
+    return dict((k, to_num(v)) for (k, v) in parse_config(s))
+
+def decimals(value):
+    '''Number of decimal digits of a value parsed by to_num (None for
+       integers)'''
+    if isinstance(value, numbers.Integral):
+        return None
+    mantissa, _, exp = repr(value).partition('e')
+    return max(len(mantissa.partition('.')[2]) - int(exp or 0), 0)
+
+def net_items(run, overhead):
+    '''Values of run corrected for the overhead as (key, value) pairs (keys
+       have NET_PREFIX). Values, which would become negative, are clamped to
+       zero; values are rounded to the precision of the measured ones.
+       overhead - dictionary filled by iter_runs'''
+    if not overhead or run.name is None:
+        return []
+    values = overhead.get(os.path.splitext(run.name)[1])
+    if values is None:
+        return []
+    result = []
+    for (k, v) in run.items():
+        if k not in values:
+            continue
+        # Round off the errors of floating point subtraction
+        digits = [d for d in [decimals(v), decimals(values[k])] if d is not None]
+        net = round(v - values[k], max(digits)) if digits else v - values[k]
+        result.append((NET_PREFIX + k, max(net, 0)))
+    return result
+
+def iter_runs(input, separator=',', overhead=None):
+    '''Parse perf output from an iterable of lines (e.g. a file or a pipe)
+       and yield RunReport objects one at a time. If overhead (a dictionary) is
+       given, OVERHEAD markers are stored into it: extension of units ->
+       dictionary name -> value (the markers precede the runs, so they are
+       stored before the first run is yielded)'''
+    key_cache = KeyCache()
+    # Configurations are shared between runs: marker string -> parsed tuple
+    config_cache = {}
+    lines = []
+    report = None
+    config = None
+    workload_name = None
+    for line in input:
+        if line.startswith(REPORT_PREFIX):
+            if report is None:
+                report = []
+            report.append(line[len(REPORT_PREFIX):].rstrip('\r\n'))
+            continue
+        match = WORKLOAD_RE.match(line)
+        if match:
+            if lines:
+                yield RunReport(workload_name, lines, separator, key_cache, report, config)
+                lines = []
+            report = None
+            config = None
+            workload_name = match.group(1)
+            continue
+        match = OVERHEAD_RE.match(line)
+        if match:
+            if overhead is not None:
+                overhead[match.group(1)] = parse_overhead(match.group(2))
+            continue
+        match = CONFIG_RE.match(line)
+        if match:
+            config = config_cache.get(match.group(1))
+            if config is None:
+                config = config_cache[match.group(1)] = parse_config(match.group(1))
+            continue
+        pos = line.find('#')
+        if pos >= 0:
+            line = line[:pos]
+        line = line.strip()
+        if not line:
+            if lines:
+                yield RunReport(workload_name, lines, separator, key_cache, report, config)
+                lines = []
+                report = None
+                config = None
+                workload_name = None
+            continue
+        lines.append(line)
+    if lines:
+        yield RunReport(workload_name, lines, separator, key_cache, report, config)
+
+class PerfReport:
     def __init__(self, input, separator=','):
-        class RunReportBuilder:
-            def __init__(self):
-                self.lines = []
-                self.workload_name = None
-
-            def append_line(self, line):
-                self.lines.append(line)
-
-            def maybe_flush(self, dest):
-                if not self.lines:
-                    return
-                dest.append(RunReport(self.workload_name,
-                                      self.lines, separator))
-                self.lines = []
-                self.workload_name = None
-
-        self.runs = []
-        bld = RunReportBuilder()
-
-        for line in input:
-            match = self.WORKLOAD_RE.match(line)
-            if match:
-                bld.maybe_flush(self.runs)
-                bld.workload_name = match.group(1)
-                continue
-            pos = line.find('#')
-            if pos >= 0:
-                line = line[:pos]
-            line = line.strip()
-            if not line:
-                bld.maybe_flush(self.runs)
-                continue
-            bld.append_line(line)
-        bld.maybe_flush(self.runs)
+        # See iter_runs
+        self.overhead = {}
+        self.runs = list(iter_runs(input, separator, self.overhead))
 
     def __str__(self):
         return str(self.runs)
@@ -113,9 +381,10 @@ class PerfReport:
     def get_raw_data(self):
         result = []
         for run in self.runs:
-            row = {'name': run.name}
-            for k, v in run.values.items():
-                row[k] = v.value
+            row = dict(run.items())
+            if run.config:
+                row.update(run.config)
+            row['name'] = run.name
             result.append(row)
         return result
 
@@ -0,0 +1,108 @@
+# Content-addressed cache of preprocessed translation units.
+#
+# Each entry is stored under a key which is a hash of everything the
+# preprocessed output depends on: the compiler binary, the command line
+# options, the absolute path (it is embedded into line markers) and the
+# contents of the source file.
+
+import os, os.path
+import hashlib
+import shutil
+
+class CacheError(Exception): pass
+
+HASH_BLOCK = 1 << 20
+
+def hash_file(path, digest=None):
+    '''Feed contents of file into digest (creates a new SHA-1 digest if
+       none given) and return it'''
+    if digest is None:
+        digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            digest.update(block)
+    return digest
+
+class PreprocCache:
+    def __init__(self, path, max_size):
+        '''path - cache directory, max_size - size limit in bytes'''
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError as ex:
+                raise CacheError('failed to create cache directory: {}'.format(ex))
+
+    @staticmethod
+    def make_key(compiler_digest, options, src_path):
+        '''Compute cache key of a translation unit'''
+        digest = hashlib.sha1()
+        digest.update(compiler_digest.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update('\0'.join(options).encode('utf-8'))
+        digest.update(b'\0')
+        # The path is written into line markers (and its extension selects
+        # the language)
+        digest.update(os.path.abspath(src_path).encode('utf-8'))
+        digest.update(b'\0')
+        return hash_file(src_path, digest).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key, dest):
+        '''Copy cached entry to dest. Return False if there is no such entry'''
+        entry = self._entry_path(key)
+        if not os.path.exists(entry):
+            self.misses += 1
+            return False
+        shutil.copyfile(entry, dest)
+        # Update mtime: eviction removes least recently used entries
+        os.utime(entry, None)
+        self.hits += 1
+        return True
+
+    def put(self, key, src):
+        '''Store a copy of file src in the cache'''
+        entry = self._entry_path(key)
+        entry_dir = os.path.dirname(entry)
+        if not os.path.isdir(entry_dir):
+            os.makedirs(entry_dir)
+        # Copy to a temporary name first, so that an interrupted copy does not
+        # leave a truncated entry
+        tmp = entry + '.tmp'
+        shutil.copyfile(src, tmp)
+        os.rename(tmp, entry)
+
+    def entries(self):
+        '''Return list of (mtime, size, path) for all cache entries'''
+        result = []
+        for subdir in os.listdir(self.path):
+            full_subdir = os.path.join(self.path, subdir)
+            if not os.path.isdir(full_subdir):
+                continue
+            for fname in os.listdir(full_subdir):
+                full_path = os.path.join(full_subdir, fname)
+                st = os.stat(full_path)
+                result.append((st.st_mtime, st.st_size, full_path))
+        return result
+
+    def evict(self):
+        '''Remove least recently used entries until the total size of the
+           cache fits into the limit. Return number of removed entries'''
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, full_path in entries:
+            if total <= self.max_size:
+                break
+            os.remove(full_path)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,504 @@
+# In-process benchmark runner.
+#
+# Runs timed compilations in parallel: one compilation per CPU core, each
+# one bound to its core and run with FIFO scheduling policy, i.e. the same
+# way as the shell scripts generated by build_spec.py do it for CPU 0.
+# Each compilation is measured by 'perf stat'; the results are appended to
+# a single log in the format consumed by perf_report.PerfReport.
+
+import os, os.path
+import gzip
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import sys
+
+# Local modules
+import perf_report
+import stats
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class RunnerError(Exception): pass
+
+def parse_cpu_list(s):
+    '''Parse list of CPUs in taskset/cpuset format, e.g. "2-5,8,10-11"'''
+    cpus = []
+    for part in s.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                first, last = part.split('-', 1)
+                cpus += list(range(int(first), int(last) + 1))
+            else:
+                cpus.append(int(part))
+        except ValueError:
+            raise RunnerError('invalid CPU list: \'{}\''.format(s))
+    if not cpus or any(cpu < 0 for cpu in cpus):
+        raise RunnerError('invalid CPU list: \'{}\''.format(s))
+    if len(set(cpus)) != len(cpus):
+        raise RunnerError('duplicate CPUs in list: \'{}\''.format(s))
+    return cpus
+
+# Values measured by the runner itself (in addition to perf counters). They
+# are written to the log after page-faults, in the same format as perf output
+MAX_RSS         = 'max-rss'
+WALL_TIME       = 'wall-time'
+MALLOC_CALLS    = 'malloc-calls'
+MALLOC_FREES    = 'malloc-frees'
+MALLOC_BYTES    = 'malloc-bytes'
+PAGE_FAULTS     = 'page-faults'
+# Values, which are not additive, i.e. the overhead of the harness (see
+# Runner.calibrate) can not be subtracted from them
+NON_ADDITIVE    = [MAX_RSS]
+# Environment variable: the file, into which malloc_count.so writes counters
+MALLOC_COUNT_OUT = 'MALLOC_COUNT_OUT'
+
+def malloc_count_env(env, shim_path, out_path):
+    '''Environment for counting memory allocations using malloc_count.so. The
+       shim is preloaded before the allocator (if any), so that it forwards
+       calls to the allocator'''
+    env = dict(os.environ if env is None else env)
+    preload = env.get('LD_PRELOAD')
+    env['LD_PRELOAD'] = shim_path + (' ' + preload if preload else '')
+    env[MALLOC_COUNT_OUT] = out_path
+    return env
+
+def read_malloc_counts(path, program):
+    '''Read counters written by malloc_count.so for given program (other
+       processes, e.g. perf, are ignored). Returns (allocations, frees, bytes)
+       or None, if the program did not write its counters'''
+    result = None
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split(',')
+            if len(fields) != 4 or fields[0] != program:
+                continue
+            counts = [int(v) for v in fields[1:]]
+            result = counts if result is None else [a + b for (a, b) in zip(result, counts)]
+    return result
+
+def insert_values(perf_output, values):
+    '''Insert values (list of (name, value, unit)) into perf output after
+       the page-faults line (or at the end, if it is absent)'''
+    lines = perf_output.splitlines(True)
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+    pos = len(lines)
+    for (ind, line) in enumerate(lines):
+        fields = line.split(',')
+        if len(fields) >= 3 and fields[2] == PAGE_FAULTS:
+            pos = ind + 1
+            break
+    new_lines = ['{},{},{},,\n'.format(value, unit, name) for (name, value, unit) in values]
+    return ''.join(lines[:pos] + new_lines + lines[pos:])
+
+# Compressed preprocessed units are decompressed into a staging directory
+# before the timed compilation. tmpfs is preferred (it holds a single unit at
+# a time)
+DEFAULT_STAGING_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+COMPRESSED_EXT  = '.gz'
+
+def decompress(src_path, dest_path):
+    '''Decompress a gzip-compressed file'''
+    with gzip.open(src_path, 'rb') as src:
+        with open(dest_path, 'wb') as dest:
+            shutil.copyfileobj(src, dest, 1 << 20)
+
+def staged_name(compressed):
+    '''Name of the decompressed unit. It is the name of the uncompressed unit,
+       because the compiler writes the name of its input into the assembly'''
+    return os.path.basename(compressed[:-len(COMPRESSED_EXT)])
+
+def stage_input(argv, compressed, stage_dir):
+    '''Decompress compressed input of a command into stage_dir. Returns the
+       command, in which the compressed file is replaced with the decompressed
+       one'''
+    stage_path = os.path.join(stage_dir, staged_name(compressed))
+    decompress(compressed, stage_path)
+    return [stage_path if arg == compressed else arg for arg in argv]
+
+def bind_aff_sched_argv(cpu):
+    '''Command prefix which binds the process to CPU and sets FIFO policy'''
+    return ['taskset', '-c', str(cpu), 'chrt', '--fifo', '99']
+
+def perf_argv(out_path):
+    '''Command prefix which runs 'perf stat' writing results to out_path'''
+    return ['perf', 'stat', '-d', '-x,', '-o', out_path]
+
+class Job:
+    '''A single timed compilation'''
+    def __init__(self, workload, argv, repeat=0, env=None, config=None, compressed=None):
+        # Workload name, as written in '# WORKLOAD:' marker (bench/file)
+        self.workload = workload
+        # Compiler command line
+        self.argv = argv
+        # Index of the repeat (distinguishes runs of the same workload)
+        self.repeat = repeat
+        # Environment of the compiler (None means the runner's one)
+        self.env = env
+        # Configuration of the run, written as '# CONFIG:' marker (list of
+        # (key, value) pairs, see perf_report.format_config)
+        self.config = config
+        # Compressed input file (an element of argv), which is decompressed
+        # into a staging directory before the compilation (outside of the
+        # measured command)
+        self.compressed = compressed
+
+JOURNAL_CONFIG  = 'config'
+JOURNAL_DONE    = 'done'
+JOURNAL_FAILED  = 'failed'
+
+class Journal:
+    '''Append-only record of finished jobs, which allows to resume an
+       interrupted run. Each line is a tab-separated entry:
+         config <description of the run configuration>
+         done <workload> <repeat> <size of the log after writing the result>
+         failed <workload> <repeat> <reason>
+       A result is recorded after it has been written to the log, so the log
+       size in the last 'done' entry is the end of the last complete result'''
+    def __init__(self, path, config):
+        '''config - string describing the configuration (the journal can only
+           be resumed with the same configuration)'''
+        self.path = path
+        # Set of (workload, repeat)
+        self.done = set()
+        # (workload, repeat) -> reason of the last failure
+        self.failed = {}
+        self.log_size = 0
+        is_new = not os.path.exists(path)
+        if not is_new:
+            self._load(config)
+        self._file = open(path, 'a')
+        if is_new:
+            self._write(JOURNAL_CONFIG, config)
+
+    def _load(self, config):
+        with open(self.path, 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # Incomplete entry (the run was interrupted while writing it)
+                    break
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] == JOURNAL_CONFIG:
+                    if fields[1:] != [config]:
+                        raise RunnerError('journal \'{}\' was created with a different'
+                                          ' configuration (remove it to start a new run):'
+                                          ' {}'.format(self.path, '\t'.join(fields[1:])))
+                    continue
+                if len(fields) != 4:
+                    raise RunnerError('malformed journal entry: {}'.format(line.strip()))
+                key = (fields[1], int(fields[2]))
+                if fields[0] == JOURNAL_DONE:
+                    self.done.add(key)
+                    self.failed.pop(key, None)
+                    self.log_size = int(fields[3])
+                elif fields[0] == JOURNAL_FAILED:
+                    self.failed[key] = fields[3]
+
+    def is_done(self, job):
+        return (job.workload, job.repeat) in self.done
+
+    def _write(self, *fields):
+        self._file.write('\t'.join(str(f) for f in fields) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record_done(self, job, log_size):
+        self.done.add((job.workload, job.repeat))
+        self.failed.pop((job.workload, job.repeat), None)
+        self._write(JOURNAL_DONE, job.workload, job.repeat, log_size)
+
+    def record_failed(self, job, reason):
+        self.failed[(job.workload, job.repeat)] = reason
+        self._write(JOURNAL_FAILED, job.workload, job.repeat, reason)
+
+    def close(self):
+        self._file.close()
+
+class AdaptivePolicy:
+    '''Repeat each job until the confidence interval of the mean value of a
+       counter becomes narrow enough'''
+    def __init__(self, counter, target, min_repeat, max_repeat, confidence=0.95):
+        '''target - relative half-width of confidence interval (e.g. 0.01)'''
+        self.counter = counter
+        self.target = target
+        self.min_repeat = min_repeat
+        self.max_repeat = max_repeat
+        self.confidence = confidence
+
+    def extract(self, perf_output):
+        '''Get counter value from perf output (None, if not measured)'''
+        for run in perf_report.iter_runs(perf_output.splitlines()):
+            value = run.get_value(self.counter)
+            if value is not None:
+                return value
+        return None
+
+    def rel_ci(self, values):
+        return stats.rel_ci(values, self.confidence)
+
+    def is_done(self, values):
+        if len(values) >= self.max_repeat:
+            return True
+        return len(values) >= self.min_repeat and self.rel_ci(values) <= self.target
+
+class Runner:
+    def __init__(self, cpus, log, env=None, verbose=False, policy=None, summary=None,
+                 capture_report=False, journal=None, count_malloc=None, wall_time=False,
+                 staging_dir=DEFAULT_STAGING_DIR):
+        '''cpus - list of CPU numbers, log - file object open for writing,
+           env - environment of compiler processes (None means inherit),
+           policy - AdaptivePolicy (None means run each job once),
+           summary - file object for per-job number of repeats (CSV format),
+           capture_report - write compiler stderr (-ftime-report/-fmem-report
+           output) to the log,
+           journal - Journal: record finished and failed jobs (failures do
+           not stop the run),
+           count_malloc - path of malloc_count.so: count memory allocations
+           of the compiler,
+           wall_time - record elapsed time of each job (e.g. of a parallel
+           link, whose task-clock is the sum over all CPUs),
+           staging_dir - directory, in which staging directories for
+           decompressed inputs of jobs are created (see Job.compressed)'''
+        self.cpus = cpus
+        self.log = log
+        self.env = env
+        self.verbose = verbose
+        self.policy = policy
+        self.summary = summary
+        self.capture_report = capture_report
+        self.journal = journal
+        self.count_malloc = count_malloc
+        self.wall_time = wall_time
+        self.staging_dir = staging_dir
+        if summary is not None:
+            summary.write('"name","repeats","mean","rel_ci","converged"\n')
+        self.failed = []
+        self.done = 0
+        self._lock = threading.Lock()
+        self._stop = False
+
+    def _write_result(self, job, perf_output, report=None):
+        with self._lock:
+            self.log.write('# WORKLOAD: {}\n'.format(job.workload))
+            if job.config:
+                self.log.write('# CONFIG: {}\n'.format(perf_report.format_config(job.config)))
+            if report:
+                for line in report.splitlines():
+                    self.log.write('{} {}\n'.format(perf_report.REPORT_PREFIX, line))
+            self.log.write(perf_output)
+            self.log.flush()
+            if self.journal is not None:
+                os.fsync(self.log.fileno())
+                self.journal.record_done(job, self.log.tell())
+            self.done += 1
+            if self.verbose:
+                sys.stdout.write('# {}\n'.format(job.workload))
+            else:
+                sys.stdout.write('.')
+            sys.stdout.flush()
+
+    def _write_summary(self, job, values):
+        if self.summary is None:
+            return
+        rel_ci = self.policy.rel_ci(values)
+        with self._lock:
+            self.summary.write('"{}",{},{!r},{!r},{}\n'.format(
+                job.workload, len(values), stats.mean(values), rel_ci,
+                int(rel_ci <= self.policy.target)))
+            self.summary.flush()
+
+    def _fail(self, job, reason):
+        with self._lock:
+            self.failed.append((job, reason))
+            if self.journal is not None:
+                self.journal.record_failed(job, reason)
+            else:
+                self._stop = True
+
+    def run_one(self, cpu, job, out_path, report_path=None, count_path=None, job_argv=None):
+        '''Run job on given CPU, return perf output (with max RSS and memory
+           allocation counters added) or None on failure. If report_path is
+           given, compiler stderr is redirected into it. count_path - file for
+           malloc_count.so output (used if count_malloc is set), job_argv -
+           command to run instead of job.argv (e.g. with staged input)'''
+        argv = bind_aff_sched_argv(cpu) + perf_argv(out_path) + (job_argv or job.argv)
+        env = self.env if job.env is None else job.env
+        if count_path is not None:
+            env = malloc_count_env(env, self.count_malloc, count_path)
+            open(count_path, 'w').close()
+        report = None if report_path is None else open(report_path, 'w')
+        try:
+            start = time.time()
+            proc = subprocess.Popen(argv, env=env, stderr=report)
+            # Use wait4 to get resource usage of this particular child. taskset
+            # and chrt exec the next command, so the child is perf, and its
+            # max RSS includes the compiler (which normally dominates)
+            _, status, usage = os.wait4(proc.pid, 0)
+            elapsed = time.time() - start
+            proc.returncode = status
+        finally:
+            if report is not None:
+                report.close()
+        if status != 0:
+            return None
+        with open(out_path, 'r') as f:
+            perf_output = f.read()
+        values = [(MAX_RSS, usage.ru_maxrss, 'kB')]
+        if self.wall_time:
+            values.append((WALL_TIME, '{:.6f}'.format(elapsed * 1000), 'msec'))
+        if count_path is not None:
+            counts = read_malloc_counts(count_path, os.path.basename(job.argv[0]))
+            if counts is not None:
+                values += zip([MALLOC_CALLS, MALLOC_FREES, MALLOC_BYTES], counts,
+                              ['', '', 'B'])
+        return insert_values(perf_output, values)
+
+    def calibrate(self, jobs, repeat):
+        '''Measure the fixed cost of timed compilations: run each job (e.g. a
+           compilation of an empty unit) repeat times on the first CPU and take
+           the median of each additive value. Returns dictionary: workload ->
+           list of (name, value)'''
+        cpu = self.cpus[0]
+        fd, out_path = tempfile.mkstemp(prefix='perf-cpu{}-'.format(cpu))
+        os.close(fd)
+        count_path = None
+        if self.count_malloc is not None:
+            fd, count_path = tempfile.mkstemp(prefix='malloc-cpu{}-'.format(cpu))
+            os.close(fd)
+        result = {}
+        try:
+            for job in jobs:
+                samples = {}
+                for _ in range(repeat):
+                    # Compiler reports are not needed, discard them
+                    perf_output = self.run_one(cpu, job, out_path, os.devnull, count_path)
+                    if perf_output is None:
+                        raise RunnerError('calibration failed: {}'.format(' '.join(job.argv)))
+                    for run in perf_report.iter_runs(perf_output.splitlines()):
+                        for (name, value) in run.items():
+                            if name not in NON_ADDITIVE:
+                                samples.setdefault(name, []).append(value)
+                values = []
+                for (name, column) in sorted(samples.items()):
+                    if len(column) != repeat:
+                        continue
+                    value = stats.median(column)
+                    digits = [d for d in map(perf_report.decimals, column) if d is not None]
+                    if not digits:
+                        value = int(round(value))
+                    else:
+                        # The mean of the middle values has one more digit
+                        value = round(value, max(digits) + 1)
+                    values.append((name, value))
+                result[job.workload] = values
+        finally:
+            for path in [out_path, count_path]:
+                if path is not None:
+                    os.remove(path)
+        return result
+
+    def _stage(self, job, stage_dir):
+        '''Decompress the input of job into the staging directory of the CPU
+           (replacing the unit staged by the previous job). Returns the
+           command'''
+        name = staged_name(job.compressed)
+        for fname in os.listdir(stage_dir):
+            if fname != name:
+                os.remove(os.path.join(stage_dir, fname))
+        return stage_input(job.argv, job.compressed, stage_dir)
+
+    def _run_job(self, cpu, job, out_path, report_path=None, count_path=None,
+                 stage_dir=None):
+        '''Run job (several times, if adaptive policy is used). Return False
+           on failure'''
+        values = []
+        job_argv = None
+        if job.compressed is not None:
+            try:
+                job_argv = self._stage(job, stage_dir)
+            except (IOError, OSError) as ex:
+                self._fail(job, 'failed to decompress input: {}'.format(ex))
+                return False
+        while not self._stop:
+            perf_output = self.run_one(cpu, job, out_path, report_path, count_path, job_argv)
+            if perf_output is None:
+                self._fail(job, 'compilation failed')
+                return False
+            report = None
+            if report_path is not None:
+                with open(report_path, 'r') as f:
+                    report = f.read()
+            self._write_result(job, perf_output, report)
+            if self.policy is None:
+                return True
+            value = self.policy.extract(perf_output)
+            if value is None:
+                self._fail(job, '\'{}\' not measured'.format(self.policy.counter))
+                return False
+            values.append(value)
+            if self.policy.is_done(values):
+                self._write_summary(job, values)
+                return True
+        return True
+
+    def _worker(self, cpu, jobs):
+        fd, out_path = tempfile.mkstemp(prefix='perf-cpu{}-'.format(cpu))
+        os.close(fd)
+        report_path = None
+        if self.capture_report:
+            fd, report_path = tempfile.mkstemp(prefix='report-cpu{}-'.format(cpu))
+            os.close(fd)
+        count_path = None
+        if self.count_malloc is not None:
+            fd, count_path = tempfile.mkstemp(prefix='malloc-cpu{}-'.format(cpu))
+            os.close(fd)
+        stage_dir = tempfile.mkdtemp(prefix='stage-cpu{}-'.format(cpu), dir=self.staging_dir)
+        try:
+            while not self._stop:
+                try:
+                    job = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if not self._run_job(cpu, job, out_path, report_path, count_path,
+                                     stage_dir) and self.journal is None:
+                    break
+        finally:
+            os.remove(out_path)
+            for path in [report_path, count_path]:
+                if path is not None:
+                    os.remove(path)
+            shutil.rmtree(stage_dir)
+
+    def run(self, jobs):
+        '''Run all jobs. Stops at the first failure, unless a journal is used
+           (in this case failed jobs are recorded in the journal and in the
+           'failed' attribute)'''
+        job_queue = queue.Queue()
+        for job in jobs:
+            job_queue.put(job)
+        threads = [threading.Thread(target=self._worker, args=(cpu, job_queue))
+                   for cpu in self.cpus]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            # Join with timeout, so that KeyboardInterrupt is delivered
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1.0)
+        except KeyboardInterrupt:
+            self._stop = True
+            raise
+        sys.stdout.write('\n')
+        if self.failed and self.journal is None:
+            job, reason = self.failed[0]
+            raise RunnerError('{}: {}'.format(reason, ' '.join(job.argv)))
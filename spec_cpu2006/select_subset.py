@@ -0,0 +1,346 @@
+#!/usr/bin/env python2.7
+
+# This script selects a small representative subset of translation units,
+# whose compile time can be used to estimate the compile time of the whole
+# benchmark suite (e.g. as a quick check before a commit).
+#
+# TUs are clustered (k-means) by their normalized counter vectors: compile
+# time at each optimization level (log scale) and the rates which describe
+# the instruction mix (IPC, branch and L1 cache miss rates). The TU closest
+# to the centroid of each cluster represents the cluster; its weight is the
+# ratio of the total value of a counter in the cluster to its own value
+# (computed for each counter and optimization level separately), so the
+# weighted sum of the subset is the estimate of the total.
+#
+# The first dataset is used for the selection, the others (e.g. results of
+# a different compiler, allocator or host) validate it: the error is the
+# worst relative difference between the estimated and the actual totals.
+
+from __future__ import print_function
+
+# System modules
+import os, os.path
+import sys
+import argparse
+
+# Local modules
+import colstore
+from compare import Comparison, CompareError, NO_OPT, dataset_labels
+
+def error(msg):
+    '''Print error message to stderr and exit with non-zero status'''
+    sys.stderr.write('Error: {}\n'.format(msg))
+    sys.exit(1)
+
+try:
+    import numpy as np
+except ImportError:
+    error('required package \'numpy\' not found')
+
+class SubsetError(Exception): pass
+
+# Counters, whose totals are estimated
+TOTAL_COUNTERS  = ['task-clock', 'cycles', 'instructions']
+# Rates used as clustering features (if measured): (numerator, denominator)
+RATES           = [('instructions', 'cycles'), ('branch-misses', 'branches'),
+                   ('L1-dcache-load-misses', 'L1-dcache-loads')]
+# Subset sizes tried when the target error is given
+SIZES           = [5, 10, 15, 20, 30, 40, 50, 60, 80, 100, 120, 150, 200, 250, 300, 400, 500]
+KMEANS_ITER     = 100
+
+class Measurements:
+    '''Per-TU means of counters: for each dataset and counter an array of
+       shape (number of TUs, number of optimization levels). Only TUs, whose
+       counters were measured at all levels in the first dataset, are
+       included'''
+    def __init__(self, datasets):
+        counters = list(TOTAL_COUNTERS)
+        for (num, den) in RATES:
+            if all(num in ds and den in ds for ds in datasets):
+                counters += [c for c in [num, den] if c not in counters]
+        comp = Comparison(datasets, counters)
+        opt_ids = sorted(set(comp.opt_ids))
+        self.opts = [comp.opt_names[o] for o in opt_ids]
+        opt_pos = np.zeros(comp.num_opts, dtype=np.int64)
+        opt_pos[opt_ids] = np.arange(len(opt_ids))
+        name_ids = sorted(set(comp.name_ids))
+        name_pos = dict((n, i) for (i, n) in enumerate(name_ids))
+        rows = np.array([name_pos[n] for n in comp.name_ids], dtype=np.int64)
+        cols = opt_pos[comp.opt_ids]
+        self.values = []
+        for ds_ind in range(len(datasets)):
+            per_counter = {}
+            for counter in counters:
+                matrix = np.full((len(name_ids), len(opt_ids)), np.nan)
+                matrix[rows, cols] = comp.tu_means(counter)[ds_ind]
+                per_counter[counter] = matrix
+            self.values.append(per_counter)
+        complete = np.all(self.values[0]['task-clock'] > 0, axis=1)
+        for counter in TOTAL_COUNTERS:
+            complete &= np.all(~np.isnan(self.values[0][counter]), axis=1)
+        self.names = [comp.tu_names[n] for (n, ok) in zip(name_ids, complete) if ok]
+        for per_counter in self.values:
+            for counter in counters:
+                per_counter[counter] = per_counter[counter][complete]
+        if not self.names:
+            raise SubsetError('no TUs measured at all optimization levels')
+        self.rates = [(num, den) for (num, den) in RATES if num in counters]
+
+    def features(self):
+        '''Normalized feature vectors of TUs (based on the first dataset)'''
+        ref = self.values[0]
+        columns = [np.log(ref['task-clock'])]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for (num, den) in self.rates:
+                rate = ref[num] / ref[den]
+                rate[~np.isfinite(rate)] = np.nan
+                columns.append(rate)
+        features = np.hstack(columns)
+        mean = np.nanmean(features, axis=0)
+        std = np.nanstd(features, axis=0)
+        std[std == 0] = 1
+        features = (features - mean) / std
+        features[np.isnan(features)] = 0
+        return features
+
+def kmeans(points, k, rng):
+    '''k-means clustering (k-means++ initialization). Returns (labels, centroids)'''
+    num_points = len(points)
+    centroids = [points[rng.randint(num_points)]]
+    dist = ((points - centroids[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = dist.sum()
+        if total == 0:
+            break
+        ind = np.searchsorted(np.cumsum(dist), rng.random_sample() * total)
+        centroids.append(points[min(ind, num_points - 1)])
+        dist = np.minimum(dist, ((points - centroids[-1]) ** 2).sum(axis=1))
+    centroids = np.array(centroids)
+    labels = None
+    for _ in range(KMEANS_ITER):
+        dist = ((points[:, np.newaxis, :] - centroids[np.newaxis, :, :]) ** 2).sum(axis=2)
+        new_labels = dist.argmin(axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for cluster in range(len(centroids)):
+            members = labels == cluster
+            if members.any():
+                centroids[cluster] = points[members].mean(axis=0)
+    return labels, centroids
+
+class Subset:
+    '''Representative TUs and their weights'''
+    def __init__(self, names, opts, weights):
+        '''weights - dictionary: counter -> array of shape (number of TUs,
+           number of optimization levels)'''
+        self.names = names
+        self.opts = opts
+        self.weights = weights
+
+    def estimate(self, values, counter):
+        '''Estimated totals of counter for each optimization level. values -
+           array of shape (number of TUs in the subset, number of levels)'''
+        return (self.weights[counter] * values).sum(axis=0)
+
+def select(meas, k, seed):
+    '''Select subset of k TUs. Returns (Subset, indices of the selected TUs)'''
+    points = meas.features()
+    k = min(k, len(points))
+    labels, centroids = kmeans(points, k, np.random.RandomState(seed))
+    ref = meas.values[0]
+    chosen = []
+    weights = dict((c, []) for c in TOTAL_COUNTERS)
+    for cluster in range(len(centroids)):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+        dist = ((points[members] - centroids[cluster]) ** 2).sum(axis=1)
+        rep = members[dist.argmin()]
+        chosen.append(rep)
+        for counter in TOTAL_COUNTERS:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                w = ref[counter][members].sum(axis=0) / ref[counter][rep]
+            w[~np.isfinite(w)] = 0
+            weights[counter].append(w)
+    order = sorted(range(len(chosen)), key=lambda i: meas.names[chosen[i]])
+    chosen = [chosen[i] for i in order]
+    weights = dict((c, np.array(w)[order]) for (c, w) in weights.items())
+    return Subset([meas.names[i] for i in chosen], meas.opts, weights), chosen
+
+def validate(meas, subset, chosen):
+    '''Relative errors of estimated totals: array of shape (number of
+       datasets, number of counters, number of optimization levels)'''
+    errors = np.zeros((len(meas.values), len(TOTAL_COUNTERS), len(meas.opts)))
+    for (ds_ind, per_counter) in enumerate(meas.values):
+        for (c_ind, counter) in enumerate(TOTAL_COUNTERS):
+            values = per_counter[counter]
+            valid = np.all(~np.isnan(values), axis=1)
+            actual = values[valid].sum(axis=0)
+            estimate = subset.estimate(np.nan_to_num(values[chosen]), counter)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                errors[ds_ind, c_ind] = np.abs(estimate / actual - 1)
+    return errors
+
+def cost_fraction(meas, chosen):
+    '''Compile time of the subset relative to the whole suite (per level)'''
+    times = meas.values[0]['task-clock']
+    return times[chosen].sum(axis=0) / times.sum(axis=0)
+
+def write_subset(dest, subset, comments):
+    for line in comments:
+        dest.write('# {}\n'.format(line))
+    columns = ['{}:{}'.format(c, o or '-') for c in TOTAL_COUNTERS for o in subset.opts]
+    dest.write(','.join('"{}"'.format(c) for c in ['name'] + columns) + '\n')
+    for (ind, name) in enumerate(subset.names):
+        weights = [subset.weights[c][ind, o] for c in TOTAL_COUNTERS
+                   for o in range(len(subset.opts))]
+        dest.write('"{}",{}\n'.format(name, ','.join(repr(float(w)) for w in weights)))
+
+def read_subset(path):
+    '''Read subset file written by write_subset'''
+    with open(path, 'r') as f:
+        lines = [line.rstrip('\n') for line in f if line.strip() and not line.startswith('#')]
+    if not lines:
+        raise SubsetError('\'{}\' is empty'.format(path))
+    header = [h.strip('"') for h in lines[0].split(',')]
+    if header[0] != 'name':
+        raise SubsetError('\'{}\' is not a subset file'.format(path))
+    opts = []
+    for column in header[1:]:
+        counter, opt = column.rsplit(':', 1)
+        opt = NO_OPT if opt == '-' else opt
+        if counter == TOTAL_COUNTERS[0]:
+            opts.append(opt)
+    names = []
+    weights = []
+    for line in lines[1:]:
+        parts = line.split(',')
+        names.append(parts[0].strip('"'))
+        weights.append([float(w) for w in parts[1:]])
+    weights = np.array(weights).reshape(len(names), len(TOTAL_COUNTERS), len(opts))
+    return Subset(names, opts, dict((c, weights[:, i, :])
+                                    for (i, c) in enumerate(TOTAL_COUNTERS)))
+
+def fmt_counter(counter, value):
+    # task-clock is measured in milliseconds
+    if counter == 'task-clock':
+        return '{:.1f} s'.format(value / 1000)
+    return '{:.4g}'.format(value)
+
+def run_select(args):
+    paths = args.inputs
+    try:
+        datasets = [colstore.open_dataset(p) for p in paths]
+        meas = Measurements(datasets)
+    except (colstore.StoreError, CompareError, SubsetError) as ex:
+        error(str(ex))
+    labels = dataset_labels(paths)
+    print('{} TUs measured at {}'.format(
+            len(meas.names), ', '.join(o or '-' for o in meas.opts)))
+    if args.error is not None and len(datasets) < 2:
+        error('--error requires at least one validation dataset')
+
+    sizes = [args.size] if args.error is None else \
+            [s for s in SIZES if s < len(meas.names)] + [len(meas.names)]
+    for size in sizes:
+        subset, chosen = select(meas, size, args.seed)
+        errors = validate(meas, subset, chosen)
+        worst = errors[1:].max() if len(datasets) > 1 else float('nan')
+        if args.error is not None:
+            print('{:>5} TUs: max validation error {:.2%}'.format(len(chosen), worst))
+            if worst <= args.error / 100.0:
+                break
+    else:
+        if args.error is not None:
+            print('Warning: target error not reached')
+
+    cost = cost_fraction(meas, chosen)
+    print('\nSelected {} of {} TUs, {} of total compile time'.format(
+            len(chosen), len(meas.names),
+            ', '.join('{} {:.1%}'.format(o or '-', c) for (o, c) in zip(meas.opts, cost))))
+    print('Relative error of estimated totals:')
+    print('{:<24} {:<14} '.format('dataset', 'counter') +
+          ' '.join('{:>8}'.format((o or '-')[:8]) for o in meas.opts))
+    for (ds_ind, label) in enumerate(labels):
+        for (c_ind, counter) in enumerate(TOTAL_COUNTERS):
+            print('{:<24} {:<14} '.format(label[-24:], counter) +
+                  ' '.join('{:>8.2%}'.format(e) for e in errors[ds_ind, c_ind]))
+    comments = ['Representative subset: {} of {} TUs, selected using \'{}\''.format(
+                    len(chosen), len(meas.names), labels[0])]
+    if len(datasets) > 1:
+        comments.append('Max validation error: {:.2%} ({})'.format(
+                            worst, ', '.join(labels[1:])))
+    write_subset(args.output, subset, comments)
+
+def run_estimate(args):
+    try:
+        subset = read_subset(args.estimate)
+    except (IOError, ValueError, SubsetError) as ex:
+        error('failed to read subset: {}'.format(ex))
+    for arg in args.inputs:
+        if not os.path.exists(arg) and '=' in arg:
+            opt, path = arg.split('=', 1)
+        else:
+            opt, path = None, arg
+        try:
+            ds = colstore.open_dataset(path)
+        except (IOError, colstore.StoreError) as ex:
+            error(str(ex))
+        if opt is None and 'opt' not in ds:
+            error('\'{}\' has no \'opt\' column, please specify optimization'
+                  ' level as OPT=FILE'.format(path))
+        opts = [opt] if opt is not None else ds.dictionary('opt')
+        for opt in opts:
+            if opt not in subset.opts:
+                print('# {}: no weights for \'{}\', skipped'.format(path, opt))
+                continue
+            opt_ind = subset.opts.index(opt)
+            results = []
+            for counter in TOTAL_COUNTERS:
+                if counter not in ds:
+                    continue
+                values = []
+                for name in subset.names:
+                    rows = ds.select(name=name) if 'opt' not in ds or opt is None else \
+                           ds.select(name=name, opt=opt)
+                    if len(rows) == 0:
+                        error('\'{}\' has no results for \'{}\''.format(path, name))
+                    values.append(np.mean(ds[counter][rows]))
+                total = (subset.weights[counter][:, opt_ind] * np.array(values)).sum()
+                results.append('{} {}'.format(counter, fmt_counter(counter, total)))
+            print('{} ({}): estimated total: {}'.format(path, opt or '-', ', '.join(results)))
+
+def main():
+    parser = argparse.ArgumentParser(description='select a representative subset of'
+                ' translation units or estimate total compile time using a subset')
+    parser.add_argument('inputs', nargs='+', metavar='INPUT',
+                help='benchmark results: CSV files, column store files or perf logs.'
+                     ' When selecting, the first one is used for selection and the'
+                     ' others for validation; with --estimate - results of the subset'
+                     ' ([OPT=]FILE)')
+    parser.add_argument('-k', '--size', type=int, default=50,
+                help='number of TUs to select (default: %(default)s)')
+    parser.add_argument('-e', '--error', type=float, metavar='PERCENT',
+                help='select the smallest subset (of a predefined series of sizes), whose'
+                     ' estimates are within PERCENT of the actual totals of the validation'
+                     ' datasets')
+    parser.add_argument('--seed', type=int, default=0,
+                help='random seed for clustering (default: %(default)s)')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'),
+                help='subset file (can be used with build_spec.py --subset)')
+    parser.add_argument('--estimate', metavar='SUBSET',
+                help='estimate total compile time using subset file and results of the'
+                     ' subset')
+    args = parser.parse_args()
+    if args.estimate:
+        run_estimate(args)
+        return
+    if args.output is None:
+        parser.error('output file (-o) is required')
+    if args.size < 1:
+        parser.error('--size must be positive')
+    run_select(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Simple statistics routines which do not require numpy (they are used by
+# build_spec.py, which should work with a minimal set of packages).
+
+import math
+
+class StatsError(Exception): pass
+
+def mean(values):
+    if not values:
+        raise StatsError('mean of empty sequence')
+    return float(sum(values)) / len(values)
+
+def stdev(values):
+    '''Sample standard deviation'''
+    if len(values) < 2:
+        raise StatsError('standard deviation requires at least two values')
+    m = mean(values)
+    return math.sqrt(sum((v - m) ** 2 for v in values) / (len(values) - 1))
+
+def median(values):
+    if not values:
+        raise StatsError('median of empty sequence')
+    data = sorted(values)
+    mid = len(data) // 2
+    if len(data) % 2:
+        return float(data[mid])
+    return (data[mid - 1] + data[mid]) / 2.0
+
+# Scale factor which makes MAD a consistent estimator of standard deviation
+MAD_SCALE = 1.4826
+
+def mad(values):
+    '''Median absolute deviation (scaled, i.e. comparable to stdev)'''
+    med = median(values)
+    return median([abs(v - med) for v in values]) * MAD_SCALE
+
+def norm_ppf(p):
+    '''Quantile function of the standard normal distribution (P. J. Acklam's
+       rational approximation, relative error is below 1.2e-9)'''
+    if not 0 < p < 1:
+        raise StatsError('probability must be in (0, 1)')
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00]
+    p_low = 0.02425
+    if p < p_low:
+        q = math.sqrt(-2 * math.log(p))
+        return (((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) / \
+               ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1)
+    if p > 1 - p_low:
+        return -norm_ppf(1 - p)
+    q = p - 0.5
+    r = q * q
+    return (((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5]) * q / \
+           (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1)
+
+def t_ppf(p, df):
+    '''Quantile function of Student's t distribution. Exact for df = 1, 2,
+       otherwise uses the Cornish-Fisher expansion (G. W. Hill, 1970), which
+       is accurate to about 0.1% for df >= 3'''
+    if df < 1:
+        raise StatsError('degrees of freedom must be positive')
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = norm_ppf(p)
+    z2 = z * z
+    g1 = (z2 + 1) * z / 4
+    g2 = ((5 * z2 + 16) * z2 + 3) * z / 96
+    g3 = (((3 * z2 + 19) * z2 + 17) * z2 - 15) * z / 384
+    g4 = ((((79 * z2 + 776) * z2 + 1482) * z2 - 1920) * z2 - 945) * z / 92160
+    return z + g1 / df + g2 / df ** 2 + g3 / df ** 3 + g4 / df ** 4
+
+def rel_ci(values, confidence=0.95):
+    '''Half-width of the confidence interval of the mean, relative to the
+       mean (e.g. 0.01 means +-1%)'''
+    if len(values) < 2:
+        return float('inf')
+    m = mean(values)
+    if m == 0:
+        return float('inf')
+    t = t_ppf(0.5 + confidence / 2, len(values) - 1)
+    return t * stdev(values) / math.sqrt(len(values)) / abs(m)
+
+def fit_line(xs, ys):
+    '''Least squares fit of y = a + b * x. Returns (a, b, residual sum of
+       squares)'''
+    if len(xs) < 2:
+        raise StatsError('fitting a line requires at least two points')
+    mx, my = mean(xs), mean(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if sxx == 0:
+        raise StatsError('fitting a line requires distinct x values')
+    b = sum((x - mx) * (y - my) for (x, y) in zip(xs, ys)) / sxx
+    a = my - b * mx
+    return a, b, sum((y - a - b * x) ** 2 for (x, y) in zip(xs, ys))
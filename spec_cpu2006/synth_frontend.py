@@ -0,0 +1,289 @@
+#!/usr/bin/env python2.7
+
+# Synthetic benchmarks which stress the C++ front end. Each family of
+# workloads is parameterized by its size n (template instantiation depth,
+# size of an overload set, number of specializations or included headers).
+# The 'generate' command writes a preprocessed TU for each family and size
+# into the preproc directory (synth.<family>/<family>_<n>.ii), so the
+# workloads are measured by build_spec.py (--shell or --run) just like SPEC
+# units.
+#
+# The 'analyze' command reads the measurements (a log or CSV file produced
+# by convert_result.py), fits the mean value of a counter at each size to
+# the models a + b * f(n), where f(n) is n, n log n or n^2, and flags the
+# families whose compile time grows super-linearly. A super-linear model is
+# preferred to the linear one only if it fits significantly better (see
+# --margin), because the models are hard to tell apart on a narrow range of
+# sizes.
+
+from __future__ import print_function
+
+# System modules
+import re
+import os, os.path
+import sys
+import csv
+import math
+import argparse
+
+# Local modules
+import perf_report
+import stats
+
+def error(msg):
+    '''Print error message to stderr and exit with non-zero status'''
+    sys.stderr.write('Error: {}\n'.format(msg))
+    sys.exit(1)
+
+# Benchmark (directory) name of a family: BENCH_PREFIX + family
+BENCH_PREFIX        = 'synth.'
+UNIT_RE             = re.compile(r'^([a-z_]+)_(\d+)\.ii$')
+# Default -ftemplate-depth of GCC
+MAX_TEMPLATE_DEPTH  = 900
+DEFAULT_COUNTERS    = ['task-clock', 'instructions']
+DEFAULT_MARGIN      = 2.0
+NOISE_COLUMN        = 'noise'
+
+def gen_template_depth(n):
+    '''Recursive class template instantiated n levels deep'''
+    return ('# 1 "template_depth.cc"\n'
+            'template <int N> struct depth {\n'
+            '    typedef typename depth<N - 1>::type type;\n'
+            '    static int value() { return depth<N - 1>::value() + 1; }\n'
+            '};\n'
+            'template <> struct depth<0> {\n'
+            '    typedef int type;\n'
+            '    static int value() { return 0; }\n'
+            '};\n'
+            'depth<%d>::type depth_result() { return depth<%d>::value(); }\n' % (n, n))
+
+def gen_overloads(n):
+    '''Overload set of n functions, each overload is called once'''
+    lines = ['# 1 "overloads.cc"\n']
+    lines += ['struct arg_%d { };\n' % i for i in range(n)]
+    lines += ['int f(arg_%d) { return %d; }\n' % (i, i) for i in range(n)]
+    lines.append('int overload_result() {\n    int sum = 0;\n')
+    lines += ['    sum += f(arg_%d());\n' % i for i in range(n)]
+    lines.append('    return sum;\n}\n')
+    return ''.join(lines)
+
+def gen_specializations(n):
+    '''Class template with n explicit specializations, each one is used'''
+    lines = ['# 1 "specializations.cc"\n',
+             'template <int N> struct spec { static int value() { return -1; } };\n']
+    lines += ['template <> struct spec<%d> { static int value() { return %d; } };\n' % (i, i)
+              for i in range(n)]
+    lines.append('int spec_result() {\n    int sum = 0;\n')
+    lines += ['    sum += spec<%d>::value();\n' % i for i in range(n)]
+    lines.append('    return sum;\n}\n')
+    return ''.join(lines)
+
+def gen_includes(n):
+    '''n included headers (expanded, with line markers as produced by the
+       preprocessor), each one declares a namespace with a class and a
+       function, which are used by the main file'''
+    lines = ['# 1 "includes.cc"\n']
+    for i in range(n):
+        lines.append('# 1 "include_%d.h" 1\n'
+                     'namespace ns_%d {\n'
+                     'struct type {\n'
+                     '    int member;\n'
+                     '    int get() const { return member + %d; }\n'
+                     '};\n'
+                     'inline int use(const type &t) { return t.get(); }\n'
+                     '}\n'
+                     '# %d "includes.cc" 2\n' % (i, i, i, i + 2))
+    lines.append('int include_result() {\n    int sum = 0;\n')
+    lines += ['    sum += ns_%d::use(ns_%d::type());\n' % (i, i) for i in range(n)]
+    lines.append('    return sum;\n}\n')
+    return ''.join(lines)
+
+# Families: name -> (generator, default sizes)
+FAMILIES = {
+    'template_depth':   (gen_template_depth,  [50, 100, 200, 400, 800]),
+    'overloads':        (gen_overloads,       [250, 500, 1000, 2000, 4000]),
+    'specializations':  (gen_specializations, [500, 1000, 2000, 4000, 8000]),
+    'includes':         (gen_includes,        [250, 500, 1000, 2000, 4000]),
+}
+
+def unit_name(family, n):
+    return '{}_{:06d}.ii'.format(family, n)
+
+def parse_unit(name):
+    '''Parse workload name (bench/file). Returns (family, n) or None, if it
+       is not a synthetic workload'''
+    bench, _, fname = name.partition('/')
+    if not bench.startswith(BENCH_PREFIX):
+        return None
+    match = UNIT_RE.match(fname)
+    if not match or match.group(1) != bench[len(BENCH_PREFIX):]:
+        return None
+    return (match.group(1), int(match.group(2)))
+
+def generate(args):
+    preproc_dir = args.output
+    if preproc_dir is None:
+        try:
+            import config
+        except ImportError:
+            error('config.py not found (create it or use --output)')
+        preproc_dir = os.path.join(config.WORK_PATH, 'preproc')
+    for family in args.families:
+        gen_func, sizes = FAMILIES[family]
+        sizes = args.sizes or sizes
+        if family == 'template_depth' and max(sizes) >= MAX_TEMPLATE_DEPTH:
+            error('template_depth size must be less than {} (the default'
+                  ' -ftemplate-depth)'.format(MAX_TEMPLATE_DEPTH))
+        bench_dir = os.path.join(preproc_dir, BENCH_PREFIX + family)
+        if os.path.isdir(bench_dir):
+            # Remove units of sizes, which are not generated this time
+            for fname in os.listdir(bench_dir):
+                if UNIT_RE.match(fname):
+                    os.remove(os.path.join(bench_dir, fname))
+        else:
+            os.makedirs(bench_dir)
+        for n in sizes:
+            path = os.path.join(bench_dir, unit_name(family, n))
+            with open(path, 'w') as f:
+                f.write(gen_func(n))
+            print('{} ({} bytes)'.format(path, os.path.getsize(path)))
+
+def read_measurements(path, counters):
+    '''Read measurements of synthetic workloads from a log or CSV file
+       (runs marked as disturbed by convert_result.py --noise mark are
+       skipped). Returns dictionary: (family, counter) -> {n -> list of
+       values}'''
+    result = {}
+    def add(name, values):
+        unit = parse_unit(name or '')
+        if unit is None:
+            return
+        for (counter, value) in zip(counters, values):
+            if value is not None:
+                result.setdefault((unit[0], counter), {}).setdefault(unit[1], []).append(value)
+    with open(path, 'r') as f:
+        if path.endswith('.csv'):
+            reader = csv.reader(f)
+            header = next(reader, [])
+            index = dict((k, i) for (i, k) in enumerate(header))
+            if 'name' not in index:
+                raise ValueError('\'{}\' has no \'name\' column'.format(path))
+            noise_col = index.get(NOISE_COLUMN)
+            columns = [index.get(c) for c in counters]
+            for row in reader:
+                if not row or (noise_col is not None and row[noise_col]):
+                    continue
+                add(row[index['name']], [None if col is None or row[col] == ''
+                                         else float(row[col]) for col in columns])
+        else:
+            for run in perf_report.iter_runs(f):
+                add(run.name, [run.get_value(c) for c in counters])
+    return result
+
+# Complexity models: (name, f(n))
+MODELS = [('n', lambda n: n), ('n log n', lambda n: n * math.log(n)),
+          ('n^2', lambda n: n * n)]
+
+class Fit(object):
+    '''Result of fitting the measurements of a family'''
+    __slots__ = ('family', 'counter', 'sizes', 'means', 'model', 'a', 'b', 'r2', 'exponent')
+
+    @property
+    def superlinear(self):
+        return self.model != MODELS[0][0]
+
+def fit_family(family, counter, samples, margin=DEFAULT_MARGIN):
+    '''Fit the mean values (samples - dictionary: n -> list of values) to the
+       models. Returns Fit or None, if there are less than 3 sizes'''
+    sizes = sorted(samples)
+    if len(sizes) < 3:
+        return None
+    means = [stats.mean(samples[n]) for n in sizes]
+    fits = []
+    for (name, func) in MODELS:
+        a, b, rss = stats.fit_line([func(n) for n in sizes], means)
+        fits.append((name, a, b, rss))
+    linear = fits[0]
+    # The compile time can not decrease with the size
+    candidates = [f for f in fits[1:] if f[2] > 0 and f[3] * margin < linear[3]]
+    best = min(candidates, key=lambda f: f[3]) if candidates else linear
+    result = Fit()
+    result.family, result.counter = family, counter
+    result.sizes, result.means = sizes, means
+    result.model, result.a, result.b = best[:3]
+    total = sum((m - stats.mean(means)) ** 2 for m in means)
+    result.r2 = 1 - best[3] / total if total > 0 else 1.0
+    # Growth between the two largest sizes: value ~ n^exponent
+    result.exponent = None
+    if means[-2] > 0 and means[-1] > 0:
+        result.exponent = math.log(means[-1] / means[-2]) / math.log(float(sizes[-1]) / sizes[-2])
+    return result
+
+def analyze(args):
+    try:
+        measurements = read_measurements(args.input, args.counters)
+    except (IOError, ValueError, perf_report.ReportError) as ex:
+        error(str(ex))
+    if not measurements:
+        error('no synthetic workloads found in \'{}\''.format(args.input))
+    print('{:<16} {:<13} {:>16} {:>8} {:>12} {:>12} {:>7} {:>9}'.format(
+            'family', 'counter', 'sizes', 'model', 'a', 'b', 'R^2', 'exponent'))
+    flagged = 0
+    for (family, counter) in sorted(measurements):
+        fit = fit_family(family, counter, measurements[(family, counter)], args.margin)
+        if fit is None:
+            print('{:<16} {:<13} (less than 3 sizes measured)'.format(family, counter))
+            continue
+        sizes = '{}..{} ({})'.format(fit.sizes[0], fit.sizes[-1], len(fit.sizes))
+        exponent = '' if fit.exponent is None else '{:.2f}'.format(fit.exponent)
+        print('{:<16} {:<13} {:>16} {:>8} {:>12.5g} {:>12.5g} {:>7.4f} {:>9}{}'.format(
+                family, counter, sizes, fit.model, fit.a, fit.b, fit.r2, exponent,
+                '  SUPER-LINEAR' if fit.superlinear else ''))
+        flagged += fit.superlinear
+    if flagged:
+        print('{} super-linear fit(s)'.format(flagged))
+
+def parse_sizes(s):
+    try:
+        sizes = sorted(set(int(v) for v in s.split(',') if v.strip()))
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid list of sizes: \'{}\''.format(s))
+    if not sizes or sizes[0] < 1:
+        raise argparse.ArgumentTypeError('sizes must be positive')
+    return sizes
+
+def main():
+    parser = argparse.ArgumentParser(description='generate synthetic benchmarks which stress'
+                ' the C++ front end and analyze how their compile time scales')
+    subparsers = parser.add_subparsers(dest='command')
+
+    gen = subparsers.add_parser('generate', help='write preprocessed units')
+    gen.add_argument('-f', '--family', action='append', choices=sorted(FAMILIES),
+                dest='families', help='family of workloads (can be repeated, default: all)')
+    gen.add_argument('-s', '--sizes', type=parse_sizes,
+                help='comma-separated list of sizes (default: depends on the family)')
+    gen.add_argument('-o', '--output', metavar='DIR',
+                help='preproc directory (default: preproc in WORK_PATH from config.py)')
+    gen.set_defaults(func=generate)
+
+    an = subparsers.add_parser('analyze', help='fit measurements to complexity models')
+    an.add_argument('input', help='log or CSV file (produced by convert_result.py)')
+    an.add_argument('-c', '--counter', action='append', dest='counters',
+                help='counter to analyze (can be repeated, default: {})'.format(
+                     ', '.join(DEFAULT_COUNTERS)))
+    an.add_argument('--margin', type=float, default=DEFAULT_MARGIN,
+                help='a super-linear model is chosen only if its residual sum of squares'
+                ' is MARGIN times smaller than that of the linear one (default:'
+                ' %(default)s)')
+    an.set_defaults(func=analyze)
+    args = parser.parse_args()
+    if args.command == 'generate':
+        args.families = args.families or sorted(FAMILIES)
+    else:
+        args.counters = args.counters or DEFAULT_COUNTERS
+        if args.margin < 1:
+            parser.error('--margin must be at least 1')
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
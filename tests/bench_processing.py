@@ -0,0 +1,282 @@
+#!/usr/bin/env python2.7
+
+# This script benchmarks the result-processing toolchain (perf_report.py,
+# convert_result.py) on synthetic perf logs, so it does not need SPEC,
+# GCC or perf.
+#
+# The generated log mimics the output of the scripts generated by
+# build_spec.py: by default 31000 workloads, each one is measured 1 to 10
+# times (12 counters per run). Each case is run in a separate process, the
+# script reports its run time and peak memory usage (max RSS) and appends
+# the results to the history file together with the current git revision.
+# Results are compared with the last revision measured with the same
+# parameters; the exit status is non-zero if some case became slower (or
+# uses more memory) by more than --tolerance percent.
+
+from __future__ import print_function
+
+# System modules
+import os, os.path
+import sys
+import time
+import random
+import argparse
+import tempfile
+import platform
+import subprocess
+
+SELF_DIR = os.path.dirname(os.path.realpath(__file__))
+SPEC_DIR = os.path.join(os.path.dirname(SELF_DIR), 'spec_cpu2006')
+sys.path.insert(0, SPEC_DIR)
+
+# Local modules
+import perf_report
+import convert_result
+
+def error(msg):
+    '''Print error message to stderr and exit with non-zero status'''
+    sys.stderr.write('Error: {}\n'.format(msg))
+    sys.exit(1)
+
+DEFAULT_HISTORY = os.path.join(SELF_DIR, 'bench_history.csv')
+HISTORY_HEADER  = ['revision', 'date', 'python', 'workloads', 'runs', 'case',
+                   'seconds', 'max_rss_kb']
+
+BENCHMARKS = ['400.perlbench', '401.bzip2', '403.gcc', '429.mcf', '433.milc',
+              '444.namd', '445.gobmk', '447.dealII', '450.soplex', '453.povray',
+              '456.hmmer', '458.sjeng', '462.libquantum', '464.h264ref', '470.lbm',
+              '471.omnetpp', '473.astar', '482.sphinx3', '483.xalancbmk']
+
+# Counters and their approximate ratio to the number of cycles (the same set
+# as in bench_results/data)
+COUNTERS = [('task-clock', None), ('context-switches', 0), ('cpu-migrations', 0),
+            ('page-faults', None), ('cycles', 1.0), ('stalled-cycles-frontend', 0.4),
+            ('instructions', 1.4), ('branches', 0.3), ('branch-misses', 0.006),
+            ('L1-dcache-loads', 0.38), ('L1-dcache-load-misses', 0.015),
+            ('LLC-loads', 0.004)]
+
+def generate_log(path, num_workloads, min_repeat, max_repeat, seed):
+    '''Write synthetic log, return the number of runs'''
+    rng = random.Random(seed)
+    num_runs = 0
+    per_bench = (num_workloads + len(BENCHMARKS) - 1) // len(BENCHMARKS)
+    with open(path, 'w') as log:
+        for ind in range(num_workloads):
+            bench = BENCHMARKS[ind // per_bench]
+            if ind % per_bench == 0:
+                log.write('# {}\n'.format(bench))
+            workload = '{}/unit_{}.i'.format(bench, ind)
+            # Log-normal distribution of compile times, 5 ms to several seconds
+            base_cycles = int(3.5e6 * min(20000, 5 * rng.lognormvariate(2, 1.2)))
+            faults = rng.randint(1000, 30000)
+            for _ in range(rng.randint(min_repeat, max_repeat)):
+                cycles = int(base_cycles * rng.uniform(0.98, 1.05))
+                msec = cycles / 3.5e6
+                log.write('# WORKLOAD: {}\n'
+                          '# started on Mon Jan  1 00:00:00 2016\n\n'.format(workload))
+                for (name, ratio) in COUNTERS:
+                    if name == 'task-clock':
+                        value = '{:f}'.format(msec)
+                    elif name == 'page-faults':
+                        value = str(faults + rng.randint(0, 20))
+                    elif ratio == 0:
+                        value = '1' if rng.random() < 0.005 else '0'
+                    else:
+                        value = str(int(cycles * ratio))
+                    log.write('{},,{},{},100.00\n'.format(value, name, int(msec * 1e6)))
+                log.write('<not supported>,,LLC-load-misses,0,100.00\n')
+                num_runs += 1
+    return num_runs
+
+# Benchmark cases. Each one is a function which accepts the log path and
+# returns the number of processed items
+
+def case_report_line(path):
+    '''Parse counter lines with ReportLine'''
+    count = 0
+    with open(path, 'r') as f:
+        for line in f:
+            if line[0] not in '#\n':
+                perf_report.ReportLine(line, ',')
+                count += 1
+    return count
+
+def case_iter_runs(path):
+    '''Stream runs and read a counter of each one'''
+    count = 0
+    with open(path, 'r') as f:
+        for run in perf_report.iter_runs(f):
+            run.get_value('task-clock')
+            count += 1
+    return count
+
+def case_perf_report(path):
+    '''Load the whole log into PerfReport'''
+    with open(path, 'r') as f:
+        report = perf_report.PerfReport(f)
+    return len(report)
+
+def case_convert_stream(path):
+    '''Convert the log with convert_result.process_stream'''
+    with open(path, 'r') as src:
+        with open(os.devnull, 'w') as dest:
+            convert_result.process_stream(src, dest)
+    return 1
+
+def case_convert_file(path):
+    '''Convert the log in the same way as convert_result.py FILE OUTPUT'''
+    with open(os.devnull, 'w') as dest:
+        convert_result.aggregate([(path, os.path.basename(path))], dest, 1)
+    return 1
+
+CASES = [('report_line', case_report_line),
+         ('iter_runs', case_iter_runs),
+         ('perf_report', case_perf_report),
+         ('convert_stream', case_convert_stream),
+         ('convert_file', case_convert_file)]
+
+def run_case(name, path):
+    '''Body of the child process: run the case, print elapsed time'''
+    func = dict(CASES)[name]
+    start = time.time()
+    count = func(path)
+    print('{!r} {}'.format(time.time() - start, count))
+
+def measure(name, path):
+    '''Run case in a child process. Return (seconds, max RSS in kB)'''
+    proc = subprocess.Popen([sys.executable, os.path.realpath(__file__), '--case', name, path],
+                            stdout=subprocess.PIPE)
+    output = proc.stdout.read()
+    proc.stdout.close()
+    # Use wait4 to get resource usage of this particular child
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = status
+    if status != 0:
+        error('case \'{}\' failed'.format(name))
+    return float(output.split()[0]), usage.ru_maxrss
+
+def git_revision():
+    '''Current git revision ("+" is appended if the tree has local changes)'''
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                           cwd=SELF_DIR).decode().strip()
+        changes = subprocess.check_output(['git', 'status', '--porcelain',
+                                           '--untracked-files=no'], cwd=SELF_DIR)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return revision + ('+' if changes.strip() else '')
+
+def load_history(path):
+    '''Return list of dictionaries (one per history line)'''
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        lines = [line.rstrip('\n').split(',') for line in f if line.strip()]
+    return [dict(zip(HISTORY_HEADER, line)) for line in lines[1:]]
+
+def save_history(path, entries):
+    is_new = not os.path.exists(path)
+    with open(path, 'a') as f:
+        if is_new:
+            f.write(','.join(HISTORY_HEADER) + '\n')
+        for entry in entries:
+            f.write(','.join(str(entry[k]) for k in HISTORY_HEADER) + '\n')
+
+def previous_result(history, entry):
+    '''The last result of the same case with the same parameters, measured
+       at a different revision (None if there is no such result)'''
+    for old in reversed(history):
+        if old['revision'] != entry['revision'] and \
+                all(old[k] == str(entry[k]) for k in ['python', 'workloads', 'runs', 'case']):
+            return old
+    return None
+
+def run(args):
+    cases = [name for (name, _) in CASES
+             if not args.cases or name in args.cases]
+    tmp_dir = tempfile.mkdtemp(prefix='bench-processing-')
+    log_path = os.path.join(tmp_dir, 'log.txt')
+    try:
+        print('Generating log: {} workloads, {} to {} repeats'.format(
+                args.workloads, args.min_repeat, args.max_repeat))
+        num_runs = generate_log(log_path, args.workloads, args.min_repeat,
+                                args.max_repeat, args.seed)
+        print('{} runs, {:.1f} MB'.format(num_runs, os.path.getsize(log_path) / 2.0 ** 20))
+        revision = git_revision()
+        history = load_history(args.history)
+        entries = []
+        regressions = []
+        print('{:<16} {:>10} {:>12} {:>10}  {}'.format('case', 'time, s', 'runs/s',
+                                                      'RSS, MB', 'previous'))
+        for name in cases:
+            results = [measure(name, log_path) for _ in range(args.repeat)]
+            seconds = min(r[0] for r in results)
+            max_rss = min(r[1] for r in results)
+            entry = {'revision': revision, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                     'python': platform.python_version(), 'workloads': args.workloads,
+                     'runs': num_runs, 'case': name, 'seconds': '{:.4f}'.format(seconds),
+                     'max_rss_kb': max_rss}
+            old = previous_result(history, entry)
+            note = ''
+            if old is not None:
+                time_ratio = seconds / float(old['seconds'])
+                rss_ratio = max_rss / float(old['max_rss_kb'])
+                note = '{}: time {:+.1%}, RSS {:+.1%}'.format(old['revision'], time_ratio - 1,
+                                                            rss_ratio - 1)
+                limit = 1 + args.tolerance / 100.0
+                if time_ratio > limit or rss_ratio > limit:
+                    note += ' REGRESSION'
+                    regressions.append(name)
+            print('{:<16} {:>10.3f} {:>12.0f} {:>10.1f}  {}'.format(
+                    name, seconds, num_runs / seconds, max_rss / 1024.0, note))
+            entries.append(entry)
+    finally:
+        os.remove(log_path)
+        os.rmdir(tmp_dir)
+    if not args.no_save:
+        save_history(args.history, entries)
+        print('Results saved to \'{}\' (revision {})'.format(args.history, revision))
+    if regressions:
+        error('regressions detected: {}'.format(', '.join(regressions)))
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--case':
+        run_case(sys.argv[2], sys.argv[3])
+        return
+    parser = argparse.ArgumentParser(description='benchmark processing of perf logs'
+                ' (perf_report.py, convert_result.py) using synthetic data')
+    parser.add_argument('cases', nargs='*', metavar='CASE',
+                help='cases to run: {} (default: all)'.format(
+                    ', '.join(name for (name, _) in CASES)))
+    parser.add_argument('-w', '--workloads', type=int, default=31000,
+                help='number of workloads (default: %(default)s)')
+    parser.add_argument('--min-repeat', type=int, default=1,
+                help='minimal number of runs of a workload (default: %(default)s)')
+    parser.add_argument('--max-repeat', type=int, default=10,
+                help='maximal number of runs of a workload (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0,
+                help='random seed used for generating the log (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                help='run each case several times, report the best result'
+                     ' (default: %(default)s)')
+    parser.add_argument('--history', default=DEFAULT_HISTORY,
+                help='history file (default: %(default)s)')
+    parser.add_argument('--no-save', action='store_true',
+                help='do not append the results to the history file')
+    parser.add_argument('--tolerance', type=float, default=10.0, metavar='PERCENT',
+                help='maximal allowed slowdown or memory usage increase compared to'
+                     ' the previous revision (default: %(default)s)')
+    args = parser.parse_args()
+    for name in args.cases:
+        if name not in dict(CASES):
+            parser.error('unknown case \'{}\''.format(name))
+    if args.workloads < len(BENCHMARKS):
+        parser.error('--workloads must be at least {}'.format(len(BENCHMARKS)))
+    if not 1 <= args.min_repeat <= args.max_repeat:
+        parser.error('--min-repeat must be positive and must not exceed --max-repeat')
+    if args.repeat < 1:
+        parser.error('--repeat must be positive')
+    run(args)
+
+if __name__ == '__main__':
+    main()
@@ -33,6 +33,19 @@ if check --gcc --preprocess; then
     check --shell
     check --cxx98
     check -r 3
+    check --gcc --preprocess -j 2
+    check --checksums --manifest "${TMPDIR:-/tmp}/checksums.md5"
+    check --checksums --baseline "${TMPDIR:-/tmp}/checksums.md5" --stop-on-diff
+    check --run --cpus 0 --log /dev/null
+    check --run --cpus 0 --log "${TMPDIR:-/tmp}/log.txt" --adaptive --max-repeat 3
+    rm -f "${TMPDIR:-/tmp}/journal_log.txt" "${TMPDIR:-/tmp}/journal_log.txt.journal"
+    check --run --cpus 0 --log "${TMPDIR:-/tmp}/journal_log.txt" --journal
+    check --run --cpus 0 --log "${TMPDIR:-/tmp}/journal_log.txt" --journal -r 2
+    printf '"name"\n"429.mcf/mcf.i"\n' > "${TMPDIR:-/tmp}/subset.csv"
+    check --subset "${TMPDIR:-/tmp}/subset.csv"
+    check --run --cpus 0 --log /dev/null --subset "${TMPDIR:-/tmp}/subset.csv"
+    check --run --cpus 0 --log /dev/null --subset "${TMPDIR:-/tmp}/subset.csv" \
+          --sweep-opt O0 --sweep-opt 'O2 g' --sweep-alloc ptmalloc --sweep-alloc tcmalloc --seed 1
     check --with-gcc "${HOME}/gcc/build/gcc"
 
     check --alloc=ptmalloc
@@ -41,7 +54,32 @@ if check --gcc --preprocess; then
 
     check -v
     check --mem-report
+    check --time-report --mem-report -r 2
+    check --run --cpus 0 --log /dev/null --time-report
+    check --run --cpus 0 --log /dev/null --calibrate 3
+    check --run --cpus 0 --log /dev/null --count-malloc --alloc tcmalloc
+    $SCRIPT --serve --listen 17450 --cpus 0 >/dev/null &
+    WORKER_PID=$!
+    sleep 1
+    check --run --workers localhost:17450 --log "${TMPDIR:-/tmp}/log.txt"
+    check --run --workers localhost:17450 --log /dev/null --costs "${TMPDIR:-/tmp}/log.txt"
+    kill ${WORKER_PID}
+    echo secret > "${TMPDIR:-/tmp}/secret"
+    $SCRIPT --serve --listen 17451 --cpus 0 --secret-file "${TMPDIR:-/tmp}/secret" >/dev/null &
+    WORKER_PID=$!
+    sleep 1
+    check --run --workers localhost:17451 --log /dev/null --secret-file "${TMPDIR:-/tmp}/secret"
+    kill ${WORKER_PID}
+    check --lto --cpus 0 --lto-jobs 1,2 --log /dev/null
     check -O 'O1 finline-functions fdump-tree-optimized --alloc tcmalloc'
+    # Code generated from compressed units must match the uncompressed ones
+    check --checksums --manifest "${TMPDIR:-/tmp}/uncompressed.md5"
+    if check --gcc --preprocess --compress; then
+        check --shell
+        check --run --cpus 0 --log /dev/null
+        check --checksums --baseline "${TMPDIR:-/tmp}/uncompressed.md5"
+        check --gcc --preprocess
+    fi
 fi
 
 if check --clang --preprocess; then
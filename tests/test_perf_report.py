@@ -0,0 +1,64 @@
+#!/usr/bin/env python2.7
+
+# Tests of compiler report parsing in perf_report.py. The reports are
+# captured from real compilers (tests/data), so the script does not need
+# GCC.
+
+from __future__ import print_function
+
+# System modules
+import os, os.path
+import sys
+import unittest
+
+SELF_DIR = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(SELF_DIR, 'data')
+sys.path.insert(0, os.path.join(os.path.dirname(SELF_DIR), 'spec_cpu2006'))
+
+# Local modules
+import perf_report
+
+# GCC 8 format (from the comment in perf_report.py)
+OLD_REPORT = '''
+Execution times (seconds)
+ phase setup             :   0.01 ( 1%) usr   0.00 ( 0%) sys   0.01 ( 1%) wall    1201 kB ( 1%) ggc
+ phase parsing           :   0.20 (17%) usr   0.04 (29%) sys   0.24 (18%) wall   21453 kB (26%) ggc
+ TOTAL                 :   1.17             0.14             1.32              82313 kB
+'''.splitlines()
+
+def read_report(name):
+    with open(os.path.join(DATA_DIR, name)) as f:
+        return f.read().splitlines()
+
+class TimeReportTest(unittest.TestCase):
+    def test_combined_reports(self):
+        '''-ftime-report together with -fmem-report (GCC 12)'''
+        lines = read_report('gcc12_time_mem_report.txt')
+        passes = perf_report.parse_time_report(lines)
+        self.assertEqual(sorted(passes), sorted([
+                'phase setup', 'phase parsing', 'phase opt and generate',
+                'callgraph functions expansion', 'parser function body', 'combiner',
+                'integrated RA', 'TOTAL']))
+        self.assertEqual(passes['phase parsing'].wall, 0.01)
+        self.assertEqual(passes['phase setup'].ggc, 1326)
+        self.assertEqual(passes['parser function body'].ggc, 4176 / 1024.0)
+        self.assertEqual(passes['TOTAL'].usr, 0.01)
+        self.assertEqual(passes['TOTAL'].wall, 0.02)
+        self.assertEqual(passes['TOTAL'].ggc, 1537)
+        mem = perf_report.parse_mem_report(lines)
+        self.assertEqual(mem['Total allocated maps size'], 8184 / 1024.0)
+
+    def test_old_format(self):
+        passes = perf_report.parse_time_report(OLD_REPORT)
+        self.assertEqual(sorted(passes), ['TOTAL', 'phase parsing', 'phase setup'])
+        self.assertEqual(passes['phase parsing'].sys, 0.04)
+        self.assertEqual(passes['phase parsing'].ggc, 21453)
+        self.assertEqual(passes['TOTAL'].wall, 1.32)
+
+    def test_no_table(self):
+        lines = read_report('gcc12_time_mem_report.txt')
+        header = next(i for (i, line) in enumerate(lines) if line.startswith('Time variable'))
+        self.assertEqual(perf_report.parse_time_report(lines[:header]), {})
+
+if __name__ == '__main__':
+    unittest.main()